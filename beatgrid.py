@@ -0,0 +1,380 @@
+""" ************************************************************
+Offline beat detection for the Parable Sequencing Program
+
+Finds the beats of show music ahead of time, so show sequences can be
+kept on the beat of a song without anyone tapping it.  Each media file is
+decoded to mono (WAV files directly, anything else through ffmpeg), an
+onset strength envelope is taken from its spectral flux, the tempo from
+the envelope's autocorrelation, and the beats by dynamic programming
+(Ellis 2007): the best chain of onsets about one period apart.
+
+The result, a BeatGrid, is saved as XML next to the media
+(song.mp3 -> song.mp3.beats.xml) and is only recomputed when the media
+changes.  A BeatGrid can stand in for the Beatnik tap beat as the beat
+object of ControlList.scaleToBeat(), once told the clock time its media
+started playing (ControlBank's beatgrid command does this).
+
+NumPy is needed to analyze music, not to use saved beat grids.
+
+usage: python beatgrid.py <file.show.xml | media file | folder> [...]
+       folders are searched recursively for shows and music; all the
+       music found is analyzed in a process pool
+
+************************************************************ """
+
+import bisect
+import concurrent.futures
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import wave
+import xml.etree.ElementTree as ET  # XML support
+
+try:
+    import numpy as np  # needed to analyze music
+except ImportError:
+    np = None
+
+media_extensions = (".wav", ".mp3", ".ogg", ".flac", ".m4a", ".aac", ".wma")
+sample_rate = 22050  # music is analyzed at this rate
+frame_size = 2048  # samples per spectrum
+hop_size = 256  # samples between spectra (11.6 ms)
+
+
+def gridPath(media_path):
+    """ Path of the beat grid saved for a media file """
+    return media_path + ".beats.xml"
+
+
+class BeatGrid(object):
+    """ The beat times (seconds of media time) of a piece of music.  period is
+        the typical beat period.  media_start is the clock time (seconds, see
+        parclock) the media started playing, for the Beatnik style methods
+        used by ControlList's perpetual sync """
+
+    def __init__(self, media_path='', beats=None):
+        self.media_path = media_path
+        self.media_size = 0  # size and mtime of the media analyzed
+        self.media_mtime = 0.0
+        self.beats = []
+        self.period = 0.5
+        self.media_start = 0.0
+        if beats is not None:
+            self.setBeats(beats)
+
+    def setBeats(self, beats):
+        self.beats = [float(beat) for beat in beats]
+        if len(self.beats) > 1:
+            # the mean of the gaps near the median, so a missed beat does not count
+            gaps = sorted(b - a for a, b in zip(self.beats, self.beats[1:]))
+            median = gaps[len(gaps) // 2]
+            near = [gap for gap in gaps if abs(gap - median) < median / 4]
+            self.period = sum(near) / len(near)
+
+    def tempo(self):
+        """ Beats per minute """
+        return 60.0 / self.period
+
+    def isFresh(self):
+        """ Returns True if the media has not changed since it was analyzed """
+        try:
+            stat = os.stat(self.media_path)
+        except OSError:
+            return False
+        return stat.st_size == self.media_size and abs(stat.st_mtime - self.media_mtime) < 0.001
+
+    def nearestBeat(self, media_time):
+        """ The beat (media seconds) nearest media_time; beyond the grid the
+            first or last beat is extended by the period """
+        if len(self.beats) == 0:
+            return media_time
+        index = bisect.bisect_left(self.beats, media_time)
+        if index == 0:
+            first = self.beats[0]
+            return first - round((first - media_time) / self.period) * self.period
+        if index == len(self.beats):
+            last = self.beats[-1]
+            return last + round((media_time - last) / self.period) * self.period
+        before, after = self.beats[index - 1], self.beats[index]
+        return before if media_time - before <= after - media_time else after
+
+    def periodAt(self, media_time):
+        """ The beat period (seconds) around media_time """
+        index = bisect.bisect_right(self.beats, media_time)
+        if 0 < index < len(self.beats):
+            return self.beats[index] - self.beats[index - 1]
+        return self.period
+
+    # Beatnik methods, so a grid can be passed to ControlList.scaleToBeat()
+
+    def isReady(self):
+        return len(self.beats) > 1
+
+    def getPeriod(self):
+        return self.period
+
+    def isSimilarTo(self, reference_beat_period):
+        """ Returns True if the grid's period is similar to the passed beat period """
+        ratio = reference_beat_period / self.period
+        return .75 < ratio < 1.25
+
+    def getCorrectedBeatTime(self, reference_beat_time):
+        """ Returns the clock time (seconds) of the beat nearest the passed clock time """
+        if not self.isReady():
+            return reference_beat_time
+        return self.media_start + self.nearestBeat(reference_beat_time - self.media_start)
+
+    def save(self, file_path=None):
+        """ Saves the grid as XML (default: next to the media) """
+        root = ET.Element("BeatGrid")
+        root.set("media", os.path.basename(self.media_path))
+        root.set("media_size", str(self.media_size))
+        root.set("media_mtime", repr(self.media_mtime))
+        root.set("period", "{0:.6f}".format(self.period))
+        root.set("tempo", "{0:.3f}".format(self.tempo()))
+        for beat in self.beats:
+            ET.SubElement(root, "beat").set("time", "{0:.4f}".format(beat))
+        try:
+            ET.ElementTree(root).write(file_path or gridPath(self.media_path))
+        except OSError as e:
+            print("Error saving beat grid for {0}: {1}".format(self.media_path, e))
+
+    def load(self, file_path):
+        """ Loads a saved grid.  Returns False if it could not be read """
+        try:
+            root = ET.parse(file_path).getroot()
+        except (OSError, ET.ParseError) as e:
+            print("Error parsing beat grid {0}: {1}".format(file_path, e))
+            return False
+        self.media_size = int(root.get("media_size", "0"))
+        self.media_mtime = float(root.get("media_mtime", "0"))
+        self.setBeats(beat.get("time") for beat in root.iter("beat"))
+        self.period = float(root.get("period", str(self.period)))
+        return True
+
+
+def loadGrid(media_path):
+    """ The saved beat grid of a media file, or None if there is none or the
+        media has changed since """
+    path = gridPath(media_path)
+    if not os.path.exists(path):
+        return None
+    grid = BeatGrid(media_path)
+    if grid.load(path) and grid.isFresh():
+        return grid
+    return None
+
+
+# *********************** analysis ****************************
+
+
+def decode(media_path, rate=sample_rate):
+    """ Returns the media's audio as a mono float32 array at rate, or None.
+        8, 16 and 32 bit WAV files are read directly (resampled linearly),
+        anything else through ffmpeg """
+    if media_path.lower().endswith(".wav"):
+        try:
+            with wave.open(media_path, "rb") as wav:
+                dtype = {1: "u1", 2: "<i2", 4: "<i4"}.get(wav.getsampwidth())
+                if dtype is not None:
+                    samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=dtype).astype(np.float32)
+                    if dtype == "u1":
+                        samples -= 128.0
+                    samples = samples.reshape(-1, wav.getnchannels()).mean(axis=1)
+                    samples /= float(1 << (8 * wav.getsampwidth() - 1))
+                    if wav.getframerate() != rate:
+                        times = np.arange(int(len(samples) * rate / wav.getframerate())) / rate
+                        samples = np.interp(times, np.arange(len(samples)) / wav.getframerate(), samples)
+                    return samples.astype(np.float32)
+        except (wave.Error, EOFError) as e:
+            print("Error reading {0}: {1}".format(media_path, e))
+            return None
+
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        print("ffmpeg not found, cannot decode " + media_path)
+        return None
+    try:
+        pcm = subprocess.run([ffmpeg, "-v", "error", "-i", media_path, "-f", "s16le", "-ac", "1",
+                              "-ar", str(rate), "-"], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             check=True).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        print("Error decoding {0}: {1}".format(media_path, e))
+        return None
+    return (np.frombuffer(pcm, dtype="<i2") / 32768.0).astype(np.float32)
+
+
+def onsetEnvelope(samples, frame=frame_size, hop=hop_size):
+    """ Onset strength per hop: the spectral flux (summed rise of the log
+        magnitude spectrum) less its running mean, half wave rectified.
+        Being log compressed, an onset shows as soon as it enters the tail of
+        the window: value i is for an onset near sample i * hop + 3 * frame // 4 """
+    if len(samples) < frame:
+        return np.zeros(0, dtype=np.float32)
+    frames = np.lib.stride_tricks.sliding_window_view(samples, frame)[::hop]
+    spectra = np.abs(np.fft.rfft(frames * np.hanning(frame).astype(np.float32), axis=1))
+    spectra = np.log1p(1000.0 * spectra)
+    flux = np.maximum(np.diff(spectra, axis=0), 0.0).sum(axis=1)
+    flux = np.concatenate(([0.0], flux))
+
+    # subtract a running mean (about 0.4 seconds) so loud passages do not count as onsets
+    width = 33
+    kernel = np.ones(width) / width
+    flux = np.maximum(flux - np.convolve(flux, kernel, mode="same"), 0.0)
+    deviation = flux.std()
+    return flux / deviation if deviation > 0 else flux
+
+
+def estimatePeriod(envelope, env_rate, min_bpm=60.0, max_bpm=200.0, centre_bpm=120.0):
+    """ Beat period (in envelope values) from the envelope's autocorrelation,
+        weighted towards centre_bpm (a log normal one octave wide) """
+    count = len(envelope)
+    size = 1 << (2 * count - 1).bit_length()
+    spectrum = np.fft.rfft(envelope - envelope.mean(), size)
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum), size)[:count]
+
+    lags = np.arange(max(int(env_rate * 60.0 / max_bpm), 1), min(int(env_rate * 60.0 / min_bpm) + 1, count - 1))
+    if len(lags) == 0:
+        return env_rate * 60.0 / centre_bpm
+    bpm = 60.0 * env_rate / lags
+    weighted = autocorr[lags] * np.exp(-0.5 * np.log2(bpm / centre_bpm) ** 2)
+    best = int(np.argmax(weighted))
+
+    # parabolic interpolation between lags
+    lag = float(lags[best])
+    if 0 < best < len(lags) - 1:
+        left, mid, right = weighted[best - 1:best + 2]
+        bend = left - 2 * mid + right
+        if bend < 0:
+            lag += 0.5 * (left - right) / bend
+    return lag
+
+
+def trackBeats(envelope, period, tightness=100.0):
+    """ Indices of the beats in envelope: the chain of onsets that scores
+        best, each step scored by the onset strength less tightness times the
+        squared log of how far the gap is from period """
+    count = len(envelope)
+    if count == 0:
+        return []
+    offsets = np.arange(-int(round(2 * period)), -int(round(period / 2)) + 1)
+    penalty = -tightness * np.log(-offsets / period) ** 2
+    score = envelope.astype(np.float64)
+    backlink = np.full(count, -1)
+    for i in range(-offsets[-1], count):
+        start = max(i + offsets[0], 0)
+        window = score[start:i + offsets[-1] + 1] + penalty[start - i - offsets[0]:]
+        best = int(np.argmax(window))
+        if window[best] > 0:
+            score[i] += window[best]
+            backlink[i] = start + best
+
+    # end on the best scoring strong beat in the last period, then follow the links back
+    tail = max(count - int(round(period)), 0)
+    beat = tail + int(np.argmax(score[tail:]))
+    beats = []
+    while beat >= 0:
+        beats.append(beat)
+        beat = backlink[beat]
+    beats.reverse()
+
+    # drop leading and trailing beats on silence
+    threshold = 0.5 * np.sqrt(np.mean(envelope[beats] ** 2))
+    strong = [i for i, beat in enumerate(beats) if envelope[beat] > threshold]
+    return beats[strong[0]:strong[-1] + 1] if strong else beats
+
+
+def analyze(media_path, rate=sample_rate):
+    """ Finds the beats of a media file.  Returns a BeatGrid, or None if the
+        file could not be decoded """
+    if np is None:
+        print("NumPy is needed to analyze " + media_path)
+        return None
+    samples = decode(media_path, rate)
+    if samples is None:
+        return None
+    envelope = onsetEnvelope(samples)
+    env_rate = rate / hop_size
+    indices = trackBeats(envelope, estimatePeriod(envelope, env_rate))
+    grid = BeatGrid(media_path, [(i * hop_size + 3 * frame_size // 4) / rate for i in indices])
+    stat = os.stat(media_path)
+    grid.media_size = stat.st_size
+    grid.media_mtime = stat.st_mtime
+    return grid
+
+
+def analyzeAndSave(media_path):
+    """ analyze() and save the grid next to the media.  Runs in analyzeAll()'s
+        process pool, so it is a module level function.  Returns the grid """
+    grid = analyze(media_path)
+    if grid is not None:
+        grid.save()
+    return grid
+
+
+def analyzeAll(media_paths, processes=None, force=False):
+    """ Analyzes each media file that has no fresh saved grid (all of them if
+        force), in a pool of processes (None for one per CPU, 1 to analyze
+        serially).  Returns {media path: BeatGrid or None} """
+    grids = {}
+    jobs = []
+    for path in media_paths:
+        grid = None if force else loadGrid(path)
+        if grid is not None:
+            grids[path] = grid
+        elif path not in jobs:
+            jobs.append(path)
+
+    processes = processes or os.cpu_count() or 1
+    if processes > 1 and len(jobs) > 1:
+        try:
+            # spawn rather than fork, as BankCache does: the app runs threads
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=min(processes, len(jobs)), mp_context=multiprocessing.get_context("spawn")) as pool:
+                for path, grid in zip(jobs, pool.map(analyzeAndSave, jobs)):
+                    grids[path] = grid
+        except (OSError, NotImplementedError, ValueError, concurrent.futures.process.BrokenProcessPool) as e:
+            print("Beat analysis process pool failed, analyzing serially: " + str(e))
+    for path in jobs:
+        if path not in grids:
+            grids[path] = analyzeAndSave(path)
+    return grids
+
+
+def showMedia(show_file_path):
+    """ The media files played by a show """
+    import showlist  # here, so the analysis processes do not load VLC
+    show = showlist.read_show(show_file_path)
+    if show is None:
+        return []
+    music_root, events = show
+    return [music_root + ev.source for ev in events if ev.source != '']
+
+
+def findMedia(path):
+    """ The media files named by a path: a show file, a media file or a folder
+        holding either """
+    if os.path.isdir(path):
+        found = []
+        for root, dirs, files in os.walk(path):
+            for filename in sorted(files):
+                found.extend(findMedia(os.path.join(root, filename)))
+        return found
+    if path.endswith(".show.xml"):
+        return showMedia(path)
+    if path.lower().endswith(media_extensions):
+        return [path]
+    return []
+
+
+if __name__ == '__main__':
+    media = []
+    for arg in sys.argv[1:]:
+        media.extend(findMedia(arg))
+    for path, grid in sorted(analyzeAll(media).items()):
+        if grid is None:
+            print("{0}: not analyzed".format(path))
+        else:
+            print("{0}: {1:.1f} bpm, {2} beats".format(path, grid.tempo(), len(grid.beats)))
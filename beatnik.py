@@ -27,10 +27,89 @@ fDL = FinishedDataList -- this is a simple float (double) timing value, in secon
 Version 1.01 - receives optional tap time in BeatRecorder()
 Ver 3.0 - Python 3 & Trinity  7/2017
 
+Each TapBeat now follows the beat with a BeatTracker, a two state Kalman filter
+(time of the latest beat and the period), instead of averaging its tap window:
+a tap early or late by the tapper's jitter moves the beat a little, a tempo
+change moves it steadily, and the beat phase at any time is one division.
+
 """
 
-import time
 import math
+import parclock
+
+
+class BeatTracker(object):
+    """ Kalman filter over the beat: beat_time (clock seconds of the latest
+        beat) and period (seconds).  Each tap is matched to the predicted beat
+        nearest it; the difference moves both estimates by the filter gains,
+        which follow how sure the filter is of each against tap_jitter.
+        phase_wander and tempo_wander are how far, per beat, the player's beat
+        and tempo may move on their own (the process noise).
+
+        The estimates are plain attributes, so the phase, the next beat and
+        the nearest beat at any time are O(1) however long the taps go on """
+
+    tap_jitter = 0.02  # seconds, standard deviation of a tap about the beat
+    phase_wander = 0.001  # seconds per beat
+    tempo_wander = 0.001  # seconds of period per beat
+
+    def __init__(self):
+        self.taps = 0
+        self.beat_time = 0.0
+        self.period = 0.5
+        self.error = 0.0  # last tap minus the beat predicted for it (seconds)
+        self.var_time = 0.0  # covariance of (beat_time, period)
+        self.covar = 0.0
+        self.var_period = 0.0
+
+    def tap(self, tap_time):
+        """ Corrects the estimates with a tap.  Returns the tap's error
+            against the predicted beat (0 for the first two taps) """
+        self.taps += 1
+        jitter = self.tap_jitter ** 2
+        if self.taps == 1:
+            self.beat_time = tap_time
+            return 0.0
+        if self.taps == 2:
+            # the period is the difference of two taps
+            self.period = tap_time - self.beat_time
+            self.beat_time = tap_time
+            self.var_time = jitter
+            self.covar = jitter
+            self.var_period = 2 * jitter
+            return 0.0
+
+        # predict the beat the tap belongs to, some beats on from the last one
+        beats = max(round((tap_time - self.beat_time) / self.period), 1)
+        predicted = self.beat_time + beats * self.period
+        var_time = self.var_time + 2 * beats * self.covar + beats * beats * self.var_period \
+            + beats * self.phase_wander ** 2
+        covar = self.covar + beats * self.var_period
+        var_period = self.var_period + beats * self.tempo_wander ** 2
+
+        # correct by the tap
+        self.error = tap_time - predicted
+        total = var_time + jitter
+        gain_time = var_time / total
+        gain_period = covar / total
+        self.beat_time = predicted + gain_time * self.error
+        self.period += gain_period * self.error
+        self.var_time = (1 - gain_time) * var_time
+        self.covar = (1 - gain_time) * covar
+        self.var_period = var_period - gain_period * covar
+        return self.error
+
+    def phase(self, now):
+        """ Fraction of a beat (0 up to 1) since the last beat at clock time now """
+        return ((now - self.beat_time) / self.period) % 1.0
+
+    def nextBeat(self, now):
+        """ Clock time (seconds) of the first beat at or after now """
+        return self.beat_time + math.ceil((now - self.beat_time) / self.period) * self.period
+
+    def nearestBeat(self, when):
+        """ Clock time (seconds) of the beat nearest when """
+        return self.beat_time + round((when - self.beat_time) / self.period) * self.period
 
 
 class TapBeat(object):
@@ -40,6 +119,7 @@ class TapBeat(object):
         self.taps = []
         self.index = 0
         self.period = 5.00      # arbitrary start value - will be overwritten
+        self.tracker = BeatTracker()  # filtered beat time and period
 
         self.ready = False      # indicates the timing is reasonably accurate
         self.locked = False     # no more taps accepted for this object
@@ -53,12 +133,12 @@ class TapBeat(object):
         self.default_light_time = 0.06  # SET default beat light time HERE
         self.light_time = 0.06  # time that the beat light is on in seconds
         
-        time.time()             # start system time
+        parclock.now()         # start system time
 
     def tap(self, tapTime=None):
         """ Processes a tap and recalculated timing.
             Returns True if tap accepted, False if rejected (locked) """
-        now = time.time() if tapTime is None else tapTime
+        now = parclock.now() if tapTime is None else tapTime
         if not self.locked and self.tapIsLegal(now):
             # only collect the indicated amount of taps
             if self.index >= self.taps_to_count:
@@ -66,6 +146,7 @@ class TapBeat(object):
                 self.index = self.taps_to_count - 1
 
             self.taps.append(now)
+            self.tracker.tap(now)
             self.start_time = now  # use this as the new start time 
             self.index = self.index + 1
             print("INDEX: " + str(self.index))
@@ -88,9 +169,10 @@ class TapBeat(object):
             return True
 
     def calcPeriod(self):
-        """ calculates the beat period """
+        """ takes the beat period and start time from the tracker """
         if self.index > 1:
-            self.period = (self.taps[self.index - 1] - self.taps[0]) / float(self.index - 1)
+            self.period = self.tracker.period
+            self.start_time = self.tracker.beat_time
             if self.period < self.default_light_time / 3:
                 self.light_time = self.period / 3
             else:
@@ -105,10 +187,29 @@ class TapBeat(object):
 
     def nextBeatSecs(self):
         """ return a float, the number of seconds.ms until next beat """
-        now = time.time()
+        now = parclock.now()
         nextBeatTime = (math.ceil((now - self.start_time) / self.period) * self.period) + self.start_time
         return nextBeatTime - now
 
+    def nextBeatAt(self, now=None):
+        """ return the clock time (float seconds) of the next beat at or after now """
+        return self.tracker.nextBeat(parclock.now() if now is None else now)
+
+    def phase(self, now=None):
+        """ return the fraction of a beat since the last beat """
+        return self.tracker.phase(parclock.now() if now is None else now)
+
+    def nextLightChange(self):
+        """ return float seconds until light() next changes, or None if the light is not in use """
+        if self.index > 2:
+            phase = (parclock.now() - self.start_time) % self.period
+            if phase <= self.light_time:
+                return self.light_time - phase
+            else:
+                return self.period - phase
+        else:
+            return None
+
     def isReady(self):
         """ returns true if the tap beat may be used """
         return self.ready
@@ -121,8 +222,8 @@ class TapBeat(object):
         """ should the beat light be on or off? 1/10th second beat light assumed
             (old version toggled light every other beat) """
         if self.index > 2:
-            # return (math.ceil((time.time() - self.start_time) / self.period) % 2 != 0) ^ self.invert_light
-            return ((time.time() - self.start_time) % self.period) > self.light_time            
+            # return (math.ceil((parclock.now() - self.start_time) / self.period) % 2 != 0) ^ self.invert_light
+            return ((parclock.now() - self.start_time) % self.period) > self.light_time            
         else:
             return False
 
@@ -135,9 +236,14 @@ class TapBeat(object):
     def getPeriod(self):
         return self.period
 
+    def setPeriod(self, period):
+        self.period = period
+        self.tracker.period = period
+
     def setStartTime(self, new_start_time):
         """ used for aligning an existing tapBeat back to the start time """
         self.start_time = new_start_time
+        self.tracker.beat_time = new_start_time
 
     def getCorrectedBeatTime(self, reference_beat_time):
         """ return beat time for this object that is closest to the passed
@@ -171,7 +277,7 @@ class Beatnik(object):
             collector TapBeat object, promoting the collector to the
             player when it's ready """
         if tap_time is None or tap_time == 0.0:
-            now = time.time()
+            now = parclock.now()
         else:                
             now = tap_time
             
@@ -202,6 +308,11 @@ class Beatnik(object):
         """ When called, will analyze if it's time to turn the light on, or time to turn the light off. """
         return self.player.light() if self.collector is None or not self.collector.isReady() else self.collector.light()
 
+    def nextLightChange(self):
+        """ Returns float seconds until BeatLight() next changes, or None if it will not change on its own """
+        return self.player.nextLightChange() if self.collector is None or not self.collector.isReady() \
+            else self.collector.nextLightChange()
+
     def BeatLightToggle(self):
         """ Returns true ONLY if the state has changed """
         result = self.BeatLight() != self.cur_state            
@@ -211,12 +322,20 @@ class Beatnik(object):
 
     def nextBeatTime(self):
         """ returns float, number of seconds.milliseconds until next beat """
-        return self.player.nextBeatSecs() 
+        return self.player.nextBeatSecs()
+
+    def nextBeatAt(self, now=None):
+        """ returns the clock time (float seconds) of the next predicted beat at or after now """
+        return self.player.nextBeatAt(now)
+
+    def beatPhase(self, now=None):
+        """ returns the fraction of a beat (0 up to 1) since the last predicted beat """
+        return self.player.phase(now)
 
     def align(self, tap_time=None):
         """ realigns the player start time """
         if tap_time is None:
-            now = time.time()
+            now = parclock.now()
         else:
             now = tap_time
         if self.player.isReady():
@@ -247,4 +366,4 @@ class Beatnik(object):
 
     def setPeriod(self, period):
         """ Sets the period for the active tempo thingy """
-        self.player.period = float(period)
+        self.player.setPeriod(float(period))
@@ -0,0 +1,888 @@
+""" ************************************************************
+Benchmarks for the Parable Sequencing Program
+
+Synthetic timing runs for the loading and playback paths.  Each
+benchmark builds its own test data in a temporary folder.
+
+usage: python benchmarks.py <benchmark> [options]
+       python benchmarks.py -h  lists the benchmarks
+
+bankload - serial vs process pool parsing of a bank of .seqx files
+ethernet - writes, packets and bytes per chord for each Ethernet framing
+fanout   - Ethernet dispatch latency behind a slow GUI port, serial vs fan-out
+queues   - event throughput and latency: multiprocessing.Queue vs EventRing
+output   - event to wire latency: UI frame loop dispatch vs OutputDispatcher
+timeline - ControlList playback polling and seeking on the compiled timeline
+ports    - per event cost of ValvePort state updates and execute()
+bankswitch - bank switch and first trigger latency, resident memory: full parse vs header index
+overlay  - building randy() sequences and merging recorder layers: resort vs merge
+tempo    - cost of a tempo change mid-sequence: rewriting every event time vs the tempo map
+clock    - read cost and smallest step of each clock source (see parclock)
+player   - ParaPlayer start, end and loop callback latency against the fake VLC backend
+sync     - sequence position error against drifting media: start callback only vs MediaSync
+beats    - replays tap times (a file or a made up tapper) and reports the beat phase prediction error
+beatgrid - offline beat detection of made up songs: time serial vs process pool, and accuracy
+seqxload - loading one big .seqx file, time and peak memory: whole tree parse vs streaming
+
+************************************************************ """
+
+import argparse
+import io
+import contextlib
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import wave
+import xml.etree.ElementTree as ET
+from array import array
+import beatgrid
+import beatnik
+import fakevlc
+import paraplayer
+import parclasses
+import parclock
+import parthreads
+import parqueues
+import parstats
+import puffserver
+
+
+def syntheticSequence(num_events, num_channels=18, seed=None):
+    """ A ControlList of num_events on/off events on random channels, built
+        straight into the event columns (randy() is too slow for big banks) """
+    rand = random.Random(seed)
+    seq = parclasses.ControlList()
+    store = seq.events
+    store.clear()
+    frame_ns = parclasses.framesToNanos(1)
+    start = 0
+    for i in range(num_events // 2):
+        channel = rand.randint(1, num_channels)
+        store.add(start, start, 0, channel, 1)
+        store.add(start + 3 * frame_ns, start + 3 * frame_ns, 0, channel, 0)
+        start += rand.randint(0, 2) * frame_ns
+    store.sort()
+    return seq
+
+
+def makeBank(folder, num_files, num_events):
+    """ Writes num_files synthetic .seqx files into folder """
+    for i in range(num_files):
+        syntheticSequence(num_events, seed=i).saveXML(os.path.join(folder, "seq{0:04d}.seqx".format(i)))
+
+
+def timeBankLoad(folder, processes):
+    """ Seconds to parse folder with a cold BankCache using processes workers
+        (includes starting the pool), and seconds until the first sequence is ready """
+    cache = parthreads.BankCache(processes=processes, lazy=False)
+    first = []
+    start = time.perf_counter()
+    cache.get(folder, lambda seq: first or first.append(time.perf_counter()))
+    elapsed = time.perf_counter() - start
+    cache.shutdown()
+    return elapsed, first[0] - start
+
+
+def bankload(args):
+    folder = tempfile.mkdtemp(prefix="parbench")
+    try:
+        makeBank(folder, args.files, args.events)
+        devnull = open(os.devnull, "w")
+        results = []
+        for label, processes in (("serial", 1), ("parallel", args.processes)):
+            stdout, sys.stdout = sys.stdout, devnull  # loaders print each file name
+            try:
+                elapsed, first = timeBankLoad(folder, processes)
+            finally:
+                sys.stdout = stdout
+            results.append((label, elapsed, first))
+        devnull.close()
+
+        print("bankload: {0} files x {1} events, {2} CPUs".format(args.files, args.events, os.cpu_count()))
+        for label, elapsed, first in results:
+            print("  {0:8s} total {1:7.3f}s  first sequence {2:7.3f}s".format(label, elapsed, first))
+        print("  speedup {0:.2f}x (the pool is only used with more than one process)".format(results[0][1] / results[1][1]))
+    finally:
+        shutil.rmtree(folder)
+
+
+def ethernet(args):
+    print("ethernet: {0} chords of {1} channels on then off, 24 channel port{2}".format(
+        args.chords, args.width, ", writer thread" if args.threaded else ""))
+    for framing, capabilities in (("chx", ()), ("bnx", ("bnx",)), ("bin", ("bin", "bnx")), ("auto", ("bin", "bnx"))):
+        server = puffserver.PuffServer(capabilities=capabilities).start()
+        port = parclasses.ValvePort_Ethernet(24, 6, server.host, server.port, framing=framing, threaded=args.threaded)
+        port.execute()  # initial all-off
+        time.sleep(0.5 if args.threaded else 0.05)
+        server.reset()
+        port.writes = port.bytes_sent = port.collapsed = port.dropped = 0
+
+        frames = 0
+        elapsed = 0.0  # in execute() only, not the pacing below
+        for i in range(args.chords):
+            for value in (1, 0):
+                for ch in range(1, args.width + 1):
+                    port.setChannel(ch, value)
+                start = time.perf_counter()
+                port.execute()
+                elapsed += time.perf_counter() - start
+                frames += 1
+                while args.threaded and not port.out_q.empty():
+                    time.sleep(0)  # pace chords to the writer so none collapse
+        time.sleep(0.3 if args.threaded else 0.1)  # let the writer and server finish
+
+        correct = server.state(24) == [0] * 24
+        print("  {0:4s} ({1:3s}) writes/frame {2:5.2f}  bytes/frame {3:6.1f}  {4:6.1f}us/execute  server {5}{6}".format(
+            framing, port.frame_mode, port.writes / frames, port.bytes_sent / frames, elapsed / frames * 1e6,
+            server.summary(frames), "" if correct else "  STATE MISMATCH"))
+        if args.threaded:
+            print("       " + port.metrics())
+        port.close()
+        server.stop()
+
+
+class SlowGUIPort(parclasses.ValvePort):
+    """ Stands in for a GUI port whose redraw takes delay seconds """
+    thread_safe = False
+
+    def __init__(self, delay):
+        self.delay = delay
+        parclasses.ValvePort.__init__(self, 24, 6)
+
+    def execute(self):
+        time.sleep(self.delay)
+        parclasses.ValvePort.execute(self)
+
+
+def fanout(args):
+    print("fanout: {0} events, GUI port taking {1}ms per execute".format(args.events, args.delay))
+    ev = parclasses.ControlEvent()
+    for label, fan_out in (("serial", False), ("fan-out", True)):
+        server = puffserver.PuffServer().start()
+        gui = SlowGUIPort(args.delay / 1000.0)
+        ethernet = parclasses.ValvePort_Ethernet(24, 6, server.host, server.port, framing="bin")
+        bank = parclasses.ValvePortBank(24, 6, fan_out=fan_out)
+        bank.addPort(gui)  # the app adds its display ports first too
+        bank.addPort(ethernet)
+        for port in bank.ports:
+            bank.latency[port].reset()
+
+        for i in range(args.events):
+            ev.setValues(0, 0, i % 18 + 1, "on" if i % 2 == 0 else "off")
+            bank.setEventExec(ev)
+        bank.drain()
+        print("  {0}".format(label))
+        for line in bank.latencyReport().split("\n"):
+            print("    " + line)
+        bank.close()
+        ethernet.close()
+        server.stop()
+
+
+def queueRun(q, num_events, interval):
+    """ Sends num_events ControlEvents through q from a producer thread to this
+        thread, interval seconds apart (0: as fast as possible).  Returns
+        (events per second, LatencyStats of put to get) """
+    sent = [0] * num_events  # put times, by event number (carried in the channel field)
+    stats = parstats.LatencyStats("latency")
+
+    def produce():
+        ev = parclasses.ControlEvent()
+        ev.action = "on"
+        for i in range(num_events):
+            if interval:
+                time.sleep(interval)
+            ev.channel = i
+            sent[i] = time.perf_counter_ns()
+            q.put(ev)
+
+    producer = threading.Thread(target=produce)
+    start = time.perf_counter()
+    producer.start()
+    for i in range(num_events):
+        ev = q.get()
+        stats.record(time.perf_counter_ns() - sent[ev.channel])
+    elapsed = time.perf_counter() - start
+    producer.join()
+    return num_events / elapsed, stats
+
+
+def queues(args):
+    print("queues: {0} events flat out, {1} events at 1 kHz".format(args.events, args.paced))
+    for label, make in (("multiprocessing.Queue", lambda: parqueues.eventQueue("process")),
+                        ("EventRing", lambda: parqueues.eventQueue("thread"))):
+        rate, burst = queueRun(make(), args.events, 0)
+        rate2, paced = queueRun(make(), args.paced, 0.001)
+        print("  {0:22s} {1:9.0f} events/s  paced {2}".format(label, rate, paced.summary()))
+
+
+def outputRun(dispatch_thread, num_events, interval, frame_rate, busy):
+    """ Plays num_events toggles (18 channels, interval seconds apart) into an
+        EventRing and fires them at a stand-in Puff server, either from a
+        simulated UI frame loop (frame_rate Hz, up to busy seconds of layout
+        work per frame) or from an OutputDispatcher.  Returns a LatencyStats of
+        due time to the server receiving the change """
+    server = puffserver.PuffServer(log=True, clock=parclock.nowNanos).start()
+    ethernet = parclasses.ValvePort_Ethernet(24, 6, server.host, server.port, framing="bin", threaded=True)
+    bank = parclasses.ValvePortBank(24, 6)
+    bank.addPort(ethernet)
+    bank.execute()
+    ring = parqueues.EventRing()
+    time.sleep(0.3)  # connected and negotiated
+
+    due = []  # (due ns, channel, value) in play order
+    start = parclock.nowNanos() + 50000000
+    for i in range(num_events):
+        channel = i % 18 + 1
+        due.append((start + int(i * interval * 1e9), channel, (i // 18 + 1) % 2))
+
+    def produce():
+        ev = parclasses.ControlEvent()
+        for due_ns, channel, value in due:
+            while parclock.nowNanos() < due_ns:
+                time.sleep(0.0002)
+            ev.time.nanos = due_ns
+            ev.channel = channel
+            ev.action = "on" if value else "off"
+            ring.put(ev)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    if dispatch_thread:
+        dispatcher = parthreads.OutputDispatcher(bank, [ring]).start()
+        producer.join()
+        time.sleep(0.1)
+        dispatcher.stop()
+    else:
+        rand = random.Random(1)
+        while producer.is_alive() or not ring.empty():
+            frame_start = time.perf_counter()
+            while not ring.empty():
+                bank.setEventExec(ring.get())
+            time.sleep(rand.uniform(0, busy))  # widget layout and drawing
+            time.sleep(max(0.0, 1.0 / frame_rate - (time.perf_counter() - frame_start)))
+    time.sleep(0.2)
+    ethernet.close()
+    server.stop()
+
+    # match the server's changes to the events that caused them, per channel in order
+    stats = parstats.LatencyStats("event to wire")
+    expected = {}
+    for due_ns, channel, value in due:
+        expected.setdefault(channel, []).append(due_ns)
+    for received, channel, value in server.log:
+        if expected.get(channel):
+            stats.record(received - expected[channel].pop(0))
+    return stats
+
+
+def output(args):
+    print("output: {0} events {1}ms apart, UI loop at {2} Hz with up to {3}ms layout per frame".format(
+        args.events, args.interval, args.fps, args.busy))
+    for label, dispatch_thread in (("UI frame loop", False), ("OutputDispatcher", True)):
+        stats = outputRun(dispatch_thread, args.events, args.interval / 1000.0, args.fps, args.busy / 1000.0)
+        print("  {0:17s} {1}".format(label, stats.summary()))
+
+
+def timeline(args):
+    seq = syntheticSequence(args.events, seed=3)
+    num_events = len(seq.events)
+    start = time.perf_counter()
+    seq.timeline()
+    compile_time = time.perf_counter() - start
+
+    # play through with a simulated clock, polling four times a frame
+    poll_step = parclasses.framesToNanos(1) // 4
+    polls = 0
+    now = parclasses.TimeCode(0)
+    seq.start(now)
+    start = time.perf_counter()
+    while seq.running():
+        polls += 1
+        if not isinstance(seq.getNextByTime(now), parclasses.ControlEvent):
+            now.nanos += poll_step
+    play_time = time.perf_counter() - start
+
+    rand = random.Random(1)
+    end = seq.events.time[num_events - 1]
+    targets = [rand.randint(0, end) / parclasses.NS_PER_SECOND for i in range(args.seeks)]
+    start = time.perf_counter()
+    for target in targets:
+        seq.getEventAtTime(target)
+    seek_time = time.perf_counter() - start
+
+    print("timeline: {0} events, {1} steps".format(num_events, len(seq.timeline())))
+    print("  compile        {0:8.3f}ms".format(compile_time * 1e3))
+    print("  getNextByTime  {0:8.2f}us/poll ({1} polls)".format(play_time / polls * 1e6, polls))
+    print("  getEventAtTime {0:8.2f}us/seek".format(seek_time / len(targets) * 1e6))
+
+
+class NullLight(object):
+    """ Stands in for a Kivy ChannelLight """
+    def on(self):
+        pass
+
+    def off(self):
+        pass
+
+
+def ports(args):
+    print("ports: {0} events, one channel change per execute".format(args.events))
+    parallel_port = parclasses.ValvePort_Parallel(24, 6)  # no hardware here: the bank loop only
+    kivy = parclasses.ValvePort_Kivy(24, 6, [NullLight() for i in range(24)])
+    ev = parclasses.ControlEvent()
+    for label, port in (("ValvePort", parclasses.ValvePort(24, 6)), ("Parallel", parallel_port), ("Kivy", kivy)):
+        start = time.perf_counter()
+        for i in range(args.events):
+            ev.setValues(0, 0, i % 18 + 1, "on" if i // 18 % 2 == 0 else "off")
+            port.setEventExec(ev)
+        elapsed = time.perf_counter() - start
+        print("  {0:10s} {1:6.2f}us/event".format(label, elapsed / args.events * 1e6))
+
+    seq = syntheticSequence(2000, seed=1)
+    ev.setValues(0, 0, 3, "on")
+    seq.keepState(ev)
+    seq.stop()  # stopped with a channel still on: atEnd() checks the channel state
+    start = time.perf_counter()
+    for i in range(args.events):
+        seq.atEnd()
+    print("  ControlList.atEnd {0:6.3f}us".format((time.perf_counter() - start) / args.events * 1e6))
+
+
+def residentBytes():
+    """ Current resident set size of this process (Linux), else the peak (Unix), else 0 """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def bankSwitchRun(folder, lazy, prefetch, results):
+    """ In a fresh process: loads folder as a bank with a cold BankCache, then
+        starts one sequence.  Puts (switch s, first start s, RSS growth bytes) on results """
+    devnull = open(os.devnull, "w")
+    sys.stdout = devnull  # loaders print each file name
+    before = residentBytes()
+    cache = parthreads.BankCache(processes=1, lazy=lazy)
+    start = time.perf_counter()
+    sequences = cache.get(folder)
+    for seq in sequences:
+        seq.reset()
+    switch = time.perf_counter() - start
+    rss = residentBytes() - before
+    target = sequences[len(sequences) // 2]
+    if prefetch:
+        cache.prefetch(target).result()
+    start = time.perf_counter()
+    target.start()
+    first = time.perf_counter() - start
+    cache.shutdown()
+    results.put((switch, first, rss))
+
+
+def bankswitch(args):
+    folder = tempfile.mkdtemp(prefix="parbench")
+    try:
+        makeBank(folder, args.files, args.events)
+        print("bankswitch: {0} files x {1} events".format(args.files, args.events))
+        context = multiprocessing.get_context("spawn")
+        for label, lazy, prefetch in (("full parse", False, False), ("index", True, False),
+                                      ("index+prefetch", True, True)):
+            results = context.Queue()
+            worker = context.Process(target=bankSwitchRun, args=(folder, lazy, prefetch, results))
+            worker.start()
+            switch, first, rss = results.get()
+            worker.join()
+            print("  {0:15s} switch {1:8.1f}ms  first start {2:7.2f}ms  RSS +{3:6.1f}MB".format(
+                label, switch * 1e3, first * 1e3, rss / 1e6))
+    finally:
+        shutil.rmtree(folder)
+
+
+def overlay(args):
+    random.seed(5)
+    beeps = [parclasses.beep(random.randint(1, 18), duration=3, start_time=i) for i in range(args.beeps)]
+    layers = [syntheticSequence(args.events, seed=i) for i in range(args.layers)]
+    print("overlay: {0} beeps, {1} layers of {2} events".format(args.beeps, args.layers, args.events))
+    for label, lists in (("beeps", beeps), ("layers", layers)):
+        start = time.perf_counter()
+        resorted = parclasses.ControlList()
+        for other in lists:  # what overlay() used to do
+            resorted.addEvents(parclasses.ControlList(other).events)
+            resorted.sortEvents()
+        resort = time.perf_counter() - start
+
+        start = time.perf_counter()
+        one_by_one = parclasses.ControlList()
+        for other in lists:
+            one_by_one.overlay(other)
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        merged = parclasses.ControlList()
+        merged.overlay_many(lists)
+        bulk = time.perf_counter() - start
+        print("  {0:7s} copy+resort {1:8.2f}ms  overlay() {2:8.2f}ms  overlay_many() {3:8.2f}ms".format(
+            label, resort * 1e3, single * 1e3, bulk * 1e3))
+
+
+def tempo(args):
+    seq = syntheticSequence(args.events, seed=4)
+    factors = [0.8 + 0.4 * random.Random(i).random() for i in range(args.changes)]
+    seq.start()
+    seq.getNextByTime()
+
+    # what scale() used to do: rewrite the time column, then recompile on the next poll
+    store = seq.events
+    start = time.perf_counter()
+    for factor in factors:
+        store.time = array("q", [int(round(ref * factor)) for ref in store.ref_time])
+        store.changed()
+        seq.timeline()
+    rewrite = time.perf_counter() - start
+    store.time = array("q", store.ref_time)
+    store.changed()
+    seq.timeline()
+
+    start = time.perf_counter()
+    for factor in factors:
+        seq.scale(factor)
+        seq.getNextByTime()
+    mapped = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for factor in factors:
+        seq.scale(factor, ramp=1.0)
+        seq.getNextByTime()
+    ramped = time.perf_counter() - start
+
+    print("tempo: {0} events, {1} tempo changes".format(args.events, args.changes))
+    print("  rewrite times  {0:10.3f}ms/change".format(rewrite / args.changes * 1e3))
+    print("  tempo map      {0:10.3f}ms/change".format(mapped / args.changes * 1e3))
+    print("  ramped (1s)    {0:10.3f}ms/change".format(ramped / args.changes * 1e3))
+
+
+def clock(args):
+    print("clock: {0} reads per source".format(args.reads))
+    for label, source in (("time.time_ns", time.time_ns), ("monotonic_ns", time.monotonic_ns),
+                          ("perf_counter_ns", time.perf_counter_ns), ("parclock.nowNanos", parclock.nowNanos)):
+        start = time.perf_counter()
+        for i in range(args.reads):
+            source()
+        cost = time.perf_counter() - start
+
+        # smallest non-zero step between successive reads
+        step = None
+        for i in range(args.reads // 10):
+            first = source()
+            second = source()
+            while second == first:
+                second = source()
+            step = second - first if step is None else min(step, second - first)
+        print("  {0:18s} {1:7.1f}ns/read  step {2:>9,}ns".format(label, cost / args.reads * 1e9, step))
+
+
+def player(args):
+    instance = fakevlc.Instance(media_length=args.length, time_period=args.time_period / 1000.0)
+    para = paraplayer.ParaPlayer(fakevlc, instance)
+    vlc_player = para.player
+    started = parstats.LatencyStats("playing to start callback")
+    finished = parstats.LatencyStats("end reached to finish callback")
+    looped = parstats.LatencyStats("loop end to loop callback")
+    done = threading.Event()
+
+    def on_start(media_path, ptime):
+        started.record(int((parclock.now() - vlc_player.playing_at) * 1e9))
+
+    def on_finish(media_path, ptime):
+        if vlc_player.ended_at is not None:
+            finished.record(int((parclock.now() - vlc_player.ended_at) * 1e9))
+        done.set()
+
+    para.set_start_callback(on_start)
+    para.set_finish_callback(on_finish)
+    print("player: {0} plays of {1}s media, VLC time changes every {2}ms".format(args.plays, args.length,
+                                                                                  args.time_period))
+    with contextlib.redirect_stdout(io.StringIO()):  # ParaPlayer reports to stdout
+        for i in range(args.plays):
+            done.clear()
+            para.set_media("fake.wav")
+            vlc_player.ended_at = None
+            para.play()
+            done.wait(args.length + 2)
+
+        # loop the first half of the media: the loop end is passed when the
+        # media time reaches it, one loop length after the loop (re)started
+        loop_end = args.length / 2
+        loop_started = []
+
+        def on_loop(media_path, ptime):
+            looped.record(int((parclock.now() - loop_started[-1] - loop_end) * 1e9))
+            loop_started.append(vlc_player.base_clock)
+            if len(loop_started) > args.plays:
+                para.stop()
+
+        para.set_start_callback(lambda media_path, ptime: loop_started.append(vlc_player.base_clock))
+        para.set_media("fake.wav")
+        vlc_player.ended_at = None
+        para.loop(0.0, loop_end, loop_callback_fn=on_loop)
+        deadline = time.perf_counter() + loop_end * (args.plays + 2) + 2
+        while para.is_playing and time.perf_counter() < deadline:
+            time.sleep(0.05)
+        para.kill()
+        para.join(2)
+    for stats in (started, finished, looped):
+        print("  " + stats.summary())
+
+
+def sync(args):
+    instance = fakevlc.Instance(media_length=args.length + 1.0, time_period=args.time_period / 1000.0,
+                                rate=1.0 + args.drift / 1e6)
+    para = paraplayer.ParaPlayer(fakevlc, instance)
+    vlc_player = para.player
+    once = parstats.LatencyStats("start callback only")
+    synced = parstats.LatencyStats("MediaSync")
+    starts = []  # sequence start times (clock ns): [start callback, latest correction]
+
+    def on_start(media_path, ptime):
+        starts.append(parclock.nowNanos() - int(ptime * 1e9))
+        starts.append(starts[0])
+
+    def on_correction(start_ns):
+        starts[1] = start_ns
+
+    def error(start_ns):
+        # sequence time against the true media time, nanoseconds either way
+        return abs(parclock.nowNanos() - start_ns - int(vlc_player.exactTime() * 1e9))
+
+    para.set_start_callback(on_start)
+    print("sync: {0}s of media playing {1}ppm fast, VLC time changes every {2}ms".format(
+        args.length, args.drift, args.time_period))
+    with contextlib.redirect_stdout(io.StringIO()):
+        para.set_media("fake.wav")
+        para.play()
+        while not starts:
+            time.sleep(0.001)
+        media_sync = paraplayer.MediaSync(para, on_correction)
+        media_sync.start()
+        end = time.perf_counter() + args.length
+        while time.perf_counter() < end:
+            once.record(error(starts[0]))
+            synced.record(error(starts[1]))
+            time.sleep(0.02)
+        media_sync.end()
+        para.kill()
+        para.join(2)
+    for stats in (once, synced, media_sync.residual):
+        print("  " + stats.summary())
+    print("  drift estimate {0:.0f}ppm".format(media_sync.drift * 1e6))
+
+
+def tapTimes(args):
+    """ Returns (tap times, true beat times or None) in seconds: read from
+        args.taps (one time per line, # comments) or made up - a tapper with
+        args.jitter ms of scatter on a tempo that moves args.change percent
+        over the middle third """
+    if args.taps:
+        with open(args.taps) as tap_file:
+            lines = [line.split("#")[0].strip() for line in tap_file]
+        return [float(line) for line in lines if line], None
+    rng = random.Random(1)
+    period = 60.0 / args.bpm
+    beats = []
+    beat = 100.0
+    for i in range(args.beats):
+        beats.append(beat)
+        progress = min(max((i - args.beats / 3) / (args.beats / 3), 0.0), 1.0)
+        beat += period / (1.0 + args.change / 100.0 * progress)
+    return [b + rng.gauss(0.0, args.jitter / 1000.0) for b in beats], beats
+
+
+class WindowBeat(object):
+    """ The old TapBeat estimate: the period averaged over the last 12 taps,
+        beats counted from the last tap """
+
+    def __init__(self):
+        self.taps = []
+
+    def tap(self, tap_time):
+        self.taps = (self.taps + [tap_time])[-12:]
+
+    def nearestBeat(self, when):
+        period = (self.taps[-1] - self.taps[0]) / (len(self.taps) - 1)
+        return self.taps[-1] + round((when - self.taps[-1]) / period) * period
+
+
+def beats(args):
+    taps, truth = tapTimes(args)
+    print("beats: {0} taps{1}, phase error of the predicted beat {2} beat(s) ahead".format(
+        len(taps), " from " + args.taps if args.taps else ", {0} bpm, {1}ms jitter, {2}% tempo change".format(
+            args.bpm, args.jitter, args.change), args.ahead))
+    beat_keeper = beatnik.Beatnik()
+    estimators = [("window average", WindowBeat()), ("BeatTracker", beatnik.BeatTracker()),
+                  ("Beatnik", None)]
+    stats = {label: parstats.LatencyStats(label) for label, estimator in estimators}
+    warmup = 4
+    with contextlib.redirect_stdout(io.StringIO()):  # TapBeat reports each tap
+        for i, tap_time in enumerate(taps):
+            target = i + args.ahead - 1
+            if i >= warmup and target < len(taps):
+                # where the beat is: the true beat, else the tap the player made for it
+                actual = truth[target] if truth is not None else taps[target]
+                for label, estimator in estimators:
+                    if estimator is None:
+                        predicted = beat_keeper.player.tracker.nearestBeat(actual)
+                    else:
+                        predicted = estimator.nearestBeat(actual)
+                    stats[label].record(int(abs(predicted - actual) * 1e9))
+            for label, estimator in estimators:
+                if estimator is None:
+                    beat_keeper.BeatRecorder(tap_time)
+                else:
+                    estimator.tap(tap_time)
+    for label, estimator in estimators:
+        print("  " + stats[label].summary())
+
+
+def writeSong(path, bpm, seconds, rate=44100, seed=0):
+    """ Writes a made up 16 bit stereo song: a kick drum on the beat, a hat
+        between beats, a chord pad and some noise.  Returns the beat times """
+    import numpy as np
+    rng = np.random.RandomState(seed)
+    count = int(seconds * rate)
+    t = np.arange(count) / rate
+    song = 0.15 * sum(np.sin(2 * np.pi * f * t) for f in (220.0, 277.2, 329.6)) / 3
+    song += 0.02 * rng.randn(count)
+    period = 60.0 / bpm
+    beats = list(np.arange(0.5, seconds - 0.5, period))
+    hit = np.arange(int(0.15 * rate)) / rate
+    kick = 0.8 * np.sin(2 * np.pi * 60.0 * hit) * np.exp(-hit * 30.0) + 0.4 * rng.randn(len(hit)) * np.exp(-hit * 300.0)
+    hat = 0.1 * rng.randn(len(hit)) * np.exp(-hit * 80.0)
+    for beat in beats:
+        for sound, when in ((kick, beat), (hat, beat + period / 2)):
+            start = int(when * rate)
+            end = min(start + len(sound), count)
+            song[start:end] += sound[:end - start]
+    pcm = (np.clip(song, -1.0, 1.0) * 32767).astype("<i2")
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(np.repeat(pcm, 2).tobytes())
+    return beats
+
+
+def beatgridRun(args):
+    folder = tempfile.mkdtemp(prefix="parable_beats_")
+    try:
+        truth = {}
+        rng = random.Random(2)
+        for i in range(args.songs):
+            path = os.path.join(folder, "song{0:02d}.wav".format(i))
+            truth[path] = writeSong(path, rng.uniform(80.0, 160.0), args.length, seed=i)
+        print("beatgrid: {0} songs of {1}s".format(args.songs, args.length))
+        for label, processes in (("serial", 1), ("process pool", args.processes)):
+            for path in truth:
+                if os.path.exists(beatgrid.gridPath(path)):
+                    os.remove(beatgrid.gridPath(path))
+            start = time.perf_counter()
+            grids = beatgrid.analyzeAll(sorted(truth), processes=processes)
+            print("  {0:13s} {1:7.2f}s".format(label, time.perf_counter() - start))
+
+        start = time.perf_counter()
+        beatgrid.analyzeAll(sorted(truth))
+        print("  {0:13s} {1:7.2f}s".format("saved grids", time.perf_counter() - start))
+
+        # a detected beat is a hit within 20 ms of a true beat
+        hits = found = actual = 0
+        tempo_error = 0.0
+        for path, beats in truth.items():
+            grid = grids[path]
+            found += len(grid.beats)
+            actual += len(beats)
+            hits += sum(1 for beat in grid.beats if min(abs(beat - b) for b in beats) < 0.02)
+            tempo_error = max(tempo_error, abs(grid.period / (beats[1] - beats[0]) - 1.0))
+        print("  {0} of {1} beats found, {2} false; worst tempo error {3:.2f}%".format(
+            hits, actual, found - hits, tempo_error * 100))
+    finally:
+        shutil.rmtree(folder)
+
+
+def peakBytes():
+    """ Peak resident set size of this process so far (Linux), else 0.  Not
+        ru_maxrss: Linux carries that over from the parent of a spawned process """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def treeLoad(path):
+    """ The old ControlList.loadXML: parses the whole tree, then reads the events """
+    seq = parclasses.ControlList()
+    root = ET.parse(path).getroot()
+    seq.attributesFromXML(root)
+    seq.events = parclasses.EventStore()
+    add = seq.events.add
+    for ev in root.find("events").findall("event"):
+        get = ev.get
+        add(parclasses.secondsToNanos(float(get("time", "0.0"))),
+            parclasses.secondsToNanos(float(get("ref_time", "0.0"))),
+            int(get("level", "0")), int(get("channel", "0")),
+            parclasses.EventStore.actionCode(get("action", "off")),
+            parclasses.secondsToNanos(float(get("duration", "0.0"))),
+            int(get("value", "0")), int(get("sequence", "0")))
+    return seq
+
+
+def seqxLoadRun(path, method, results):
+    """ In a fresh process: loads path by method, then plays the first event.
+        Puts (first event s, all events in s, peak RSS growth bytes) on results """
+    sys.stdout = open(os.devnull, "w")  # loaders print the file name
+    before = peakBytes()
+    start = time.perf_counter()
+    if method == "tree":
+        seq = treeLoad(path)
+    elif method == "stream":
+        seq = parclasses.ControlList(path)
+    else:
+        seq = parclasses.LazyControlList(path)
+    seq.start(0)
+    first = seq.getNextByTime(0)
+    ready = time.perf_counter()
+    if method == "lazy":
+        while seq.streaming:
+            time.sleep(0.001)
+    results.put((ready - start, time.perf_counter() - start, peakBytes() - before, first is not False))
+
+
+def seqxload(args):
+    folder = tempfile.mkdtemp(prefix="parbench")
+    try:
+        path = os.path.join(folder, "big.seqx")
+        syntheticSequence(args.events, seed=1).saveXML(path)
+        print("seqxload: {0} events, {1:.1f}MB file".format(args.events, os.path.getsize(path) / 1e6))
+        context = multiprocessing.get_context("spawn")
+        for label, method in (("tree parse", "tree"), ("streaming", "stream"), ("lazy streaming", "lazy")):
+            results = context.Queue()
+            worker = context.Process(target=seqxLoadRun, args=(path, method, results))
+            worker.start()
+            first, loaded, peak, played = results.get()
+            worker.join()
+            print("  {0:15s} first event {1:8.1f}ms  all loaded {2:8.1f}ms  peak RSS +{3:6.1f}MB{4}".format(
+                label, first * 1e3, loaded * 1e3, peak / 1e6, "" if played else "  (nothing played)"))
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Parable benchmarks")
+    commands = parser.add_subparsers(dest="benchmark")
+    commands.required = True
+
+    cmd = commands.add_parser("bankload", help="serial vs process pool bank parsing")
+    cmd.add_argument("--files", type=int, default=500)
+    cmd.add_argument("--events", type=int, default=400)
+    cmd.add_argument("--processes", type=int, default=None, help="pool size (default one per CPU)")
+    cmd.set_defaults(run=bankload)
+
+    cmd = commands.add_parser("ethernet", help="Ethernet framing against the stand-in Puff server")
+    cmd.add_argument("--chords", type=int, default=500)
+    cmd.add_argument("--width", type=int, default=18, help="channels per chord")
+    cmd.add_argument("--threaded", action="store_true", help="use the writer thread")
+    cmd.set_defaults(run=ethernet)
+
+    cmd = commands.add_parser("fanout", help="ValvePortBank serial vs fan-out dispatch")
+    cmd.add_argument("--events", type=int, default=500)
+    cmd.add_argument("--delay", type=float, default=2.0, help="GUI port execute time (ms)")
+    cmd.set_defaults(run=fanout)
+
+    cmd = commands.add_parser("queues", help="event queue throughput and latency")
+    cmd.add_argument("--events", type=int, default=100000)
+    cmd.add_argument("--paced", type=int, default=1000, help="events sent 1 ms apart")
+    cmd.set_defaults(run=queues)
+
+    cmd = commands.add_parser("output", help="event to wire latency, UI loop vs dispatcher thread")
+    cmd.add_argument("--events", type=int, default=360)
+    cmd.add_argument("--interval", type=float, default=5.0, help="ms between events")
+    cmd.add_argument("--fps", type=float, default=60.0)
+    cmd.add_argument("--busy", type=float, default=8.0, help="max ms of layout work per frame")
+    cmd.set_defaults(run=output)
+
+    cmd = commands.add_parser("timeline", help="ControlList playback and seeking")
+    cmd.add_argument("--events", type=int, default=50000)
+    cmd.add_argument("--seeks", type=int, default=2000)
+    cmd.set_defaults(run=timeline)
+
+    cmd = commands.add_parser("ports", help="ValvePort state updates and execute()")
+    cmd.add_argument("--events", type=int, default=100000)
+    cmd.set_defaults(run=ports)
+
+    cmd = commands.add_parser("bankswitch", help="bank switch latency and memory, full parse vs header index")
+    cmd.add_argument("--files", type=int, default=200)
+    cmd.add_argument("--events", type=int, default=2000)
+    cmd.set_defaults(run=bankswitch)
+
+    cmd = commands.add_parser("overlay", help="ControlList overlay: copy and resort vs merge")
+    cmd.add_argument("--beeps", type=int, default=2000)
+    cmd.add_argument("--layers", type=int, default=8)
+    cmd.add_argument("--events", type=int, default=20000)
+    cmd.set_defaults(run=overlay)
+
+    cmd = commands.add_parser("tempo", help="tempo change cost, event rewrite vs tempo map")
+    cmd.add_argument("--events", type=int, default=50000)
+    cmd.add_argument("--changes", type=int, default=50)
+    cmd.set_defaults(run=tempo)
+
+    cmd = commands.add_parser("clock", help="clock source read cost and resolution")
+    cmd.add_argument("--reads", type=int, default=200000)
+    cmd.set_defaults(run=clock)
+
+    cmd = commands.add_parser("player", help="ParaPlayer callback latency on the fake VLC backend")
+    cmd.add_argument("--plays", type=int, default=10)
+    cmd.add_argument("--length", type=float, default=0.5, help="media length, seconds")
+    cmd.add_argument("--time-period", type=float, default=250, help="ms between VLC time changes")
+    cmd.set_defaults(run=player)
+
+    cmd = commands.add_parser("sync", help="show sequence drift from the media, with and without MediaSync")
+    cmd.add_argument("--length", type=float, default=10.0, help="seconds of media to play")
+    cmd.add_argument("--drift", type=float, default=2000.0, help="media clock error, ppm")
+    cmd.add_argument("--time-period", type=float, default=250, help="ms between VLC time changes")
+    cmd.set_defaults(run=sync)
+
+    cmd = commands.add_parser("beats", help="tap beat phase prediction error, window average vs BeatTracker")
+    cmd.add_argument("--taps", default=None, help="file of recorded tap times, seconds, one per line")
+    cmd.add_argument("--beats", type=int, default=300, help="made up taps")
+    cmd.add_argument("--bpm", type=float, default=120.0)
+    cmd.add_argument("--jitter", type=float, default=15.0, help="tap scatter, ms standard deviation")
+    cmd.add_argument("--change", type=float, default=4.0, help="tempo change over the middle third, percent")
+    cmd.add_argument("--ahead", type=int, default=1, help="predict the beat this many beats after the last tap")
+    cmd.set_defaults(run=beats)
+
+    cmd = commands.add_parser("beatgrid", help="offline beat grid analysis, serial vs process pool")
+    cmd.add_argument("--songs", type=int, default=8)
+    cmd.add_argument("--length", type=float, default=60.0, help="seconds per song")
+    cmd.add_argument("--processes", type=int, default=None, help="pool size (default one per CPU)")
+    cmd.set_defaults(run=beatgridRun)
+
+    cmd = commands.add_parser("seqxload", help="big .seqx load time and peak memory, tree parse vs streaming")
+    cmd.add_argument("--events", type=int, default=200000)
+    cmd.set_defaults(run=seqxload)
+
+    args = parser.parse_args()
+    args.run(args)
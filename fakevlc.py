@@ -0,0 +1,204 @@
+""" ************************************************************
+Stand-in VLC backend for the Parable Sequencing Program
+
+Implements the part of the VLC bindings (vlc.py) that ParaPlayer uses,
+without libvlc or a sound card, so player timing can be tested and
+benchmarked: paraplayer.ParaPlayer(backend=fakevlc).
+
+A media "plays" on the parclock clock in real time.  Like VLC, the
+player reports MediaPlayerPlaying start_latency seconds after play(),
+MediaPlayerTimeChanged every time_period seconds and
+MediaPlayerEndReached at the end of the media, calling event callbacks
+on its own thread.  get_time() returns the time of the last
+TimeChanged, as VLC does.  playing_at and ended_at keep the clock time
+(seconds) each event was sent, for measuring callback latency.  rate
+is how fast the media plays against the clock: a sound card's clock is
+never quite the computer's, so 1.0005 plays 500 ppm fast.
+
+************************************************************ """
+
+import threading
+import parclock
+
+
+class EventType(object):
+    MediaPlayerPlaying = 260
+    MediaPlayerEndReached = 265
+    MediaPlayerTimeChanged = 267
+
+
+class EventUnion(object):
+    def __init__(self, new_time=0):
+        self.new_time = new_time  # ms, for MediaPlayerTimeChanged
+
+
+class Event(object):
+    def __init__(self, event_type, new_time=0):
+        self.type = event_type
+        self.u = EventUnion(new_time)
+
+
+class EventManager(object):
+    def __init__(self):
+        self.callbacks = {}  # event type -> [(callback, args, kwds)]
+
+    def event_attach(self, eventtype, callback, *args, **kwds):
+        self.callbacks.setdefault(eventtype, []).append((callback, args, kwds))
+        return 0
+
+    def event_detach(self, eventtype):
+        self.callbacks.pop(eventtype, None)
+
+    def send(self, event):
+        for callback, args, kwds in self.callbacks.get(event.type, []):
+            callback(event, *args, **kwds)
+
+
+class Media(object):
+    def __init__(self, path, length):
+        self.path = path
+        self.length = length  # seconds
+
+    def get_mrl(self):
+        return self.path
+
+    def get_duration(self):
+        return int(self.length * 1000)
+
+
+class MediaPlayer(object):
+    """ Plays a Media on a background thread, on the clock """
+
+    def __init__(self, start_latency, time_period, rate=1.0):
+        self.start_latency = start_latency
+        self.time_period = time_period
+        self.rate = rate  # media seconds per clock second
+        self.events = EventManager()
+        self.media = None
+        self.lock = threading.Lock()
+        self.wake = threading.Condition(self.lock)
+        self.generation = 0  # bumped by play, pause, stop and seeks to end a play thread
+        self.playing = False
+        self.position = 0.0  # media seconds at base_clock
+        self.base_clock = None  # clock time (seconds) of position, while playing
+        self.time_ms = 0  # last reported time
+        self.playing_at = None
+        self.ended_at = None
+
+    def event_manager(self):
+        return self.events
+
+    def set_media(self, media):
+        self.stop()
+        self.media = media
+        self.position = 0.0
+        self.time_ms = 0
+
+    def get_media(self):
+        return self.media
+
+    def set_position(self, fraction):
+        if self.media is not None:
+            self.set_time(int(fraction * self.media.length * 1000))
+
+    def exactTime(self):
+        """ The true media position (seconds), not the last reported one """
+        with self.lock:
+            return self._position()
+
+    def _position(self):
+        if self.base_clock is None:
+            return self.position
+        return self.position + (parclock.now() - self.base_clock) * self.rate
+
+    def play(self):
+        if self.media is None:
+            return -1
+        with self.lock:
+            if self.playing:
+                return 0
+            if self.position >= self.media.length:
+                self.position = 0.0
+            self.playing = True
+            self.generation += 1
+            generation = self.generation
+        threading.Thread(target=self._run, args=(generation,), daemon=True).start()
+        return 0
+
+    def pause(self):
+        with self.lock:
+            if self.playing:
+                self.position = self._position()
+                self.base_clock = None
+                self.playing = False
+                self.generation += 1
+                self.wake.notify_all()
+
+    def stop(self):
+        with self.lock:
+            self.playing = False
+            self.base_clock = None
+            self.position = 0.0
+            self.time_ms = 0
+            self.generation += 1
+            self.wake.notify_all()
+
+    def set_time(self, ms):
+        with self.lock:
+            self.position = ms / 1000.0
+            self.time_ms = int(ms)
+            if self.base_clock is not None:
+                self.base_clock = parclock.now()
+            self.wake.notify_all()
+
+    def get_time(self):
+        return self.time_ms
+
+    def is_playing(self):
+        return 1 if self.playing and self.base_clock is not None else 0
+
+    def _run(self, generation):
+        """ One play, until paused, stopped or the media ends """
+        with self.lock:
+            self.wake.wait_for(lambda: self.generation != generation, self.start_latency)
+            if self.generation != generation:
+                return
+            self.base_clock = parclock.now()
+            self.playing_at = self.base_clock
+        self.events.send(Event(EventType.MediaPlayerPlaying))
+
+        while True:
+            with self.lock:
+                remaining = (self.media.length - self._position()) / self.rate
+                self.wake.wait_for(lambda: self.generation != generation, min(self.time_period, max(remaining, 0)))
+                if self.generation != generation:
+                    return
+                position = min(self._position(), self.media.length)
+                self.time_ms = int(position * 1000)
+                ended = position >= self.media.length
+                if ended:
+                    self.playing = False
+                    self.position = position
+                    self.base_clock = None
+                    self.ended_at = parclock.now()
+            self.events.send(Event(EventType.MediaPlayerTimeChanged, self.time_ms))
+            if ended:
+                self.events.send(Event(EventType.MediaPlayerEndReached))
+                return
+
+
+class Instance(object):
+    """ media_length (seconds) is the length of every media made by
+        media_new(); start_latency, time_period and rate set the player timing """
+
+    def __init__(self, *args, media_length=10.0, start_latency=0.05, time_period=0.25, rate=1.0):
+        self.media_length = media_length
+        self.start_latency = start_latency
+        self.time_period = time_period
+        self.rate = rate
+
+    def media_player_new(self):
+        return MediaPlayer(self.start_latency, self.time_period, self.rate)
+
+    def media_new(self, path):
+        return Media(path, self.media_length)
@@ -3,14 +3,14 @@ import kivy
 # import logging
 # import sys
 # import vlc
-import time
 import threading
 # import Queue
-import multiprocessing
 
 import paraplayer
 import parascreens
 import parclasses
+import parclock
+import parqueues
 import parthreads
 import showlist
 
@@ -52,13 +52,15 @@ class TrinityApp(App):
         # self.show_seq_directory = "/Users/Stu/Documents/Compression/Sequences/Show/"
         self.music_directory = "/Users/Stu/Documents/Compression/Music/"
         self.show_list_file = "/Users/Stu/Documents/Compression/compression.show.xml"
+        self.beat_mode = "yes"  # usebeat mode: "yes" snaps loops to the beat, "phase" re-phases on every beat
 
-        # Threading queues
-        self.out_queue = multiprocessing.Queue()  # send commands to main thread
-        self.in_queue = multiprocessing.Queue()  # get responses from main thread
-        self.ev_queue = multiprocessing.Queue()  # get event records from main thread
-        self.temp_out_queue = multiprocessing.Queue()  # send commands to temp seq thread
-        self.temp_ev_queue = multiprocessing.Queue()  # get event records from main thread
+        # Threading queues ("process" transport uses multiprocessing queues)
+        self.transport = "thread"
+        self.out_queue = parqueues.commandQueue(self.transport)  # send commands to main thread
+        self.in_queue = parqueues.commandQueue(self.transport)  # get responses from main thread
+        self.ev_queue = parqueues.eventQueue(self.transport)  # get event records from main thread
+        self.temp_out_queue = parqueues.commandQueue(self.transport)  # send commands to temp seq thread
+        self.temp_ev_queue = parqueues.eventQueue(self.transport)  # get event records from main thread
 
         # create a channel map for the actual cannons
         self.straight_map = parclasses.ChannelMap(24)  # for straight import mapping
@@ -137,7 +139,9 @@ class TrinityApp(App):
         self.vp1 = None  # ValvePort output
         self.vp2 = None  # ValvePort output
         self.vp3 = None
-        self.vpb = parclasses.ValvePortBank()
+        self.vpb = parclasses.ValvePortBank()  # outputs driven by the dispatcher thread
+        self.light_state = parclasses.ValvePort_Snapshot(24, 6)  # what the lights show, read once a frame
+        self.dispatcher = None  # OutputDispatcher thread, owns vpb
         self.auto_pilot = False  # in case we add auto-pilot at some point
 
         self.sequences = []  # list of SequenceButton objects (prev seq name)
@@ -170,18 +174,22 @@ class TrinityApp(App):
 
         # Other output objects
         # TODO: address and port from command line arguments or from config file
-        self.vp2 = parclasses.ValvePort_Ethernet(24, 6, self.remote_addr, 4444, False)
+        self.vp2 = parclasses.ValvePort_Ethernet(24, 6, self.remote_addr, 4444, False, threaded=True)  # never blocks the UI
         self.vp2.setMap(self.graybox_map)
 
         # Recorder object
         self.vp3 = parclasses.ValvePort_Recorder(24, 6, self.music_directory, self.on_kill_press)
         self.vp3.setMap(self.straight_map)
 
-        # add output objects to an output bank
+        # add output objects to an output bank, run by the output dispatcher thread
+        # the Kivy lights (vp1) stay in this thread and follow light_state at display rate
+        self.light_state.setMap(self.effect_map)
         self.vpb.addPort(self.vp3)
-        self.vpb.addPort(self.vp1)
+        self.vpb.addPort(self.light_state)
         self.vpb.addPort(self.vp2)
-        self.vpb.execute()   # show the lights
+        self.vpb.execute()
+        self.vp1.execute()   # show the lights
+        self.dispatcher = parthreads.OutputDispatcher(self.vpb, [self.ev_queue, self.temp_ev_queue]).start()
 
         # Create initial temp sequence
         li = parclasses.randy(140, 18, 1, 2)
@@ -205,6 +213,7 @@ class TrinityApp(App):
         # Initiate thread handler
         print('Starting Kivy loop handler')
         Clock.schedule_once(self.loop_handler, 3)
+        Clock.schedule_interval(self.show_lights, 1 / 30)
 
         return self.ui
 
@@ -236,22 +245,11 @@ class TrinityApp(App):
         return self.countdown < self.num_channels
 
     def loop_handler(self, dt=None):
-        """Once this is called it will run each frame"""
+        """Once this is called it will run each frame.  Events are fired by
+           the output dispatcher thread, not here"""
         # lock = threading.Lock()
         if not self.in_handler:
             self.in_handler = True
-            while self.ev_queue.empty() is False:
-                # lock.acquire()
-                ev = self.ev_queue.get()
-                self.vpb.setEventExec(ev)
-                # lock.release()
-
-            while self.temp_ev_queue.empty() is False:
-                # lock.acquire()
-                ev = self.temp_ev_queue.get()
-                self.vpb.setEventExec(ev)
-                # lock.release()
-
             while self.in_queue.empty() is False:
                 # lock.acquire()
                 self.process_thread_command(self.in_queue.get())
@@ -260,6 +258,11 @@ class TrinityApp(App):
             self.in_handler = False
         Clock.schedule_once(self.loop_handler, 0)  # call this on next frame
 
+    def show_lights(self, dt=None):
+        """Updates the lights from the output state (coalesced to the display rate)"""
+        self.vp1.setMask(self.light_state.take())
+        self.vp1.execute()
+
     def process_thread_command(self, cmdstr):
         """ process incoming commands from the main thread """
         # print(">>> " + cmdstr)
@@ -267,7 +270,7 @@ class TrinityApp(App):
 
         # kill - kill the cannons
         if cmd[0] == "kill":
-            self.vpb.reset()
+            self.dispatcher.call(self.vpb.reset)
             # running - color button to indicate running status
         elif cmd[0] == "started":
             for button in self.sequences:
@@ -330,40 +333,47 @@ class TrinityApp(App):
         if self.auto_pilot is False:
             # print("toggle|" + self.sequences[event.target.id])
             self.out_queue.put("toggle|" + button.sequence_name)
-            button.trigger_time = time.time()
+            button.trigger_time = parclock.now()
+
+    def on_seq_hover(self, button: parascreens.SequenceButton):
+        """ The pointer is over a sequence button: have its events parsed now so
+            the first trigger does not wait for the file """
+        if not button.prefetched:
+            button.prefetched = True
+            self.out_queue.put("prefetch|" + button.sequence_name)
 
     def seq_btn_up(self, button: parascreens.SequenceButton):
         """ Depending on how long the button was pressed, either stop the sequence or does nothing """
         if self.auto_pilot is False:
-            if time.time() - button.trigger_time > 0.2:
+            if parclock.now() - button.trigger_time > 0.2:
                 # print("stop|" + self.sequences[event.target.id])
                 self.out_queue.put("stop|" + button.sequence_name)
 
     def fire_channel(self, channel_number):
         """Takes a channel numnber and fires that channel. NO OFF! Must use Kill"""
         print('Firing channel {} manually'.format(channel_number))
-        self.vp2.setChannelExec(int(channel_number), 1)
+        self.dispatcher.call(self.vp2.setChannelExec, int(channel_number), 1)
 
     def on_use_beat(self, toggle: ToggleButton):
         """Depending on the state of the button, use the tap beat or not"""
         if toggle.state == 'down':
-            self.out_queue.put("usebeat|yes")
+            self.out_queue.put("usebeat|" + self.beat_mode)
         else:
             self.out_queue.put("usebeat|no")
 
     def on_tap_press(self):
         """ process a tap beat to keep time with music """
-        self.out_queue.put("tap|" + str(time.time()))
+        self.out_queue.put("tap|" + str(parclock.now()))
         if self.home_screen.ids.use_beat.state == 'normal':
             self.home_screen.ids.use_beat.state = 'down'
-            self.out_queue.put("usebeat|yes")
+            self.out_queue.put("usebeat|" + self.beat_mode)
 
     def on_kill_press(self):
         """terminate sequences with extreme prejudice"""
         self.out_queue.put("stop|")
         self.home_screen.ids.use_beat.state = 'normal'
         self.out_queue.put("usebeat|no")
-        self.vpb.reset()
+        self.dispatcher.call(self.vpb.reset)
         self.auto_pilot = False
         if self.tmain.isAlive():
             self.title = "Thread is alive"
@@ -375,7 +385,7 @@ class TrinityApp(App):
 
     def on_align_press(self):
         """ realign the start_time for the tap beat"""
-        self.out_queue.put("align|" + str(time.time()))
+        self.out_queue.put("align|" + str(parclock.now()))
 
 
     def on_load_bank(self, bank_name):
@@ -394,13 +404,18 @@ class TrinityApp(App):
                             tempo = tempofile.readline()
                             self.title = tempo
                             self.out_queue.put("settempo|" + tempo)
-                            self.out_queue.put("usebeat|yes")
+                            self.out_queue.put("usebeat|" + self.beat_mode)
                 except FileNotFoundError:
                     self.title = 'tempo.txt not found'
             else:
                 self.temp_out_queue.put("stop")
                 print("Sequence was running. Please try again")
 
+    def on_preload_bank(self, bank_name):
+        """Parses a bank in the sequencing thread's background so loading it later is instant"""
+        if bank_name != '':
+            self.out_queue.put("preloadbank|" + bank_name)
+
     def play_temp_seq(self):
         """Plays the temp sequence that is initialized with a randy sequence"""
         if self.ttemp.isAlive() is True:
@@ -444,12 +459,19 @@ class TrinityApp(App):
         if self.ttemp.isAlive():
             self.temp_out_queue.put("die")
             self.ttemp.join()  # wait for thread to finish
+        # stop the output dispatcher and the Ethernet writer thread
+        self.dispatcher.stop()
+        print(self.dispatcher.latency.summary())
+        print(self.showlist.sync_residual.summary())
+        print(self.vpb.latencyReport())
+        print(self.vp2.metrics())
+        self.vp2.close()
 
     def initiate_recording(self, show_index):
         """Sets up the recorder with a media file"""
         event = self.showlist.get_event(show_index)
         if event and event.type == 'music':
-            self.vp3.set_media(event.source, event.duration)
+            self.dispatcher.call(self.vp3.set_media, event.source, event.duration)
         self.home_screen.show_recorder_controls()
 
     def on_show_control_button(self, button_text, button_state='normal'):
@@ -471,15 +493,16 @@ class TrinityApp(App):
 
     def on_recorder_button(self, button_text):
         """To avoid multiple button handlers, uses button label"""
+        # the recorder is part of the output bank, so it is driven from the dispatcher thread
         if button_text == 'record':
-            self.vp3.record()
+            self.dispatcher.call(self.vp3.record)
         elif button_text == 'accept':
-            self.vp3.accept()
+            self.dispatcher.call(self.vp3.accept)
         elif button_text == 'discard':
-            self.vp3.reject()
+            self.dispatcher.call(self.vp3.reject)
         elif button_text == 'commit':
-            self.vp3.accept()
-            self.vp3.commit()
+            self.dispatcher.call(self.vp3.accept)
+            self.dispatcher.call(self.vp3.commit)
             self.home_screen.hide_recorder_controls()
 
 
@@ -1,19 +1,48 @@
+import collections
 import threading
 import vlc
-import time
+import parclock
+import parstats
 
 # A class intended for threaded operation, instantiates a VLC media player and operates it
 
 
 class ParaPlayer(threading.Thread):
+    """ Plays media through VLC, or silence for a set time, and rings the start,
+        finish, loop and interval callbacks from its own thread.
 
-    def __init__(self):
-        self.Instance = vlc.Instance()
+        VLC's event manager reports when playback starts, the media time
+        changes and the end is reached.  Its callbacks (on a VLC thread, which
+        must not call back into libvlc) only note the event and wake this
+        thread, which does the rest.  In between the thread sleeps until the
+        next thing that can fall due: the end of a set playback length, an
+        interval callback or a loop end.  Within loop_fine_window seconds of
+        such an end it checks every loop_fine_period seconds against the media
+        time extrapolated from the last time change.
+
+        backend is the VLC bindings module: vlc, or fakevlc to run without
+        libvlc.  instance is a backend Instance (default: a new one) """
+
+    loop_fine_window = 0.05  # seconds before a loop or playback end to start fine checks
+    loop_fine_period = 0.002  # seconds between checks in that window
+    default_interval = 0.3  # interval callback period if interval_period is not set
+    check_period = 1.0  # longest sleep while media plays, in case VLC stops without telling
+
+    def __init__(self, backend=vlc, instance=None):
+        self.Instance = instance if instance is not None else backend.Instance()
         self.player = self.Instance.media_player_new()
 
-        # Lines below are unused but may come in handy on a rainy day
-        # self.vlc_events = self.player.event_manager()
-        # self.vlc_events.event_attach(vlc.EventType.MediaPlayerEndReached, self., 1)
+        # VLC events, noted by the _on_vlc_...() callbacks
+        self.vlc_events = self.player.event_manager()
+        self.vlc_events.event_attach(backend.EventType.MediaPlayerPlaying, self._on_vlc_playing)
+        self.vlc_events.event_attach(backend.EventType.MediaPlayerTimeChanged, self._on_vlc_time_changed)
+        self.vlc_events.event_attach(backend.EventType.MediaPlayerEndReached, self._on_vlc_end_reached)
+        self.vlc_playing = False  # VLC reported playing (cleared on pause/stop)
+        self.vlc_ended = False  # VLC reported the end of the media
+        self.vlc_time = 0.0  # media time (seconds) VLC last reported
+        self.vlc_clock = 0.0  # clock time (seconds) of that report
+        self.vlc_report = None  # (media time, clock time) of the last time change while playing
+        self._wake = threading.Event()
 
         self.media_path = None
         self.playback_length = 0  # length of playback before stopping or 0
@@ -42,6 +71,9 @@ class ParaPlayer(threading.Thread):
         """Sets a media file for playback or None with length to play silence for a period of time
         in seconds (float)"""
         self._halt_playback()
+        self.vlc_ended = False
+        self.vlc_time = 0.0
+        self.vlc_report = None
         self.media_path = media_path
         self.playback_length = length
         if self.media_path is not None:
@@ -50,19 +82,15 @@ class ParaPlayer(threading.Thread):
             self.player.set_position(0)
 
     def run(self):
-        """Initializes the thread but does not actually play media"""
-        # CRITICAL: call this repeatedly from the program loop, remove loop and sleep. I think, right?
-        # CONSIDER: actually, maybe not, if the program loop halts it may result in less than perfect operation. TBD!!!
+        """Waits for VLC events or the next due time and rings the callbacks, until killed"""
         print("Entering media thread")
         self.is_active = True
-        # while self._stop_thread.is_set() is False:
-        # CRITICAL: are there two competing conditions or are both needed?
-        # CRITICAL: self.player.is_playing() returns 0/1, is never True of False!!! Not being checked
-        while self._stop_thread.is_set() is False or self.player.is_playing() is True:
-            while self.is_active is True or self.player.is_playing() is True:
-                self._check_playback()
-                self._check_interval()
-                time.sleep(.3)
+        while self._stop_thread.is_set() is False:
+            self._wake.wait(self._next_wait())
+            self._wake.clear()
+            self._check_playback()
+            self._check_interval()
+        self._check_playback()  # halts playback
         print("Leaving ParaPlayer media thread")
 
     def kill(self):
@@ -70,6 +98,7 @@ class ParaPlayer(threading.Thread):
         print("Killing playback thread")
         self.is_active = False  # CRITICAL: does this conflict with is_active() on threading.thread?
         self._stop_thread.set()
+        self._wake.set()
 
     # Set callback functions for event mgt. All functions get media_path and current playback time
     def set_start_callback(self, callback_fn=None):
@@ -88,7 +117,7 @@ class ParaPlayer(threading.Thread):
         if self.is_playing is False:
             # Handle paused playback
             if self.pause_time > 0.0:
-                self.start_time = time.time() - (self.pause_time - self.start_time)
+                self.start_time = parclock.now() - (self.pause_time - self.start_time)
                 self.pause_time = 0.0
                 if self.media_path is not None:
                     self.player.play()
@@ -98,7 +127,8 @@ class ParaPlayer(threading.Thread):
                     self.player.play()
                     if self._is_looping():
                         self.player.set_time(int(self.loop_start * 1000))
-                self.start_time = time.time()
+                        self.vlc_time = self.loop_start
+                self.start_time = parclock.now()
             self.is_playing = True
             # Call start callback
             if self.start_callback is not None:
@@ -106,14 +136,18 @@ class ParaPlayer(threading.Thread):
                     self.start_callback_armed = True
                 else:
                     self.start_callback(self.media_path, self.get_time())
+            self._wake.set()  # new due times
 
     def pause(self):
         """Pause playback and keep track of time signatures"""
         if self.is_playing:
             self.is_playing = False
-            self.pause_time = time.time()
+            self.pause_time = parclock.now()
             if self.player.is_playing() == 1:
                 self.player.pause()
+            self.vlc_time = self._media_time()
+            self.vlc_playing = False
+            self._wake.set()
 
     def stop(self):
         """Stop playback and reset media, call finish callback"""
@@ -132,12 +166,22 @@ class ParaPlayer(threading.Thread):
         """Returns the current time of playback"""
         if self.media_path is None:
             if self.start_time > 0.0:
-                return time.time() - self.start_time
+                return parclock.now() - self.start_time
             else:
                 return 0.0
         else:
             return float(self.player.get_time() / 1000)
 
+    def get_sync_point(self):
+        """Returns (media time, clock time) in seconds of the latest reading of the playback position - VLC's
+        last time change and when it came in, or now for silence - or None if nothing is playing"""
+        if self.is_playing is False:
+            return None
+        if self.media_path is None:
+            now = parclock.now()
+            return now - self.start_time, now
+        return self.vlc_report if self.vlc_playing else None
+
     def report_time(self):
         rtime = self.get_time()
         print(rtime)
@@ -156,11 +200,13 @@ class ParaPlayer(threading.Thread):
     def _halt_playback(self):
         """If player is playing, stop it. Ring callback. Return playback timestamp."""
         if self.media_path is None:
-            ptime = time.time() - self.start_time
+            ptime = parclock.now() - self.start_time
         else:
             ptime = float(self.player.get_time() / 1000)
             if self.player.is_playing() == 1:
                 self.player.stop()
+        self.vlc_playing = False
+        self.vlc_report = None
 
         # Ring callback function
         if self.is_playing is True:
@@ -169,55 +215,200 @@ class ParaPlayer(threading.Thread):
                 self.finish_callback(self.media_path, ptime)
         return ptime
 
+    # VLC event callbacks.  These run on a VLC thread: note the event, wake the player thread
+
+    def _on_vlc_playing(self, event):
+        self.vlc_clock = parclock.now()
+        self.vlc_playing = True
+        self._wake.set()
+
+    def _on_vlc_time_changed(self, event):
+        self.vlc_time = event.u.new_time / 1000.0
+        self.vlc_clock = parclock.now()
+        self.vlc_report = (self.vlc_time, self.vlc_clock)
+        self._wake.set()
+
+    def _on_vlc_end_reached(self, event):
+        self.vlc_playing = False
+        self.vlc_ended = True
+        self._wake.set()
+
+    def _media_time(self):
+        """ Media time (seconds) now: VLC's last report, moved on by the clock while playing """
+        if self.vlc_playing:
+            return self.vlc_time + parclock.now() - self.vlc_clock
+        return self.vlc_time
+
+    def _play_time(self):
+        """ Playback time (seconds) of the media, or of the silence """
+        if self.media_path is None:
+            return parclock.now() - self.start_time
+        return self._media_time()
+
+    def _until(self, end_time):
+        """ Seconds to sleep before checking for end_time (playback seconds): up
+            to the fine check window, then short steps inside it """
+        remaining = end_time - self._play_time()
+        if self.media_path is None:
+            return remaining  # silence is timed by the clock itself
+        if remaining > self.loop_fine_window:
+            return remaining - self.loop_fine_window
+        return min(remaining, self.loop_fine_period)
+
+    def _next_wait(self):
+        """ Seconds until the next check is due, None to wait for an event """
+        waits = []
+        if self.is_playing:
+            if float(self.playback_length) > 0.0:
+                waits.append(self._until(float(self.playback_length)))
+            elif self._is_looping():
+                waits.append(self._until(self.loop_end))
+            if self.media_path is not None and self.vlc_playing:
+                waits.append(self.check_period)
+            if self.interval_callback is not None:
+                period = self.interval_period or self.default_interval
+                waits.append(self.interval_last_checked + period - parclock.now())
+        return max(min(waits), 0.0) if waits else None
+
     def _check_playback(self):
         """(internal) check the status of playback and whether it's finished, ping callbacks, set flags"""
         # Check if active flag is cleared, stop playback
         if self.is_playing:
             # Check for thread halt
             if self.is_active is False:
-                ptime = self._halt_playback()
-            else:
-                # Check the player time to fire armed callback
-                if self.media_path is not None and self.start_callback_armed:
-                    ptime = self.get_time()
-                    if ptime > 0.0:
-                        self.start_callback(self.media_path, ptime)
-                        self.start_callback_armed = False
-
-                # Check whether playback length is set and exceeded
-                if float(self.playback_length) > 0.0:
-                    if self.get_time() >= self.playback_length:
-                        ptime = self._halt_playback()
-                else:
-                    # Check if looping, end reached?
-                    if self._is_looping():
-                        ptime = self.get_time()
-                        if ptime >= self.loop_end:
-                            if self.media_path is not None:
-                                self.player.set_time(int(self.loop_start * 1000))
-                            if self.pause_on_loop:
-                                self.pause()
-                            if self.loop_callback is not None:
-                                self.loop_callback(self.media_path, self.get_time())
-                    else:
-                        # Check whether player reached the end (self.is_playing still set)
-                        if self.media_path is not None:
-                            if self.player.is_playing() == 0:
-                                ptime = self._halt_playback()
+                self._halt_playback()
+                return
+
+            # Fire the armed start callback once VLC reports playing
+            if self.media_path is not None and self.start_callback_armed and self.vlc_playing:
+                self.start_callback_armed = False
+                self.start_callback(self.media_path, self.get_time())
 
-            # Call the finish callback
-            if self.is_playing is False:
-                if self.finish_callback is not None:
-                    self.finish_callback(self.media_path, ptime)
+            # Check whether playback length is set and exceeded
+            if self.media_path is not None and self.vlc_ended:
+                self._halt_playback()
+            elif float(self.playback_length) > 0.0:
+                if self._play_time() >= self.playback_length:
+                    self._halt_playback()
+            elif self._is_looping():
+                # Check if looping, end reached?
+                if self._play_time() >= self.loop_end:
+                    if self.media_path is not None:
+                        self.player.set_time(int(self.loop_start * 1000))
+                        self.vlc_time = self.loop_start
+                        self.vlc_clock = parclock.now()
+                        self.vlc_report = None
+                    else:
+                        self.start_time = parclock.now() - self.loop_start
+                    if self.pause_on_loop:
+                        self.pause()
+                    if self.loop_callback is not None:
+                        self.loop_callback(self.media_path, self.get_time())
+            elif self.media_path is not None:
+                # Check whether the player stopped without reporting the end
+                if self.vlc_playing and self.player.is_playing() == 0:
+                    self._halt_playback()
 
     def _check_interval(self):
         """Checks whether it's time for an interval callback and rings it if so"""
         if self.is_playing and self.interval_callback is not None:
-            now = time.time()
-            if (now - self.interval_period) > self.interval_last_checked:
+            now = parclock.now()
+            if (now - (self.interval_period or self.default_interval)) >= self.interval_last_checked:
                 self.interval_callback(self.media_path, now)
                 self.interval_last_checked = now
 
     def _is_looping(self):
         """Is this thing looping?"""
         return self.loop_end > 0.0 and self.loop_end > self.loop_start
+
+
+class MediaSync(threading.Thread):
+    """ Keeps a running sequence locked to the media a ParaPlayer is playing.
+
+        Every sample_period seconds it reads the player's media clock
+        (ParaPlayer.get_sync_point(): the media time VLC last reported and
+        the clock time it came in) and fits a line through the last window
+        reports by least squares, giving the offset of the media against
+        parclock and the drift of one clock against the other.  Single
+        reports are late by the audio buffer and rounded to milliseconds; the
+        fit averages that out.  From the fit it works out the start time
+        (clock ns) that puts sequence time on media time now, and passes it to
+        on_correction(start_ns) whenever it moves more than threshold_ns, so a
+        sequence running on that start time follows the media for the length
+        of the song with no per-event work.
+
+        residual (parstats.LatencyStats) collects how far each new report
+        lands from the fit's prediction.  A report further out than jump
+        seconds is a seek or loop: the fit starts again from it """
+
+    sample_period = 0.05  # seconds between readings of the media clock
+    window = 32  # reports in the fit
+    min_samples = 3  # reports before the first correction
+    threshold_ns = 1000000  # smallest start time change passed on
+    max_drift = 0.01  # the media clock rate is clamped to 1 +/- this
+    jump = 0.25  # seconds off the fit that mean the media time jumped
+
+    def __init__(self, player, on_correction, residual=None):
+        threading.Thread.__init__(self, name="media sync", daemon=True)
+        self.player = player
+        self.on_correction = on_correction
+        self.residual = residual if residual is not None else parstats.LatencyStats("media sync residual")
+        self.reports = collections.deque(maxlen=self.window)  # (media time, clock time) seconds
+        self.start_ns = None  # start time last passed to on_correction
+        self.drift = 0.0  # media clock rate against parclock, minus 1
+        self._stop_sync = threading.Event()
+
+    def run(self):
+        while self._stop_sync.is_set() is False:
+            self.sample()
+            self._stop_sync.wait(self.sample_period)
+
+    def end(self):
+        """ Stops the thread; no more corrections are passed on """
+        self._stop_sync.set()
+
+    def sample(self):
+        """ Takes one reading of the media clock.  Returns True if it was a new report """
+        point = self.player.get_sync_point()
+        if point is None or (self.reports and point[1] == self.reports[-1][1]):
+            return False
+        fit = self.fit()
+        if fit is not None:
+            error = abs(point[0] - self.predict(fit, point[1]))
+            if error > self.jump:
+                self.reports.clear()
+            else:
+                self.residual.record(int(error * parclock.NS_PER_SECOND))
+        self.reports.append(point)
+
+        fit = self.fit()
+        if fit is not None:
+            self.drift = fit[2] - 1.0
+            now = parclock.now()
+            start_ns = int((now - self.predict(fit, now)) * parclock.NS_PER_SECOND)
+            if self.start_ns is None or abs(start_ns - self.start_ns) >= self.threshold_ns:
+                if self._stop_sync.is_set() is False:
+                    self.start_ns = start_ns
+                    self.on_correction(start_ns)
+        return True
+
+    def fit(self):
+        """ (mean clock time, mean media time, rate) of the reports, or None if too few """
+        count = len(self.reports)
+        if count < self.min_samples:
+            return None
+        media_mean = sum(media for media, clock in self.reports) / count
+        clock_mean = sum(clock for media, clock in self.reports) / count
+        sxx = sxy = 0.0
+        for media, clock in self.reports:
+            sxx += (clock - clock_mean) ** 2
+            sxy += (clock - clock_mean) * (media - media_mean)
+        rate = sxy / sxx if sxx > 0.0 else 1.0
+        rate = min(max(rate, 1.0 - self.max_drift), 1.0 + self.max_drift)
+        return clock_mean, media_mean, rate
+
+    @staticmethod
+    def predict(fit, clock):
+        """ Media time (seconds) at a clock time, by the fit """
+        clock_mean, media_mean, rate = fit
+        return media_mean + (clock - clock_mean) * rate
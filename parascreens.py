@@ -4,9 +4,9 @@ from kivy.uix.relativelayout import RelativeLayout
 from kivy.uix.button import Button
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
+from kivy.core.window import Window
 from re import match
 # from kivy.uix.widget import Widget
-# from kivy.core.window import Window
 # from kivy.uix.image import Image
 # from kivy.properties import ListProperty, NumericProperty, ReferenceListProperty, ObjectProperty
 # from kivy.config import Config
@@ -25,6 +25,9 @@ class HomeScreen(FloatLayout):
     def __init__(self, main_app):
         self.app = main_app
         self.test_me = False
+        self.hovered = None  # SequenceButton under the mouse pointer
+        self.load_hovered = False  # pointer is over the bank Load button
+        Window.bind(mouse_pos=self.on_mouse_pos)
         # self._keyboard = Window.request_keyboard(self._keyboard_closed, self)
         # self._keyboard.bind(on_key_down=self._on_keyboard_down)
         super(FloatLayout, self).__init__()
@@ -48,6 +51,25 @@ class HomeScreen(FloatLayout):
         self._keyboard.unbind(on_key_down=self._on_keyboard_down)
         self._keyboard = None
 
+    def on_mouse_pos(self, window, pos):
+        """Tells the app when the pointer moves onto a sequence button (so it can prefetch it)
+        or onto the bank Load button (so it can preload the bank named)"""
+        load_button = self.ids.btn_load_bank
+        load_hovered = load_button.collide_point(*load_button.parent.to_widget(*pos))
+        if load_hovered and not self.load_hovered:
+            self.preload_bank()
+        self.load_hovered = load_hovered
+
+        hovered = None
+        for button in self.app.sequences:
+            if button.parent is not None and button.collide_point(*button.parent.to_widget(*pos)):
+                hovered = button
+                break
+        if hovered is not self.hovered:
+            self.hovered = hovered
+            if hovered is not None:
+                self.app.on_seq_hover(hovered)
+
     def clear(self):
         self.ids.light_panel.clear_widgets()
 
@@ -61,6 +83,9 @@ class HomeScreen(FloatLayout):
         self.app.on_load_bank(self.ids.bank_name.text)
         self.ids.bank_name.text = ''
 
+    def preload_bank(self):
+        self.app.on_preload_bank(self.ids.bank_name.text)
+
 
 class ChannelLight(RelativeLayout):
     def __init__(self, index):
@@ -93,6 +118,7 @@ class SequenceButton(Button):
         """A button with which to control a sequence"""
         super(Button, self).__init__()
         self.trigger_time = 0.0
+        self.prefetched = False  # prefetch requested (see TrinityApp.on_seq_hover)
         self.sequence_name = sequence_name
         if match('.+\.$', self.sequence_name) is None:
             self.text = sequence_name
@@ -27,23 +27,69 @@ NEW FEATURE: you can add a header value for offset in a seqx file and that numbe
 entire sequence.
 entire sequence.
 
+* ControlList events are held in an EventStore (parallel array columns)
+instead of a list of ControlEvent objects.  ControlEvents are built only when
+a caller asks for one.  saveXML() no longer writes each event twice.
+
+* TimeCode is based on a single integer nanosecond value (slotted).  Frames
+and seconds are derived from it; getNextByTime() compares raw nanoseconds, so
+events fire on their exact time instead of the nearest frame.
+
+* Added the binary .seqb sequence format (saveBinary(), loadBinary()).  It
+is memory mapped on load; see seqconvert.py to convert .seqx files.
+
+* Sequences play on their ref_time column through a TempoMap.  scale() no
+longer rewrites the event times: it changes the tempo at the current position,
+optionally ramping to the new rate, and returned events carry the time they
+were played at.
+
 ***************************************************** """
 
 # from __future__ import division
 from math import fabs
+from functools import lru_cache
+from array import array
+from bisect import bisect_left, bisect_right
 import parallel
-import operator
+import heapq
 import time
 import random
 import socket
 import os.path
+import os
+import sys
+import mmap
+import struct
+import re
 # import sys
 import threading
+import queue
 # from multiprocessing import Queue
 import xml.etree.ElementTree as ET  # XML support
 import paraplayer
+import parstats
+import parclock
+
+try:
+    import numpy as np  # optional, used by ControlList.reconcile() for large lists
+except ImportError:
+    np = None
 
 max_channels = 24  
+reconcile_numpy_min = 5000  # reconcile() uses NumPy (if installed) from this many events
+
+# .seqb binary sequence file: a fixed little-endian header, then one packed
+# fixed-width block per EventStore column (each padded to 8 bytes)
+seqb_magic = b"SEQB"
+seqb_version = 1
+seqb_header = struct.Struct("<4sHHIQqiidqqqq64s")
+seqb_header_size = (seqb_header.size + 7) & ~7
+seqb_looping = 0x1  # header flags
+seqb_scale_pending = 0x2
+
+# event elements and their times (not ref_time), for ControlList.readHeader() of a file without count and duration
+xml_event_tag = re.compile(rb'<event[\s/>]')
+xml_time_attribute = re.compile(rb'\stime\s*=\s*["\']([^"\']*)["\']')
 
 
 # *********************** Channel ****************************
@@ -102,28 +148,117 @@ class ChannelMap(object):
 
 # ***************** TimeCode **************************
 
+NS_PER_SECOND = 1000000000
+FRAMES_PER_SECOND = 30
+
+
+def framesToNanos(frames):
+    """ converts a frame count (int) to nanoseconds, rounded to the nearest ns """
+    return (frames * 2 * NS_PER_SECOND + FRAMES_PER_SECOND) // (2 * FRAMES_PER_SECOND)
+
+
+def nanosToFrames(nanos):
+    """ converts nanoseconds to the nearest frame count (int) """
+    return (nanos * FRAMES_PER_SECOND + NS_PER_SECOND // 2) // NS_PER_SECOND
+
+
+def secondsToNanos(seconds):
+    """ converts float seconds to nanoseconds (int) """
+    return int(round(seconds * NS_PER_SECOND))
+
+
+def maskBits(mask):
+    """ Yields the set bits of a channel bitmask, lowest first, as 0-based
+        channel indexes (bit 0 = channel 1) """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+@lru_cache(maxsize=4096)
+def _smpte(frames):
+    """ formats a frame count as a SMPTE string; cached since the same times are formatted over and over """
+    hours, remainder = divmod(frames, 108000)
+    minutes, remainder = divmod(remainder, 1800)
+    secs, frms = divmod(remainder, 30)
+    return "%d:%d:%d:%d" % (hours, minutes, secs, frms)
+
+
+def _toNanos(value):
+    """ converts any value accepted by TimeCode.setTime() to nanoseconds without building a TimeCode.
+        Returns None if the value is not understood """
+    if isinstance(value, TimeCode):
+        return value.nanos
+    elif isinstance(value, float):  # float value assumed to be seconds!
+        return int(round(value * NS_PER_SECOND))
+    elif isinstance(value, int):  # int value is frames
+        return framesToNanos(value)
+    elif isinstance(value, str):
+        multipliers = [108000, 1800, 30, 1]
+        split_tc = value.strip().split(':')
+        count = len(split_tc)
+        index = 1
+        frames = 0
+        # parse string from the right-hand-side
+        while count > 0:
+            try:
+                count -= 1
+                frames += int(split_tc[count]) * multipliers[4-index]
+                index += 1
+            except:
+                print("There was an error in the timecode string.\nPlease use ':' to separate all fields")
+                frames = 0
+                break
+        return framesToNanos(frames)
+    else:
+        return None
+
 
 class TimeCode(object):
-    """Stores a time code value in frames and formats it as SMPTE string"""
-    version = 2.0
+    """Stores a time code value and formats it as SMPTE string.
+    Version 3 keeps a single integer nanosecond value; frames (1/30 sec) and
+    float seconds are derived from it.  Hot code may read or compare .nanos
+    directly instead of building TimeCode objects"""
+    __slots__ = ("nanos",)
+    version = 3.0
 
     def __init__(self, value=0):
-        self.total_frames = int(0)
-        self.seconds = float(0.0)  # new 7/2012
+        self.nanos = 0
         self.setTime(value)
 
+    @classmethod
+    def fromNanos(cls, nanos):
+        """ Returns a new TimeCode for an integer nanosecond value (no conversion) """
+        result = cls.__new__(cls)
+        result.nanos = nanos
+        return result
+
+    @classmethod
+    def now(cls):
+        """ Returns the current clock time (see parclock) as a TimeCode """
+        return cls.fromNanos(parclock.nowNanos())
+
+    @property
+    def total_frames(self):
+        return (self.nanos * FRAMES_PER_SECOND + NS_PER_SECOND // 2) // NS_PER_SECOND
+
+    @total_frames.setter
+    def total_frames(self, frames):
+        self.nanos = framesToNanos(int(frames))
+
+    @property
+    def seconds(self):
+        return self.nanos / NS_PER_SECOND
+
+    @seconds.setter
+    def seconds(self, seconds):
+        self.nanos = int(round(seconds * NS_PER_SECOND))
+
     def __cmp__(self, other):
         """Comparison routine for cmp() BIF"""
-        if isinstance(other, TimeCode):
-            if self.total_frames != other.total_frames:
-                if self.total_frames < other.total_frames:
-                    return -1
-                else:
-                    return 1
-            else:
-                return 0
-        elif isinstance(other, int) or isinstance(other, int):
-            frames = int(other)
+        if isinstance(other, (TimeCode, int)):
+            frames = _frames(other)
             if self.total_frames != frames:
                 if self.total_frames < frames:
                     return -1
@@ -134,20 +269,21 @@ class TimeCode(object):
         else:
             return False  # not a matching type
 
+    # comparisons are by frame, as always; an int is taken as a frame count
     def __lt__(self, other):
-        return self.total_frames < other.total_frames
+        return self.total_frames < _frames(other)
 
     def __gt__(self, other):
-        return self.total_frames > other.total_frames
+        return self.total_frames > _frames(other)
 
     def __eq__(self, other):
-        return self.total_frames == other.total_frames
+        return self.total_frames == _frames(other)
 
     def __le__(self, other):
-        return self.total_frames <= other.total_frames
+        return self.total_frames <= _frames(other)
 
     def __ge__(self, other):
-        return self.total_frames >= other.total_frames
+        return self.total_frames >= _frames(other)
 
     def __str__(self):
         return self.SMPTE()
@@ -156,61 +292,26 @@ class TimeCode(object):
         return str(self.total_frames)
 
     def __add__(self, other):
-        result = self.__class__(other)
-        result.addTime(self.seconds)
-        return result
+        return self.__class__.fromNanos(self.nanos + _toNanos(other))
 
-    def __radd__(self, other):
-        result = self.__class__(other)
-        result.addTime(self.seconds)
-        return result
+    __radd__ = __add__
 
     def __sub__(self, other):
-        result = self.__class__(self.seconds)
-        result.addTime(-other.seconds)
-        return result
+        return self.__class__.fromNanos(self.nanos - _toNanos(other))
 
     def __mul__(self, other):
-        result = self.__class__(self)
         if isinstance(other, TimeCode):
-            result.setTime(self.seconds * other.seconds)
+            return self.__class__(self.seconds * other.seconds)
         else:
             # note - mulitplies by factor, not another time
-            result.setTime(self.seconds * float(other))
-        return result
+            return self.__class__.fromNanos(int(round(self.nanos * float(other))))
         
     def setTime(self, timecode):
-        """Reads a SMPTE timecode string and sets the total_frames value"""
-        if isinstance(timecode, str):
-            multipliers = [108000, 1800, 30, 1]
-            timecode = timecode.strip()
-            split_tc = timecode.split(':')
-            count = len(split_tc)
-            index = 1
-            self.total_frames = 0
-            # parse string from the right-hand-side
-            while count > 0:
-                try:
-                    count -= 1
-                    self.total_frames += int(split_tc[count]) * multipliers[4-index]
-                    index += 1
-                except:
-                    print("There was an error in the timecode string.\nPlease use ':' to separate all fields")
-                    self.total_frames = int(0)
-                    break
-            self.makeSeconds()
-        elif isinstance(timecode, int):
-            self.total_frames = int(timecode)
-            self.makeSeconds()
-        elif isinstance(timecode, int):
-            self.total_frames = timecode
-            self.makeSeconds()
-        elif isinstance(timecode, float):  # float value assumed to be seconds!
-            self.seconds = timecode
-            self.makeFrames()
-        elif isinstance(timecode, TimeCode):
-            self.seconds = timecode.seconds
-            self.makeFrames()
+        """Sets the time from a SMPTE timecode string, frames (int),
+        seconds (float) or another TimeCode"""
+        nanos = _toNanos(timecode)
+        if nanos is not None:
+            self.nanos = nanos
         else:
             print('Time not set for new TimeCode instance; ' + str(type(timecode)) + ' passed')
 
@@ -221,39 +322,20 @@ class TimeCode(object):
     def getSeconds(self):
         """Returns time in seconds expressed as a float
             (converts frames to fractional seconds)"""
-        return self.seconds
+        return self.nanos / NS_PER_SECOND
 
     def SMPTE(self):
         """Returns the timecode as a SMPTE string (""3:59:12:1"")"""
-        multipliers = [108000, 1800, 30, 1]
-        index = 0
-        # remainder = int(self.total_frames)
-        remainder = int(self.getTime())
-        result = ""
-        while index < 4:
-            value = divmod(remainder, multipliers[index])
-            result += str(value[0])
-            index += 1
-            if index < 4:
-                result += ":"
-            remainder = value[1]
-        return result
+        return _smpte(self.total_frames)
 
     def addTime(self, time_to_add):
-        """Adds time (int or SMPTE string) to this timecode object"""
-        # temp was previously based on total_frames
-        temp = self.seconds
-        self.setTime(time_to_add)
-        self.seconds += temp
-        self.makeFrames()
+        """Adds time (int frames, float seconds or SMPTE string) to this timecode object"""
+        self.nanos += _toNanos(time_to_add)
 
-    # calculate frames value from seconds value
-    def makeFrames(self):
-        self.total_frames = int(round(self.seconds * 30.0))
 
-    # calculate frames value from seconds value
-    def makeSeconds(self):
-        self.seconds = float(self.total_frames) / 30.0
+def _frames(value):
+    """ frame count of a TimeCode or of a raw int (already frames) """
+    return value if isinstance(value, int) else value.total_frames
 
 
 # ***************** ControlEvent **************************
@@ -430,7 +512,496 @@ class ControlEvent(object):
         else:
             print("loadFromXML is confused")
             
-                      
+
+# ***************** EventStore **************************
+
+
+class EventStore(object):
+    """ Columnar storage for the events of a ControlList.  Each event
+        attribute is kept in its own array.array column so a sequence costs a
+        few bytes per event instead of a ControlEvent and its TimeCodes.
+        Times and durations are stored as integer nanoseconds (the TimeCode
+        basis), actions as a small code (see ACTIONS).
+
+        A store loaded from a .seqb file may hold memoryviews over the mapped
+        file instead of arrays (zero-copy).  Anything that grows or shrinks the
+        columns in place calls own() first to turn them into arrays.
+
+        The store behaves like a list of ControlEvents: indexing and iterating
+        build ControlEvent objects on demand.  These are copies - changing one
+        does not change the store.
+
+        version counts edits, so a compiled Timeline can tell it is stale.
+        Code that replaces or writes into a column directly calls changed().
+        Bulk appends (extend(), appendColumns()) are told apart from other
+        edits, so a Timeline of the events before them can be grown rather
+        than compiled again (see grownFrom()). """
+
+    ACTIONS = ("off", "on", "trig")
+    ACTION_CODES = {"off": 0, "on": 1, "trig": 2}
+    columns = (("time", "q"), ("ref_time", "q"), ("level", "i"), ("channel", "i"), ("action", "b"),
+               ("duration", "q"), ("value", "i"), ("sequence", "i"))
+
+    def __init__(self, source=None):
+        for name, code in self.columns:
+            setattr(self, name, array(code))
+        self.mapping = None  # mmap backing memoryview columns, if any
+        self.version = 0  # bumped by every edit, see changed()
+        self.sorted_version = None  # version last known to be in time order, see isSorted()
+        self.append_version = 0  # version after the last bulk append
+        self.edit_version = 0  # version before the run of bulk appends that led to append_version
+        if isinstance(source, EventStore):
+            self.extend(source)
+        elif source is not None:
+            for ev in source:
+                self.append(ev)
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.time)
+        if not 0 <= index < len(self.time):
+            raise IndexError("event index out of range")
+        ev = ControlEvent()
+        ev.time.nanos = self.time[index]
+        ev.ref_time.nanos = self.ref_time[index]
+        ev.level = self.level[index]
+        ev.channel = self.channel[index]
+        ev.action = self.ACTIONS[self.action[index]]
+        ev.duration.nanos = self.duration[index]
+        ev.value = self.value[index]
+        ev.sequence = self.sequence[index]
+        return ev
+
+    def __iter__(self):
+        for i in range(len(self.time)):
+            yield self[i]
+
+    def __delitem__(self, index):
+        self.own()
+        for name, code in self.columns:
+            del getattr(self, name)[index]
+        self.version += 1
+
+    def changed(self):
+        """ Marks the events as edited (call after changing a column directly) """
+        self.version += 1
+
+    def appended(self):
+        """ Marks a bulk append: the events before it are unchanged """
+        if self.append_version != self.version:
+            self.edit_version = self.version  # the appends start a new run
+        self.version += 1
+        self.append_version = self.version
+
+    def grownFrom(self, version):
+        """ True if events have only been appended (in bulk) since version """
+        return self.version == self.append_version and self.edit_version <= version
+
+    def own(self):
+        """ Copies any columns that are views of a mapped file into arrays and
+            closes the mapping, so the file is no longer held open """
+        if self.mapping is not None:
+            for name, code in self.columns:
+                col = getattr(self, name)
+                if not isinstance(col, array):
+                    owned = array(code)
+                    owned.frombytes(col.cast("B"))
+                    col.release()
+                    setattr(self, name, owned)
+            try:
+                self.mapping.close()
+            except BufferError:
+                pass  # a view of it is still in use; it closes when that goes
+            self.mapping = None
+
+    def __getstate__(self):
+        """ Pickles as the raw bytes of each column - compact, and works for
+            mapped stores (e.g. sequences parsed in a process pool) """
+        return dict((name, memoryview(getattr(self, name)).cast("B").tobytes()) for name, code in self.columns)
+
+    def __setstate__(self, state):
+        self.mapping = None
+        self.version = 0
+        self.sorted_version = None
+        self.append_version = 0
+        self.edit_version = 0
+        for name, code in self.columns:
+            col = array(code)
+            col.frombytes(state[name])
+            setattr(self, name, col)
+
+    def attach(self, mapping, offset, count):
+        """ Points the columns at count events packed in mapping (an mmap)
+            starting at offset, without copying.  Returns the end offset """
+        self.mapping = mapping
+        view = memoryview(mapping)
+        for name, code in self.columns:
+            size = count * array(code).itemsize
+            setattr(self, name, view[offset:offset + size].cast(code))
+            offset += (size + 7) & ~7
+        view.release()
+        self.version += 1
+        return offset
+
+    @classmethod
+    def actionCode(cls, action):
+        """ returns the column code for an action string (unknown actions are 'off') """
+        return cls.ACTION_CODES.get(action, 0)
+
+    def add(self, time_ns, ref_time_ns, level, channel, action, duration_ns=0, value=0, sequence=0):
+        """ Appends one event from raw values. Times are in nanoseconds, action is a code, not a string """
+        if self.mapping is not None:
+            self.own()
+        self.time.append(time_ns)
+        self.ref_time.append(ref_time_ns)
+        self.level.append(level)
+        self.channel.append(channel)
+        self.action.append(action)
+        self.duration.append(duration_ns)
+        self.value.append(value)
+        self.sequence.append(sequence)
+        self.version += 1
+
+    def append(self, ev):
+        """ Appends a ControlEvent (its values are copied) """
+        self.add(ev.time.nanos, ev.ref_time.nanos, ev.level, ev.channel, self.actionCode(ev.action),
+                 ev.duration.nanos, ev.value, ev.sequence)
+
+    def extend(self, other):
+        """ Appends all events of another EventStore (or any iterable of ControlEvents).
+            The time column goes last: len() counts it, so a reader on another
+            thread never sees part of an event """
+        if isinstance(other, EventStore):
+            self.own()
+            for name, code in self.columns[1:] + self.columns[:1]:
+                getattr(self, name).frombytes(memoryview(getattr(other, name)).cast("B"))
+            self.appended()
+        else:
+            for ev in other:
+                self.append(ev)
+
+    def appendColumns(self, count, **columns):
+        """ Appends count events given column by column: each keyword names a
+            column and holds a buffer (array.array, NumPy array...) of count
+            items of that column's type.  Columns not given are filled with 0 """
+        self.own()
+        for name, code in self.columns:
+            col = getattr(self, name)
+            data = columns.get(name)
+            if data is None:
+                col.frombytes(bytes(count * col.itemsize))
+            else:
+                view = memoryview(data).cast("B")
+                if len(view) != count * col.itemsize:
+                    raise ValueError("column {0} needs {1} items of {2} bytes".format(name, count, col.itemsize))
+                col.frombytes(view)
+        self.appended()
+
+    def clear(self):
+        for name, code in self.columns:
+            setattr(self, name, array(code))
+        self.mapping = None
+        self.version += 1
+
+    def copy(self):
+        """ Returns an exact copy of this store """
+        return EventStore(self)
+
+    def copyEvents(self, default_channel=0):
+        """ Returns a copy made the way ControlEvent(ev) copies an event: times
+            and durations are rounded to whole frames and ref_time is reset to
+            the (possibly scaled) time.  Channel 0 events are moved to
+            default_channel if it is set """
+        result = EventStore()
+        frame_times = array("q", [framesToNanos(nanosToFrames(t)) for t in self.time])
+        result.time = frame_times
+        result.ref_time = array("q", frame_times)
+        result.level = array("i", self.level)
+        if default_channel > 0:
+            result.channel = array("i", [ch if ch != 0 else default_channel for ch in self.channel])
+        else:
+            result.channel = array("i", self.channel)
+        result.action = array("b", self.action)
+        result.duration = array("q", [framesToNanos(nanosToFrames(d)) for d in self.duration])
+        result.value = array("i", self.value)
+        result.sequence = array("i", self.sequence)
+        return result
+
+    def take(self, indices):
+        """ Keeps only the events at indices, in that order (reorders or filters in one pass) """
+        for name, code in self.columns:
+            col = getattr(self, name)
+            setattr(self, name, array(code, [col[i] for i in indices]))
+        self.version += 1
+
+    def frames(self, index):
+        """ Returns the time of an event in frames, as TimeCode.total_frames would """
+        return nanosToFrames(self.time[index])
+
+    def isSorted(self):
+        """ True if the events are in time order.  Remembered until the next edit """
+        if self.sorted_version != self.version:
+            key = self.time
+            if any(key[i] > key[i + 1] for i in range(len(key) - 1)):
+                return False
+            self.sorted_version = self.version
+        return True
+
+    def sort(self):
+        """ Sorts events in time order.  Like list.sort() it is stable """
+        if not self.isSorted():
+            key = self.time
+            self.take(sorted(range(len(key)), key=key.__getitem__))
+            self.sorted_version = self.version
+
+    def merge(self, runs):
+        """ Merges runs of events into this store in time order: a k-way merge
+            of the runs (each already sorted, or sorted on its own first), with
+            the result spliced into this store's events by bisection, rather
+            than a resort of everything.
+
+            Each run is (store, offset_frames, default_channel) and is taken
+            the way copyEvents(default_channel) copies it, with the offset
+            added to the whole-frame times as the events are merged - the run
+            itself is not copied or changed.  Equal times keep this store's
+            events first, then run order, then the order within the run, as a
+            stable sort of all the runs appended to this store would """
+        self.own()
+        self.sort()  # usually known to be sorted already
+        keys = []
+        columns = []  # per run, the values of each column as copyEvents() would make them
+        for r, (store, frames, default_channel) in enumerate(runs):
+            times = [framesToNanos(nanosToFrames(t) + frames) for t in store.time]
+            order = range(len(times))
+            if any(times[i] > times[i + 1] for i in range(len(times) - 1)):
+                order = sorted(order, key=times.__getitem__)
+            keys.append([(times[i], r, i) for i in order])
+            if default_channel > 0:
+                channel = [ch if ch != 0 else default_channel for ch in store.channel]
+            else:
+                channel = store.channel
+            columns.append({"time": times, "ref_time": times, "level": store.level, "channel": channel,
+                            "action": store.action, "value": store.value, "sequence": store.sequence,
+                            "duration": [framesToNanos(nanosToFrames(d)) for d in store.duration]})
+        merged = list(heapq.merge(*keys))
+        if not merged:
+            return
+
+        # group the new events by where they go among the existing ones
+        times = self.time
+        groups = []  # (position in this store, first, end) in merged
+        pos = -1
+        for j, (t, r, i) in enumerate(merged):
+            at = bisect_right(times, t, max(pos, 0))
+            if at != pos:
+                if groups:
+                    groups[-1][2] = j
+                groups.append([at, j, 0])
+                pos = at
+        groups[-1][2] = len(merged)
+
+        for name, code in self.columns:
+            old = getattr(self, name)
+            new = [columns[r][name][i] for t, r, i in merged]
+            col = array(code)
+            prev = 0
+            for at, first, end in groups:
+                col.extend(old[prev:at])
+                col.extend(new[first:end])
+                prev = at
+            col.extend(old[prev:])
+            setattr(self, name, col)
+        self.version += 1
+        self.sorted_version = self.version
+
+    def nbytes(self):
+        """ Approximate memory held by the columns, in bytes """
+        return sum(len(getattr(self, name)) * getattr(self, name).itemsize for name, code in self.columns)
+
+
+# ***************** Timeline **************************
+
+
+class Timeline(object):
+    """ Compiled playback form of an EventStore, built by ControlList.timeline()
+        and not changed afterwards.  Events are grouped into steps: runs of
+        events that fall due together.  For each step it keeps the due time
+        (reference time, ns - see TempoMap), the due frame, the index of its
+        first event and the channel bitmask delta - the channels the step turns on and off (bit 0 =
+        channel 1, trig counts as off, channel 0 is left out).
+
+        Events play in list order, so an event that is out of time order falls
+        due with the event before it: a step's due time is the latest event
+        time so far.  That keeps the due times sorted, and seeking to any time
+        is a bisect.
+
+        version is the store version it was compiled from; a store edited
+        since (see EventStore.changed()) needs a new Timeline, one that has
+        only been appended to can be grown (see grow()). """
+
+    def __init__(self, store):
+        self.store = store
+        self.version = store.version
+        self.count = 0
+        self.due = array("q")  # due reference time of each step, ns from the start of the sequence
+        self.first = array("q", [0])  # index of the first event of each step, then count
+        self.on_masks = []  # channels each step turns on
+        self.off_masks = []  # channels each step turns off
+        self.frames = array("q")  # due frame of each step
+        self.grow()
+
+    def grow(self):
+        """ Compiles the events appended to the store since it was compiled.
+            Events that fall due with the last step join it """
+        store = self.store
+        self.version = store.version
+        end = len(store)  # read after the version: a later append is compiled next time
+        times = store.ref_time
+        channels = store.channel
+        actions = store.action
+        self.first.pop()  # the end marker
+        latest = None
+        on_mask = off_mask = 0
+        if len(self.due) > 0:
+            latest = self.due[-1]
+            on_mask = self.on_masks.pop()
+            off_mask = self.off_masks.pop()
+        for i in range(self.count, end):
+            t = times[i]
+            if latest is None or t > latest:  # a new step
+                if latest is not None:
+                    self.on_masks.append(on_mask)
+                    self.off_masks.append(off_mask)
+                    on_mask = off_mask = 0
+                latest = t
+                self.due.append(t)
+                self.first.append(i)
+            channel = channels[i]
+            if channel > 0:
+                bit = 1 << (channel - 1)
+                if actions[i] == 1:  # on
+                    on_mask |= bit
+                    off_mask &= ~bit
+                else:
+                    off_mask |= bit
+                    on_mask &= ~bit
+        if latest is not None:
+            self.on_masks.append(on_mask)
+            self.off_masks.append(off_mask)
+        self.first.append(end)
+        self.frames.extend(nanosToFrames(t) for t in self.due[len(self.frames):])
+        self.count = end
+
+    def __len__(self):
+        return len(self.due)
+
+    def seek(self, time_ns, step=0):
+        """ Returns the number of steps due at reference time time_ns (ns from
+            the start of the sequence), i.e. the index of the first step not yet due.  Steps
+            before step are taken as due already """
+        return bisect_right(self.due, time_ns, step)
+
+    def stepOf(self, index):
+        """ Returns the step that holds the event at index """
+        return bisect_right(self.first, index) - 1
+
+    def indexAtFrame(self, frames):
+        """ Returns the index of the first event due on or after frames
+            (count if there is none) """
+        return self.first[bisect_left(self.frames, frames)]
+
+    def steps(self, step=0):
+        """ Iterates over the steps from step on as due batches:
+            (due ns, first event index, end index, on mask, off mask) """
+        first = self.first
+        for i in range(step, len(self.due)):
+            yield self.due[i], first[i], first[i + 1], self.on_masks[i], self.off_masks[i]
+
+
+# ***************** TempoMap **************************
+
+
+class TempoMap(object):
+    """ Maps playback time (ns of clock time since a sequence started) to
+        reference time (ns on the sequence's ref_time scale), piecewise
+        linearly.  A scale factor of 2 plays the events at half speed: each
+        reference ns takes 2 ns of playback time.
+
+        A tempo change adds a breakpoint at the current playback position and
+        plays on at the new factor from there, so the events are never
+        rewritten and the position does not jump.  A ramp glides to the new
+        factor through ramp_segments short segments.
+
+        Factors are kept as fixed point integers (2**20 = 1.0) so that
+        wallAt() and refAt() round trip exactly: an event is always due at
+        the playback time wallAt() gives for it. """
+
+    ramp_segments = 16
+    fixed_one = 1 << 20
+
+    def __init__(self, scale_factor=1.0):
+        self.wall = array("q", [0])  # playback time of each breakpoint
+        self.ref = array("q", [0])  # reference time of each breakpoint
+        self.scales = array("q", [self.fixed(scale_factor)])  # factor from each breakpoint on
+        self.unscaled = self.scales[0] == self.fixed_one  # playback time is reference time
+
+    @classmethod
+    def fixed(cls, scale_factor):
+        return max(int(round(scale_factor * cls.fixed_one)), 1)
+
+    def restart(self):
+        """ Starts again from playback time 0 = reference time 0, at the factor
+            the map ends on (a ramp in progress is completed) """
+        self.wall = array("q", [0])
+        self.ref = array("q", [0])
+        self.scales = array("q", [self.scales[-1]])
+        self.unscaled = self.scales[0] == self.fixed_one
+
+    def scaleFactor(self):
+        """ The factor the map ends on """
+        return self.scales[-1] / self.fixed_one
+
+    def refAt(self, wall_ns):
+        """ Reference time (ns) at playback time wall_ns """
+        k = len(self.wall) - 1
+        if wall_ns < self.wall[k]:
+            k = max(bisect_right(self.wall, wall_ns) - 1, 0)
+        return self.ref[k] + ((wall_ns - self.wall[k]) << 20) // self.scales[k]
+
+    def wallAt(self, ref_ns):
+        """ Earliest playback time (ns) at which reference time ref_ns is reached """
+        k = len(self.ref) - 1
+        if ref_ns < self.ref[k]:
+            k = max(bisect_right(self.ref, ref_ns) - 1, 0)
+        return self.wall[k] - ((-(ref_ns - self.ref[k]) * self.scales[k]) >> 20)
+
+    def setScale(self, wall_ns, scale_factor, ramp_ns=0):
+        """ Plays at scale_factor from playback time wall_ns on, reached over
+            ramp_ns if given.  Replaces any tempo changes after wall_ns """
+        ref_ns = self.refAt(wall_ns)
+        k = bisect_right(self.wall, wall_ns)
+        start_scale = self.scales[max(k - 1, 0)]
+        del self.wall[k:], self.ref[k:], self.scales[k:]
+
+        target = self.fixed(scale_factor)
+        segments = self.ramp_segments if ramp_ns > 0 else 0
+        for j in range(segments + 1):
+            at = wall_ns + ramp_ns * j // segments if segments else wall_ns
+            scale = target if j == segments else start_scale + (target - start_scale) * (2 * j + 1) // (2 * segments)
+            if j > 0:
+                ref_ns = self.refAt(at)
+            if self.wall and self.wall[-1] == at:
+                self.scales[-1] = scale
+            else:
+                self.wall.append(at)
+                self.ref.append(ref_ns)
+                self.scales.append(scale)
+        self.unscaled = False
+
+
 # ***************** ControlList **************************
 
 
@@ -448,14 +1019,20 @@ class ControlList(object):
         self.next_event = 1000000  # arb large... for getNextByXXXX()
         self.eof = False
 
-        self.start_time = TimeCode(0)  # real (system) time start of sequence
+        self.compiled = None  # Timeline of the events, see timeline()
+        self.next_step = 0  # timeline step of next_event, for getNextByTime()
+        self.due_end = 0  # events before this index are known to be due (getNextByTime)
+
+        self.start_time = TimeCode(0)  # clock time (see parclock) the sequence started
         self.looping = False  # this is a looping sequence
 
-        self.cur_state = [0] * (max_channels + 1)  # one entry for each channel
+        self.cur_state = [0] * (max_channels + 1)  # on count for each channel
+        self.active_mask = 0  # bit i is set while cur_state[i] > 0
         self.cleanup = []  # array of ControlEvents to bring all channels to off
 
         self.scale_factor = 1.0  # for scaleOnNext()
         self.scale_pending = False  # for scaleOnNext()
+        self.tempo = TempoMap()  # playback time to ref_time, see scale()
 
         self.ref_beat_period = TimeCode(0)
         self.ref_first_beat = TimeCode(0)
@@ -466,18 +1043,19 @@ class ControlList(object):
         self.sync_object = None  # reference to external beatnik object
         
         # initialize list with at least one event (to assert the level)
-        if isinstance(initializer, ControlList):            
-            self.events = []
-            for ev in initializer.events:
-                nextevent = ControlEvent(ev)
-                self.events.append(nextevent)
-        elif isinstance(initializer, str):  # XML file path
-            self.events = []
-            self.loadXML(initializer)
+        # events are held in columns (EventStore), ControlEvents are built on request
+        if isinstance(initializer, ControlList):
+            self.events = initializer.events.copyEvents()
+        elif isinstance(initializer, str):  # XML (.seqx) or binary (.seqb) file path
+            self.events = EventStore()
+            if initializer.endswith(".seqb"):
+                self.loadBinary(initializer)
+            else:
+                self.loadXML(initializer)
         else:
             event1 = ControlEvent(initializer)
             event1.level = level
-            self.events = [event1]
+            self.events = EventStore([event1])
 
     def __str__(self):
         result = ""
@@ -488,7 +1066,7 @@ class ControlList(object):
     def __add__(self, other):
         result = ControlList(self)
         if isinstance(other, ControlList):
-            result.events += other.events
+            result.events.extend(other.events)
         elif isinstance(other, ControlEvent):
             self.addEvent(other)
 
@@ -498,7 +1076,7 @@ class ControlList(object):
         self.start()
         while not self.atEnd():
             lock.acquire()
-            ev = self.getNextByTime()
+            ev = self.dueEvent()
             if isinstance(ev, ControlEvent):
                 out_queue.put(ev)
             lock.release()
@@ -533,6 +1111,11 @@ class ControlList(object):
         self.events.append(new1)
         return new1
 
+    def addEvents(self, store):
+        """Adds all events of an EventStore to the list, as addEvent() would
+        one at a time, without building ControlEvent objects"""
+        self.events.extend(store.copyEvents(self.defchannel))
+
     def sortEvents(self):
         """Sorts events in the list in time-order"""
         self.events.sort()
@@ -560,9 +1143,11 @@ class ControlList(object):
             frames = offset.total_frames
         else:
             frames = int(offset)
-        
-        for ev in self.events:
-            ev.time.addTime(frames)
+
+        nanos = framesToNanos(frames)
+        self.events.time = array("q", [t + nanos for t in self.events.time])
+        self.events.ref_time = array("q", [t + nanos for t in self.events.ref_time])
+        self.events.changed()
 
     # New for 2017... to replace the one above. Main issue was adding a negative offset to time 0 events
     # This ignores time 0 events as special cases
@@ -574,13 +1159,14 @@ class ControlList(object):
         else:
             frames = int(offset)
 
-        for ev in self.events:
-            if ev.ref_time.total_frames > 0:
-                ev.ref_time.total_frames += frames
-                if ev.ref_time.total_frames < 0:
-                    ev.ref_time.total_frames = 0
-            ev.ref_time.makeSeconds()
-            ev.time = ev.ref_time
+        ref_times = self.events.ref_time
+        for i in range(len(ref_times)):
+            ref_frames = nanosToFrames(ref_times[i])
+            if ref_frames > 0:
+                ref_frames = max(ref_frames + frames, 0)
+            ref_times[i] = framesToNanos(ref_frames)
+        self.events.time = array("q", ref_times)
+        self.events.changed()
 
     # original version - see FAILED-1 for new version
     def setBaseTime(self, base_time=0):
@@ -595,24 +1181,21 @@ class ControlList(object):
 
     def overlay(self, other_list, time_offset=0):
         """Overlays another list on this one. with an optional time offset"""
-        # Create a unique instance of other_list
-        other = ControlList(other_list)
-        
-        # Add time offset to other list
-        ofs = TimeCode(time_offset)
-        if ofs.total_frames != 0:
-            other.offsetTime(ofs.total_frames)
-        
-        if isinstance(other, ControlList):
-            for ev in other.events:
-                self.addEvent(ev)
-        elif isinstance(other, ControlEvent):
-            self.addEvent(other)
-        else:
-            print('Overlay failed; illegal argument type')
-        
-        # Sort events in time order
-        self.sortEvents()
+        self.overlay_many([(other_list, time_offset)])
+
+    def overlay_many(self, lists):
+        """Overlays several lists on this one in one pass.  Each item is a
+        ControlList (or ControlEvent) or a (list, time_offset) pair.  The result
+        is that of overlay() for each in turn, but the lists are not copied
+        and the events are merged once instead of resorted after every list"""
+        runs = []
+        for item in lists:
+            other, time_offset = item if isinstance(item, tuple) else (item, 0)
+            if not isinstance(other, ControlList):
+                other = ControlList(other)
+            runs.append((other.events, TimeCode(time_offset).total_frames, self.defchannel))
+        if runs:
+            self.events.merge(runs)
 
     def append(self, other_list):
         """sorts this list then appends other_list by setting
@@ -649,15 +1232,12 @@ class ControlList(object):
     def getEventAtTime(self, target_time):
         """Returns the next event AFTER or ON target_time
             Resets the self.next_event index"""
-        target = TimeCode(target_time)
-        self.next_event = 0
-        max_index = len(self.events)
-
-        while self.next_event < max_index and self.events[self.next_event].time.total_frames < target.total_frames:
-            self.next_event += 1
+        target = self.tempo.refAt(TimeCode(target_time).nanos)
+        self.next_event = self.timeline().indexAtFrame(nanosToFrames(target))
+        self.due_end = 0
 
         # Return the result
-        if self.next_event < max_index:
+        if self.next_event < len(self.events):
             return self.events[self.next_event]
         else:
             return None
@@ -665,76 +1245,114 @@ class ControlList(object):
     def removeZeros(self):
         """ removes all channel 0 events (generally not
             a good idea - use for testing only)"""
-        i = 0
-        while i < len(self.events):
-            if self.events[i].channel == 0:
-                del self.events[i]
-            else:
-                i += 1
+        channels = self.events.channel
+        self.events.take([i for i in range(len(channels)) if channels[i] != 0])
 
-    def reconcile(self):
+    def reconcile(self, use_numpy=None):
         """Sorts list and combines all levels to produce a list of all level 0
         (active control) events.  A ControlList must be reconciled before it can
-        be used """
-        levelMap = {}  # dictionary to keep track of level in this file
-        valueMap = {}  # dictionary to keep track of pixel values (future)
-        currentState = False  # Assume an off state initially
-        
+        be used.  The combined channel is on while every level is on.
+
+        Runs as one sweep over the sorted events, keeping a running count of
+        levels that are on (rather than rescanning a level map per event).
+        With use_numpy (default: if NumPy is installed and the list is large)
+        the state transitions come from cumulative sums instead. """
         # First, create a new result list
         result = ControlList(initializer=self)
  
         # Sort all events (ControlEvents) in time order
         result.sortEvents()
+        store = result.events
+        num_events = len(store)
 
-        # Map all existing non-zero levels in this list to determine the number of levels
-        for ev in result.events:
-            if ev.level > 0 and ev.level not in levelMap:
-                # Add this level to the map
-                levelMap[ev.level] = 0
-
-        # Start at the beginning and scan the list for non-level-0 events
-        for ev in result.events:
-            if ev.level > 0:
-                # set "value" (future use)
-                valueMap[ev.level] = ev.value
-            
-                # Save the state for this level to the levelMap
-                if ev.action == "off":
-                    levelMap[ev.level] = 0
-                else:
-                    levelMap[ev.level] = 1
-                
-                # Check for a change in state
-                # tempState = self.mapState(levelMap)
-                tempState = self.State(levelMap)  # @@@ SD'A corrected 7/17
-
-                if currentState != tempState:
-                    # state has changed! Create a new level 0 event
-                    currentState = tempState
-                    newEv = ControlEvent()
-                    newEv.setValues(level=0, frames=ev.time.total_frames, value=self.mapValue(valueMap), duration=0,
-                                    channel=ev.channel)
-                    if currentState:
-                        newEv.action = "on"
-                    else:
-                        newEv.action = "off"
-                    
-                    # append the new event to this list (it's OK, it's level 0 and will be ignored)
-                    result.events.append(newEv)
-            
-        # Now remove all non-level-0 events
-        for i in range(len(result.events)):
-            while i < len(result.events) and result.events[i].level > 0:
-                del result.events[i]
-        
-        # re-sort the list
-        result.sortEvents()
+        if use_numpy is None:
+            use_numpy = np is not None and num_events >= reconcile_numpy_min
+        if use_numpy:
+            transitions = self._levelTransitionsNumpy(store)
+        else:
+            transitions = self._levelTransitions(store)
+
+        # append a new level 0 event for each change in state
+        # (times are already whole frames since the result is a copy).
+        # Their value stays 0: the pixel values of the levels are not combined yet (see mapValue())
+        on_code = EventStore.actionCode("on")
+        off_code = EventStore.actionCode("off")
+        for i, state in transitions:
+            store.add(store.time[i], store.time[i], 0, store.channel[i], on_code if state else off_code)
+
+        # keep the level 0 events, merged with the new ones in time order in one pass.
+        # On equal times existing events come first, as a stable re-sort would leave them
+        times = store.time
+        levels = store.level
+        kept = [i for i in range(num_events) if levels[i] <= 0]
+        order = []
+        k = 0
+        for new_index in range(num_events, len(store)):
+            while k < len(kept) and times[kept[k]] <= times[new_index]:
+                order.append(kept[k])
+                k += 1
+            order.append(new_index)
+        order.extend(kept[k:])
+        store.take(order)
             
         # Filter for redundant events, minimums, and write duration to ON events
         # Normalize for time 0??  (don't allow negative times)
             
         return result
 
+    def _levelTransitions(self, store):
+        """ Sweeps sorted events and returns (index, state) for every event
+            at which the combined state of all levels changes """
+        levels = store.level
+        actions = store.action
+        off_code = EventStore.actionCode("off")
+        num_levels = len(set(level for level in levels if level > 0))
+
+        level_on = {}  # level -> 0 or 1
+        on_count = 0  # running number of levels that are on
+        currentState = False  # Assume an off state initially
+        transitions = []
+
+        for i in range(len(levels)):
+            level = levels[i]
+            if level > 0:
+                on = 0 if actions[i] == off_code else 1
+                on_count += on - level_on.get(level, 0)
+                level_on[level] = on
+
+                if (on_count >= num_levels) != currentState:
+                    currentState = not currentState
+                    transitions.append((i, currentState))
+        return transitions
+
+    def _levelTransitionsNumpy(self, store):
+        """ _levelTransitions() computed with NumPy: each event's change to its own
+            level is found by grouping events per level, and the running count
+            of levels that are on is a cumulative sum of those changes """
+        levels = np.asarray(store.level)
+        index = np.flatnonzero(levels > 0)
+        if index.size == 0:
+            return []
+        levels = levels[index]
+        on = (np.asarray(store.action)[index] != EventStore.actionCode("off")).astype(np.int64)
+
+        # group by level (stable, so each group stays in time order) to find each level's previous state
+        order = np.argsort(levels, kind="stable")
+        group_start = np.ones(order.size, dtype=bool)
+        group_start[1:] = levels[order][1:] != levels[order][:-1]
+        num_levels = int(np.count_nonzero(group_start))
+
+        grouped = on[order]
+        previous = np.concatenate(([0], grouped[:-1]))
+        previous[group_start] = 0
+        change = np.empty_like(on)
+        change[order] = grouped - previous
+
+        on_count = np.cumsum(change)
+        state = on_count >= num_levels
+        changed = np.flatnonzero(state != np.concatenate(([False], state[:-1])))
+        return list(zip(index[changed].tolist(), state[changed].tolist()))
+
     def q_handler(self, queue):
         """ Handles an "interrupt" by the queue during execute(),
             overlays another list on this one and resets next_item
@@ -742,19 +1360,17 @@ class ControlList(object):
         pass
 
     def execute(self, valve_port, queue_obj=None):
-        """Sends these commands in real time via a ValvePort instance"""
+        """Sends these commands in real time via a ValvePort instance.
+        Plays the compiled timeline one due batch at a time, sleeping
+        until each batch is due"""
         if isinstance(valve_port, ValvePort):
             # Make sure everything is in order
             clr = self.reconcile()
-            num_events = len(clr.events)
+            store = clr.events
             
-            # Get the current system time.
-            start_time = time.time()
-
-            # run until done
-            now = TimeCode(0)
-            ev = clr.getEventAtTime(0)
-            run_it = False
+            # Get the current clock time.
+            start_time = parclock.nowNanos()
+            tempo = TempoMap(self.tempo.scaleFactor())
 
             # danger Will Robinson...
             if queue_obj:
@@ -763,21 +1379,24 @@ class ControlList(object):
                 force_run = False
                 
             print('Running (' + str(self.numEvents()) + " events)...")
-            
-            while force_run or isinstance(ev, ControlEvent):
-                while isinstance(ev, ControlEvent) and ev.time <= now:
-                    self.keepState(ev)  # keep cur_state up-to-date
-                    if valve_port.setEvent(ev):
+
+            for due, first, end, on_mask, off_mask in clr.timeline().steps():
+                wait = start_time + tempo.wallAt(due) - parclock.nowNanos()
+                if wait > 0:
+                    parclock.sleep(wait / NS_PER_SECOND)
+
+                run_it = False
+                for i in range(first, end):
+                    self.keepStateAt(i, store)  # keep cur_state up-to-date
+                    if valve_port.setChannel(store.channel[i], 1 if store.action[i] == 1 else 0):
                         run_it = True
-                    ev = clr.getNextEvent()
 
-                # Send all changes to the channels and get the current time
+                # Send all changes to the channels
                 if run_it:
                     valve_port.execute()
-                    run_it = False
 
-                # Get the latest time relative to start_time
-                now = TimeCode(time.time() - start_time)
+            while force_run:
+                parclock.sleep(0.001)
 
                 # Check for additions in the queue
                 """
@@ -797,26 +1416,28 @@ class ControlList(object):
         """ Returns the number of ControlEvents in this list"""
         return len(self.events)
 
-    def scale(self, scale_factor):
-        """ Scale the entire list times by a factor """
-        self.scale_pending = False
+    def nbytes(self):
+        """ Approximate memory held by the events, in bytes """
+        return self.events.nbytes()
 
-        # reset start time
-        now = TimeCode(time.time())
-        seq_time = (now.seconds - self.start_time.seconds) * scale_factor  # in seconds (float)
-        now.addTime(0.0 - seq_time)  # subtract seq_time
-        self.start_time.setTime(now)
+    def scale(self, scale_factor, ramp=0):
+        """ Plays the list scale_factor times slower than its reference times
+            from now on, gliding there over ramp seconds if given.  The events
+            are not rewritten: the tempo map changes at the current position """
+        self.scale_pending = False
 
-        # scale the list
-        for ev in self.events:
-            ev.time.setTime(ev.ref_time.seconds * scale_factor)
+        if self.running():
+            now = parclock.nowNanos() - self.start_time.nanos
+            self.tempo.setScale(now, scale_factor, secondsToNanos(ramp))
+        else:
+            self.tempo = TempoMap(scale_factor)
 
         self.beat_period.setTime(self.ref_beat_period.seconds * scale_factor)
         self.first_beat.setTime(self.ref_first_beat.seconds * scale_factor)
 
-    def scaleToBeat(self, beatperiod, beatObject=None):
+    def scaleToBeat(self, beatperiod, beatObject=None, ramp=0):
         """ calculates a scaling rate based on the target beat period
-            then scales the sequence accordingly """
+            then scales the sequence accordingly (over ramp seconds) """
         if isinstance(beatperiod, TimeCode):
             period = beatperiod
             self.sync_period = beatperiod.getSeconds() 
@@ -828,7 +1449,7 @@ class ControlList(object):
 
         if self.ref_beat_period.total_frames > 0:
             scale_factor = period.seconds / self.ref_beat_period.seconds
-            self.scale(scale_factor)
+            self.scale(scale_factor, ramp)
 
     def scaleOnNext(self, scale_factor):
         """ Save the scale factor and scale on next getNextByXXXX() call.
@@ -858,46 +1479,140 @@ class ControlList(object):
             stopped without having cannons firing """
         if eventObj.action == "on":
             self.cur_state[eventObj.channel] += 1
+            self.active_mask |= 1 << eventObj.channel
         elif eventObj.action == "off":
-            self.cur_state[eventObj.channel] -= 1
-            if self.cur_state[eventObj.channel] < 0:
+            if self.cur_state[eventObj.channel] > 1:
+                self.cur_state[eventObj.channel] -= 1
+            else:
                 self.cur_state[eventObj.channel] = 0
+                self.active_mask &= ~(1 << eventObj.channel)
+
+    def keepStateAt(self, index, store=None):
+        """ keepState() for the event at index, read from the event columns
+            (of this list, or of store) """
+        if store is None:
+            store = self.events
+        action = store.action[index]
+        channel = store.channel[index]
+        if action == 1:  # on
+            self.cur_state[channel] += 1
+            self.active_mask |= 1 << channel
+        elif action == 0:  # off
+            if self.cur_state[channel] > 1:
+                self.cur_state[channel] -= 1
+            else:
+                self.cur_state[channel] = 0
+                self.active_mask &= ~(1 << channel)
 
     def start(self, starttime=None):
         """ Marks the start time of the sequence.  Call this before
             subsequent calls to getNextByTime() """
         if starttime is None:
-            self.start_time.setTime(time.time())  # use system time
+            self.start_time.nanos = parclock.nowNanos()  # use the clock
         else:
             self.start_time.setTime(starttime)  # use passed time
 
         self.next_event = 0
+        self.next_step = 0
+        self.due_end = 0
+        self.tempo.restart()
         self.eof = False   # for end of sequence reporting in getNextByXXXX
 
+    def syncStart(self, start_ns):
+        """ Moves the start time (clock ns) of a running sequence without
+            restarting it, to keep it on an outside clock such as the media it
+            plays to.  Events already sent are not sent again; any the move
+            makes due come out on the next poll.  Returns True if running """
+        if self.running():
+            self.start_time.nanos = start_ns
+            return True
+        return False
+
     def stop(self):
         """ Stop() moves the next_event pointer past the end of the events list
             cleanup is done in the getNextEventByTime call """
         self.next_event = len(self.events) + 100
-        
+
+    def reset(self):
+        """ Returns a finished sequence to its freshly loaded state: stopped, all
+            channels off, end of sequence not yet reported.  Used when a cached
+            sequence is put back into a bank """
+        self.stop()
+        self.eof = False
+        self.cur_state = [0] * (max_channels + 1)
+        self.active_mask = 0
+        self.cleanup = []
+        self.sync_object = None
+
+    def timeline(self):
+        """ Returns the compiled Timeline of the events, compiling it again if
+            the events were edited or replaced since.  A recompile forgets which
+            events getNextByTime() already knew to be due """
+        compiled = self.compiled
+        if compiled is None or compiled.store is not self.events or compiled.version != self.events.version:
+            if compiled is not None and compiled.store is self.events and self.events.grownFrom(compiled.version):
+                compiled.grow()  # events were only added at the end (streamed in)
+            else:
+                compiled = self.compiled = Timeline(self.events)
+                self.next_step = 0
+                self.due_end = 0
+        return compiled
+
+    def nextStep(self, compiled):
+        """ Returns the timeline step holding next_event.  next_step caches the
+            step that starts at next_event, which is where playback normally is """
+        step = self.next_step
+        if compiled.first[step] != self.next_event:
+            step = compiled.stepOf(self.next_event)
+            if compiled.first[step] == self.next_event:
+                self.next_step = step
+        return step
+
     def getNextByTime(self, timenow=None):
-        """ Returns either an event to execute if it's due now or None if no events are due """
+        """ Returns either an event to execute if it's due now or None if no events are due.
+            The clock is only read when the events known to be due run out: one
+            comparison against the next step's due time, and a bisect of the
+            timeline to find the whole due batch once it is due.  Times are
+            compared on the reference scale, through the tempo map """
         # scale the sequence
         if self.scale_pending:
             self.scale(self.scale_factor)
 
         # check if we're at the end
-        if self.next_event < len(self.events):
-            # is the next item "due"?
-            if timenow is None:
-                now = TimeCode(time.time()) - self.start_time
-            else:
-                now = TimeCode(timenow) - self.start_time
-
-            evnext = self.events[self.next_event]
-            
-            if evnext.time <= now:
+        compiled = self.compiled
+        if compiled is None or compiled.version != self.events.version or compiled.store is not self.events:
+            compiled = self.timeline()
+        index = self.next_event
+        if index < compiled.count:
+            due = index < self.due_end
+            if not due:
+                if timenow is None:
+                    now = parclock.nowNanos() - self.start_time.nanos
+                else:
+                    now = _toNanos(timenow) - self.start_time.nanos
+                if not self.tempo.unscaled:
+                    now = self.tempo.refAt(now)
+                step = self.next_step
+                if compiled.first[step] == index:
+                    if compiled.due[step] <= now:
+                        self.next_step = compiled.seek(now, step + 1)
+                        self.due_end = compiled.first[self.next_step]
+                        due = True
+                elif self.events.ref_time[index] <= now:
+                    # moved into the middle of a step (getEventAtTime(), getNextEvent()): only
+                    # an out of order list differs, and there the event is due on its own time
+                    self.nextStep(compiled)
+                    self.due_end = index + 1
+                    due = True
+
+            if due:
+                evnext = self.events[self.next_event]
+                if self.tempo.unscaled:
+                    evnext.time.nanos = evnext.ref_time.nanos
+                else:
+                    evnext.time.nanos = self.tempo.wallAt(evnext.ref_time.nanos)  # as played
+                self.keepStateAt(self.next_event)  # keep the cur_state array up to date
                 self.next_event += 1
-                self.keepState(evnext)  # keep the cur_state array up to date
 
                 # check for looping
                 if self.looping is True and self.next_event == len(self.events):
@@ -919,7 +1634,7 @@ class ControlList(object):
                 return False
         else:
             # at end of sequence... is there any cleanup needed?
-            if sum(self.cur_state) == 0:            
+            if not self.active_mask:
                 # report end of sequence
                 try:
                     if not self.eof:
@@ -931,20 +1646,46 @@ class ControlList(object):
                     print("NO EOF IN " + self.name)
                     return False
             else:
-                # return a cleanup event
-                newEv = False
-                for i in range(max_channels + 1):
-                    if self.cur_state[i] > 0:
-                        newEv = ControlEvent()
-                        newEv.setValues(level=0, frames=0, value=0, duration=0, channel=i)
-                        self.keepState(newEv)
-                        self.cleanup.append(newEv)
-                        break
-                return newEv  # may be "False"
+                # return a cleanup event for the lowest channel still on
+                i = (self.active_mask & -self.active_mask).bit_length() - 1
+                newEv = ControlEvent()
+                newEv.setValues(level=0, frames=0, value=0, duration=0, channel=i)
+                self.keepState(newEv)
+                self.cleanup.append(newEv)
+                return newEv
+
+    def dueEvent(self, timenow=None):
+        """ getNextByTime() for output queues: an event comes back with its time
+            set to the clock time (ns) it was due - start time plus event time,
+            or now for cleanup events - so consumers can measure output latency """
+        start_ns = self.start_time.nanos
+        playing = self.running()
+        ev = self.getNextByTime(timenow)
+        if isinstance(ev, ControlEvent):
+            ev.time.nanos = start_ns + ev.time.nanos if playing else parclock.nowNanos()
+        return ev
+
+    def nextDueTime(self):
+        """ Returns the clock time (int nanoseconds) at which getNextByTime() will
+            next have something to return: an event, a cleanup event or the end of
+            sequence report.  0 means now, None means nothing until (re)started """
+        if self.scale_pending:
+            self.scale(self.scale_factor)
+
+        if self.next_event < len(self.events):
+            compiled = self.timeline()
+            step = self.nextStep(compiled)
+            if compiled.first[step] != self.next_event:
+                return self.start_time.nanos + self.tempo.wallAt(self.events.ref_time[self.next_event])
+            return self.start_time.nanos + self.tempo.wallAt(compiled.due[step])
+        elif self.active_mask or not self.eof:
+            return 0
+        else:
+            return None
 
     def atEnd(self):
         """ Returns True if at end of sequence AND all cleanup done """
-        if self.next_event < len(self.events) or sum(self.cur_state) > 0:
+        if self.next_event < len(self.events) or self.active_mask:
             return False
         else:
             return True
@@ -957,6 +1698,17 @@ class ControlList(object):
         else:
             return False
 
+    def beatNear(self, clock_ns):
+        """ Clock time (ns) of the sequence's own beat - ref_first_beat plus a
+            whole number of ref_beat_periods, as played - nearest clock_ns, or
+            None if the sequence has no beat period """
+        period = self.ref_beat_period.nanos
+        if period <= 0:
+            return None
+        first = self.ref_first_beat.nanos
+        beats = round((self.tempo.refAt(clock_ns - self.start_time.nanos) - first) / period)
+        return self.start_time.nanos + self.tempo.wallAt(first + beats * period)
+
     def stopSynching(self):
         """ stop syncing with beat object. call when usebeat is off """
         self.sync_object = None
@@ -975,13 +1727,26 @@ class ControlList(object):
         root.set("ref_first_beat", str(self.ref_first_beat.seconds))
         root.set("beat_period", str(self.beat_period.seconds))
         root.set("first_beat", str(self.first_beat.seconds))
-        root.set("version", "1.2")
+        root.set("version", "1.3")
 
-        # load events
+        # event count and duration (latest event time), so readHeader() need not read the events
+        store = self.events
+        root.set("count", str(len(store)))
+        root.set("duration", str(max(store.time) / NS_PER_SECOND if len(store) > 0 else 0.0))
+
+        # load events, straight from the event columns (same attributes as ControlEvent.getXMLElement())
         events = ET.SubElement(root, "events")
-        for ev in self.events:
-            ev_node = ev.getXMLElement(events)
-            events.append(ev_node)
+        for i in range(len(store)):
+            ET.SubElement(events, "event", {
+                "time": str(store.time[i] / NS_PER_SECOND),
+                "ref_time": str(store.ref_time[i] / NS_PER_SECOND),
+                "level": str(store.level[i]),
+                "channel": str(store.channel[i]),
+                "action": EventStore.ACTIONS[store.action[i]],
+                "duration": str(store.duration[i] / NS_PER_SECOND),
+                "scale_factor": "1.0",
+                "value": str(store.value[i]),
+                "sequence": str(store.sequence[i])})
 
         # save file
         tree = ET.ElementTree(root)
@@ -989,14 +1754,57 @@ class ControlList(object):
 
     def loadXML(self, file_path):
         """ reads a control list in from an XML file """
+        self.events = EventStore()
         try:
-            tree = ET.parse(file_path)
+            for parsed in self.readXML(file_path, self.events):
+                pass
         except Exception as e:
             # TODO: make below log to a logger file
             print("Not a valid ControlList XML file: {0}".format(e))
+            self.events = EventStore()
             return
 
-        root = tree.getroot()
+        if self.offset != 0:
+            self.addOffsetFrames(self.offset)
+
+    def readXML(self, file_path, store, batch=4096):
+        """ Generator that streams an XML file into store (an EventStore):
+            sets the list attributes from the root element, then appends the
+            events batch at a time, yielding the ref_time (ns) of the last one
+            after each batch.  Each element is dropped once read, so the tree
+            never holds more than one event.  Raises the parser's errors """
+        add_batch = EventStore()
+        add = add_batch.add
+        action_code = EventStore.actionCode
+        to_nanos = secondsToNanos
+        root = None
+        parent = None
+
+        for action, element in ET.iterparse(file_path, ("start", "end")):
+            if action == "start":
+                if root is None:
+                    root = element
+                    if root.tag != "ControlList":
+                        raise ValueError("no ControlList element")
+                    self.attributesFromXML(root)
+                elif element.tag == "events":
+                    parent = element
+            elif element.tag == "event" and parent is not None:
+                get = element.get
+                add(to_nanos(float(get("time", "0.0"))), to_nanos(float(get("ref_time", "0.0"))),
+                    int(get("level", "0")), int(get("channel", "0")), action_code(get("action", "off")),
+                    to_nanos(float(get("duration", "0.0"))), int(get("value", "0")), int(get("sequence", "0")))
+                parent.clear()
+                if len(add_batch) >= batch:
+                    store.extend(add_batch)
+                    yield add_batch.ref_time[-1]
+                    add_batch.clear()
+        if len(add_batch) > 0:
+            store.extend(add_batch)
+            yield add_batch.ref_time[-1]
+
+    def attributesFromXML(self, root):
+        """ sets the list attributes from the root element of an XML file """
         self.deflevel = int(root.get("deflevel", 0))
         self.defchannel = int(root.get("defchannel", 0))
         self.name = root.get("name", "")
@@ -1009,18 +1817,247 @@ class ControlList(object):
         self.first_beat.setTime(float(root.get("first_beat")))
         self.offset = int(root.get("offset", 0))
 
-        # get events
-        del self.events[:]  # clear any exiting events
-        self.events = []
+    def attributesFromBinary(self, header):
+        """ sets the list attributes from an unpacked .seqb header, returns the
+            event count """
+        (magic, version, header_size, flags, count, duration, self.deflevel, self.defchannel, self.scale_factor,
+         ref_beat_period, ref_first_beat, beat_period, first_beat, name) = header
+        self.name = name.rstrip(b"\0").decode("utf-8", "replace")
+        self.looping = bool(flags & seqb_looping)
+        self.scale_pending = bool(flags & seqb_scale_pending)
+        self.ref_beat_period.nanos = ref_beat_period
+        self.ref_first_beat.nanos = ref_first_beat
+        self.beat_period.nanos = beat_period
+        self.first_beat.nanos = first_beat
+        self.offset = 0  # any offset was applied before the file was written
+        return count
+
+    def readHeader(self, file_path):
+        """ reads the list attributes of an XML (.seqx) or binary (.seqb) file
+            without loading its events.  Returns (event count, duration ns),
+            (0, 0) if the file is not valid.  For a .seqb file this is the fixed
+            header; a .seqx file is only read up to its root element, which
+            saveXML() gives count and duration attributes.  Older .seqx files
+            without them are read whole, their events counted and timed by a
+            scan of the raw text """
+        try:
+            with open(file_path, "rb") as f:
+                if file_path.endswith(".seqb"):
+                    header = seqb_header.unpack(f.read(seqb_header.size))
+                    if header[0] != seqb_magic or header[1] > seqb_version:
+                        raise ValueError("unknown header")
+                    return self.attributesFromBinary(header), header[5]
+
+                parser = ET.XMLPullParser(("start",))
+                root = None
+                while root is None:
+                    chunk = f.read(4096)
+                    if not chunk:
+                        break
+                    parser.feed(chunk)
+                    for action, element in parser.read_events():
+                        root = element
+                        break
+                if root is None or root.tag != "ControlList":
+                    raise ValueError("no ControlList element")
+                self.attributesFromXML(root)
+                count = root.get("count")
+                duration = root.get("duration")
+                if count is not None and duration is not None:
+                    return int(count), secondsToNanos(float(duration))
+                f.seek(0)
+                data = f.read()
+
+            times = xml_time_attribute.findall(data)
+            duration = secondsToNanos(max(float(t) for t in times)) if times else 0
+            return len(xml_event_tag.findall(data)), duration
+        except Exception as e:
+            print("Not a valid ControlList file: {0}".format(e))
+            return 0, 0
+
+    def saveBinary(self, file_path):
+        """ Save this list as a binary .seqb file (see seqb_header).  Written to a
+            temporary file first so a reader never sees a partial file """
+        store = self.events
+        flags = (seqb_looping if self.looping else 0) | (seqb_scale_pending if self.scale_pending else 0)
+        duration = max(store.time) if len(store) > 0 else 0
+        header = seqb_header.pack(seqb_magic, seqb_version, seqb_header_size, flags, len(store), duration,
+                                  self.deflevel, self.defchannel, self.scale_factor, self.ref_beat_period.nanos,
+                                  self.ref_first_beat.nanos, self.beat_period.nanos, self.first_beat.nanos,
+                                  str(self.name).encode("utf-8")[:64])
+        temp_path = file_path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(header.ljust(seqb_header_size, b"\0"))
+            for name, code in EventStore.columns:
+                col = array(code, getattr(store, name))
+                if sys.byteorder != "little":
+                    col.byteswap()
+                data = col.tobytes()
+                f.write(data)
+                f.write(b"\0" * (-len(data) % 8))
+        os.replace(temp_path, file_path)
+
+    def loadBinary(self, file_path):
+        """ reads a control list from a binary .seqb file.  The file is memory
+            mapped and the event columns are views of it (no per-event parsing
+            and no copy) until the list is edited """
+        try:
+            with open(file_path, "rb") as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            header = seqb_header.unpack_from(mapping, 0)
+            if header[0] != seqb_magic or header[1] > seqb_version:
+                mapping.close()
+                raise ValueError("unknown header")
+        except Exception as e:
+            print("Not a valid ControlList binary file: {0}".format(e))
+            return
 
-        events = root.find("events")
-        if events is not None:
-            ev_list = events.findall("event")
-            for ev in ev_list:
-                self.events.append(ControlEvent(ev))
+        count = self.attributesFromBinary(header)
+        header_size = header[2]
+
+        self.events = EventStore()
+        self.events.attach(mapping, header_size, count)
+        if sys.byteorder != "little":
+            self.events.own()
+            for name, code in EventStore.columns:
+                getattr(self.events, name).byteswap()
+
+    def close(self):
+        """ Lets go of the .seqb file a list was loaded from (loadBinary()
+            maps it): the events are copied out of it first.  An open mapping
+            keeps the file from being deleted or replaced on Windows """
+        self.events.own()
+
+
+class LazyControlList(ControlList):
+    """ A ControlList read from a sequence file's header only (see readHeader()):
+        name, beat and scale settings, event count and duration.  The events
+        are parsed the first time anything uses them - normally start() - or
+        ahead of that by load() on another thread (prefetch); a list being
+        loaded makes the other thread wait.
+
+        Until then the list acts as a stopped list with no channels on, so a
+        ControlBank can hold, schedule, stop and report it without reading
+        the file.  BankCache builds a bank's index from these.
+
+        A .seqx file of more than stream_min events is streamed: load()
+        returns once the first stream_ahead ns of events are in and a thread
+        parses the rest, so the list can start playing at once.  If playback
+        catches up with the parser it waits for it rather than ending. """
+
+    stream_min = 20000  # events in a file before it is streamed
+    stream_ahead = 5000000000  # ns of events parsed before load() returns
+    stream_wait = 5000000  # ns between polls while playback waits for the parser
+
+    def __init__(self, file_path):
+        self.loaded = False
+        self.streaming = False  # events are still being parsed on a thread
+        self.load_lock = threading.Lock()
+        ControlList.__init__(self)
+        self._events = EventStore()
+        self.path = file_path
+        self.num_events, self.duration = self.readHeader(file_path)  # duration in ns
+
+    @property
+    def events(self):
+        if not self.loaded:
+            self.load()
+        return self._events
+
+    @events.setter
+    def events(self, store):
+        self._events = store
+
+    def load(self):
+        """ Parses the events of the file (once) """
+        with self.load_lock:
+            if self.loaded:
+                return
+            if self.path.endswith(".seqx") and self.num_events > self.stream_min and self.offset == 0:
+                self.stream()
+                return
+            store = ControlList(self.path).events
+            self.next_event = len(store) + 100  # still stopped
+            self._events = store
+            self.loaded = True
+
+    def stream(self):
+        """ Parses the first stream_ahead of the events, and the rest on a thread """
+        store = EventStore()
+        reader = self.readXML(self.path, store)
+        self.next_event = self.num_events + 100  # still stopped, however many events come in
+        self._events = store
+        self.streaming = True
+        self.loaded = True
+        try:
+            for parsed in reader:
+                if parsed >= self.stream_ahead:
+                    threading.Thread(target=self.finishStream, args=(reader,), name="stream " + self.path,
+                                     daemon=True).start()
+                    return
+        except Exception as e:
+            print("Not a valid ControlList XML file: {0}".format(e))
+        self.streaming = False
 
-        if self.offset != 0:
-            self.addOffsetFrames(self.offset)
+    def finishStream(self, reader):
+        try:
+            for parsed in reader:
+                pass
+        except Exception as e:
+            print("Not a valid ControlList XML file: {0}".format(e))
+        self.streaming = False
+
+    def waiting(self):
+        """ True while playback has caught up with the parser """
+        return self.streaming and len(self._events) <= self.next_event < self.num_events
+
+    def numEvents(self):
+        return len(self._events) if self.loaded else self.num_events
+
+    def nbytes(self):
+        return self._events.nbytes() if self.loaded else 0
+
+    def start(self, starttime=None):
+        if not self.loaded:
+            self.load()
+        ControlList.start(self, starttime)
+
+    # a list that is not loaded yet is stopped and has nothing to clean up
+
+    def stop(self):
+        if self.loaded:
+            ControlList.stop(self)
+            if self.streaming:
+                self.next_event = max(self.next_event, self.num_events + 100)
+        else:
+            self.next_event = self.num_events + 100
+
+    def getNextByTime(self, timenow=None):
+        if self.loaded:
+            if self.waiting():
+                return False
+            return ControlList.getNextByTime(self, timenow)
+        if not self.eof:
+            self.eof = True  # report end of sequence
+            return True
+        return False
+
+    def nextDueTime(self):
+        if self.loaded:
+            if self.waiting():
+                return parclock.nowNanos() + self.stream_wait
+            return ControlList.nextDueTime(self)
+        return None if self.eof else 0
+
+    def atEnd(self):
+        if self.loaded and self.waiting():
+            return False
+        return ControlList.atEnd(self) if self.loaded else True
+
+    def running(self):
+        if self.loaded and self.waiting():
+            return True
+        return ControlList.running(self) if self.loaded else False
 
 
 # ***************** ValvePort *****************************
@@ -1033,23 +2070,28 @@ class ValvePort(object):
        operate by passing ControlEvent instances to the execute() method,
        but manual controls are also provided"""
 
+    physical = False  # drives real valves (dispatched first by a fan-out ValvePortBank)
+    thread_safe = True  # may run on a ValvePortBank fan-out lane rather than the caller's thread
+
     def __init__(self, channels=24, channelsperbank=6):
         self.num_channels = channels
         self.channelsPerBank = channelsperbank
         self.channel_map = None
+        self.full_mask = (1 << channels) - 1  # every channel
 
-        # Create an arrary with the correct number of channels
+        # Create an arrary with the correct number of channels (on counts)
         self.channels = [0] * self.num_channels
 
-        # execstate stores the state of the valves since the last execute
-        self.execstate = [0] * self.num_channels
+        # on/off state as bitmasks (bit 0 = channel 1): on_mask follows the counts,
+        # exec_mask is the state at the last execute.  Their XOR is what changed
+        self.on_mask = 0
+        self.exec_mask = 0
         
         # Turn all channels off
         self.reset()
 
         # Set the exec state so the reset is performed
-        for i in range(0, self.num_channels):
-            self.execstate[i] = 1
+        self.exec_mask = self.full_mask
 
     def setMap(self, channel_map=None):
         """ defines a channel map for remapping the output of this port """
@@ -1066,10 +2108,12 @@ class ValvePort(object):
         if 0 < channel <= self.num_channels:
             if value > 0:
                 self.channels[channel-1] += 1
+                self.on_mask |= 1 << (channel - 1)
+            elif self.channels[channel-1] > 1:
+                self.channels[channel-1] -= 1
             else:
-                self.channels[channel-1] -= 1 
-                if self.channels[channel-1] < 0:
-                    self.channels[channel-1] = 0
+                self.channels[channel-1] = 0
+                self.on_mask &= ~(1 << (channel - 1))
             return True
         else:
             return False
@@ -1086,10 +2130,12 @@ class ValvePort(object):
             if 0 < channel <= self.num_channels:
                 if event.action == "on":
                     self.channels[channel-1] += 1
-                else:
+                    self.on_mask |= 1 << (channel - 1)
+                elif self.channels[channel-1] > 1:
                     self.channels[channel-1] -= 1
-                    if self.channels[channel-1] < 0:
-                        self.channels[channel-1] = 0
+                else:
+                    self.channels[channel-1] = 0
+                    self.on_mask &= ~(1 << (channel - 1))
                 return True
             else:
                 return False
@@ -1103,10 +2149,13 @@ class ValvePort(object):
         # set all channels to OFF
         for i in range(0, self.num_channels):
             self.channels[i] = 0
+        self.on_mask = 0
 
         # Set this channel to VALUE
-        if channel > 0 or channel <= self.num_channels:
+        if 0 < channel <= self.num_channels:
             self.channels[channel-1] = value
+            if value > 0:
+                self.on_mask = 1 << (channel - 1)
             return True
         else:
             return False
@@ -1117,21 +2166,37 @@ class ValvePort(object):
             setEvent() to update channel state before executing."""
 
         # update the exec state (after sending to output)
-        for i in range(0, self.num_channels):
-            self.execstate[i] = self.channels[i]
+        self.exec_mask = self.on_mask
 
     def reset(self):
         """ Clears all channels and sends to the hardware"""
         # set all channels to OFF
         for i in range(0, self.num_channels):
             self.channels[i] = 0
+        self.on_mask = 0
         self.execute()
 
+    def onMask(self):
+        """Bitmask of the channels that are on (bit 0 = channel 1)"""
+        return self.on_mask
+
+    def changedMask(self):
+        """Bitmask of the channels turned on or off since the last execute()"""
+        return self.on_mask ^ self.exec_mask
+
+    def setMask(self, mask):
+        """Sets every channel on or off from a bitmask (bit 0 = channel 1), with
+           no channel mapping.  Use execute() to write the changes"""
+        for i in range(0, self.num_channels):
+            self.channels[i] = mask >> i & 1
+        self.on_mask = mask & self.full_mask
+
     def all_on(self):
         """Sets all channels on and writes to the hardware"""
         # set all channels to ON
         for i in range(0, self.num_channels):
             self.channels[i] = 1
+        self.on_mask = self.full_mask
         self.execute()
 
     def setChannelExec(self, channel, value):
@@ -1175,6 +2240,8 @@ class ValvePort_GUI(ValvePort):
     """GUI display implementation of ValvePort class.  Displays the
     valve action as "lights" on a BitmapCanvas object """
 
+    thread_safe = False  # GUI toolkit calls belong in the GUI thread
+
     def __init__(self, channels=24, channelsperbank=6, canvas=None):
         ValvePort.__init__(self, channels, channelsperbank)
         self.canvas = canvas
@@ -1184,14 +2251,13 @@ class ValvePort_GUI(ValvePort):
 
     def execute(self):
         """Display the output of the sequence on a bitmap canvase"""
-        for i in range(0, self.num_channels):
-            if self.execstate[i] != self.channels[i]:
-                if self.channels[i] > 0:
-                    self.canvas.fillColor = (255, 20, 20)
-                else:
-                    self.canvas.fillColor = (100, 100, 100)
-                    
-                self.canvas.drawEllipse(self.lights[i], (20, 20))
+        for i in maskBits(self.on_mask ^ self.exec_mask):
+            if self.on_mask >> i & 1:
+                self.canvas.fillColor = (255, 20, 20)
+            else:
+                self.canvas.fillColor = (100, 100, 100)
+
+            self.canvas.drawEllipse(self.lights[i], (20, 20))
 
         # set the exec state array
         ValvePort.execute(self)
@@ -1212,6 +2278,8 @@ class ValvePort_Kivy(ValvePort):
     """Kivy GUI display implementation of ValvePort class. Displays the valve action as "lights" on
      a ChannelLight object. The lights parameter is an array of ChannelLights objects"""
 
+    thread_safe = False  # Kivy widgets are only changed from the Kivy thread
+
     def __init__(self, channels=24, channelsperbank=6, lights=None):
         ValvePort.__init__(self, channels, channelsperbank)
         if lights is None:
@@ -1221,18 +2289,48 @@ class ValvePort_Kivy(ValvePort):
 
     def execute(self):
         """Display the output of the sequence on a bitmap canvase"""
-        for i in range(0, self.num_channels):
-            if self.execstate[i] != self.channels[i]:
-                if i < self.num_available:
-                    if self.channels[i] > 0:
-                        self.lights[i].on()
-                    else:
-                        self.lights[i].off()
+        for i in maskBits(self.on_mask ^ self.exec_mask):
+            if i < self.num_available:
+                if self.on_mask >> i & 1:
+                    self.lights[i].on()
+                else:
+                    self.lights[i].off()
 
         # set the exec state array
         ValvePort.execute(self)
 
 
+# ***************** ValvePort_Snapshot *************************
+
+
+class ValvePort_Snapshot(ValvePort):
+    """Keeps the output state for a display that reads it at its own rate
+       (e.g. Kivy lights updated once a frame from the UI thread while the
+       valves are driven from an output thread).  take() returns the on/off
+       bitmask, including channels that were on at any time since the last
+       take(), so short pulses still show"""
+
+    def __init__(self, channels=24, channelsperbank=6):
+        self.lock = threading.Lock()
+        self.mask = 0  # current state
+        self.latched = 0  # current state OR'ed with everything on since the last take()
+        ValvePort.__init__(self, channels, channelsperbank)
+
+    def execute(self):
+        mask = self.on_mask
+        with self.lock:
+            self.mask = mask
+            self.latched |= mask
+        ValvePort.execute(self)
+
+    def take(self):
+        """Returns the display bitmask and restarts the latch"""
+        with self.lock:
+            mask = self.latched
+            self.latched = self.mask
+        return mask
+
+
 # ***************** ValvePort_Parallel *************************
 
 
@@ -1240,6 +2338,8 @@ class ValvePort_Parallel(ValvePort):
     """Parallel port implementation of ValvePort classe
         this was used in the original Parable versions """
 
+    physical = True
+
     def __init__(self, channels=22, channelsperbank=6):
         try:
             self.py = parallel.Parallel()
@@ -1248,6 +2348,7 @@ class ValvePort_Parallel(ValvePort):
             self.py = None
             
         ValvePort.__init__(self, channels, channelsperbank)
+        self.execute()  # every bank still counts as changed: writes the all-off state
         """
         self.num_channels=channels;
         self.channelsPerBank=channelsperbank
@@ -1259,22 +2360,19 @@ class ValvePort_Parallel(ValvePort):
         """Write the current (internal) state of the channels
             to the channels themselves.  Use setChannel() or
             setEvent() to update channel state before sending
-            to the ports."""
-        data = 0
-        base_channel = 0  # first channel for this bank
+            to the ports.  Only banks with a changed channel are written."""
+        changed = self.on_mask ^ self.exec_mask
+        bank_mask = (1 << self.channelsPerBank) - 1
         
         # how many banks need to be updated?
         banks = self.num_channels // self.channelsPerBank
         for bk in range(0, banks):  # bank number, 0-based
-            base_channel = self.channelsPerBank * bk
-            data = 0
+            base_channel = self.channelsPerBank * bk  # first channel for this bank
+            if not changed >> base_channel & bank_mask:
+                continue
 
-            # update each channel in the bank
-            for ch in range(0, self.channelsPerBank):
-                chnl = ch + base_channel  # get channel number, 0-based
-                if self.channels[chnl] > 0:
-                    # Write a bit to data
-                    data |= operator.lshift(1, ch)
+            # the bank's channels, straight from the on/off bitmask
+            data = self.on_mask >> base_channel & bank_mask
 
             if self.py is not None:
                 self.py.setData(data | (bk << 6))
@@ -1282,16 +2380,42 @@ class ValvePort_Parallel(ValvePort):
                 self.py.setDataStrobe(0)            
                 self.py.setDataStrobe(1)
 #               print 'Data written: %2.2X' % (data | (bk << 7))
-        
-        # FUTURE: update the prev_channels array to keep track of changes
+
+        # set the exec state
+        ValvePort.execute(self)
 
 
 # *********************** ValvePort_Ethernet ***********************
 
 
 class ValvePort_Ethernet(ValvePort):
-    """Implements a ValvePort control path over Ethernet. Intended for use with Puff.py running on the Gray Box"""
-    def __init__(self, channels=24, channelsperbank=6, remote_addr='127.0.0.1', remote_port=4444, verbose=False):
+    """Implements a ValvePort control path over Ethernet. Intended for use with Puff.py running on the Gray Box
+
+    framing selects how execute() writes channel changes:
+        "chx"  - one $chx:1|N:V# message per changed channel (legacy Puff)
+        "bnx"  - one $bnx:1|N:V:V...# message with every channel's state
+        "bin"  - one binary frame: frame_marker, channel count, then an on/off
+                 bitmask (bit 0 = channel 1), least significant byte first
+        "auto" - ask the remote on connect ($cap:1|?#) and use the most compact
+                 framing it lists in its $cap:1|...# reply, or "chx" if it
+                 does not answer
+    With "bnx" and "bin" each execute() is a single write, sent only if the
+    on/off state changed.  writes and bytes_sent count what has been sent.
+
+    threaded=True moves all socket work (connecting, negotiating, sending) to
+    a writer thread so execute() never blocks.  execute() queues the on/off
+    state; the writer sends only the newest queued state, as the difference
+    from what the remote last received, and reconnects with backoff when the
+    link drops.  See metrics() for queue depth and send latency."""
+
+    physical = True
+    frame_marker = 0xB1  # first byte of a binary frame (text messages start with '$')
+    cap_timeout = 0.25  # seconds to wait for a $cap reply
+    backoff_min = 0.1  # writer thread reconnect delays (seconds)
+    backoff_max = 5.0
+
+    def __init__(self, channels=24, channelsperbank=6, remote_addr='127.0.0.1', remote_port=4444, verbose=False,
+                 framing="auto", threaded=False, queue_size=64):
         self.host = remote_addr
         self.port = remote_port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -1300,8 +2424,31 @@ class ValvePort_Ethernet(ValvePort):
         self.is_connected = False
         self.verbose = verbose
         self.fail_count = 0
+        self.framing = framing  # requested framing
+        self.frame_mode = "chx" if framing == "auto" else framing  # framing in use
+        self.sent_mask = None  # on/off bitmask of the last frame sent (None: send the next one)
+        self.writes = 0
+        self.bytes_sent = 0
+
+        # writer thread (threaded=True)
+        self.threaded = threaded
+        self.out_q = queue.Queue(maxsize=queue_size) if threaded else None  # (mask, full, queued ns)
+        self.posted_mask = None  # last state queued
+        self.remote_mask = None  # last state the remote received (None: unknown)
+        self.max_depth = 0
+        self.dropped = 0  # states pushed out of a full queue
+        self.collapsed = 0  # stale states skipped by the writer
+        self.connects = 0  # connections made by the writer thread
+        self.send_latency = parstats.LatencyStats("ethernet send")  # queued -> written
+        self.writer = None
+        self.stopping = False  # close() was called
+
         ValvePort.__init__(self, channels, channelsperbank)
-        self.connect()
+        if threaded:
+            self.writer = threading.Thread(target=self.writeLoop, name="ethernet writer", daemon=True)
+            self.writer.start()
+        else:
+            self.connect()
 
     def __del__(self):
         """Clean up socket"""
@@ -1314,6 +2461,8 @@ class ValvePort_Ethernet(ValvePort):
             try:
                 self.sock.connect((self.host, self.port))
                 self.is_connected = True
+                if self.framing == "auto":
+                    self.negotiate()
             except InterruptedError:
                 print('The socket connection was interrupted')
                 self.is_connected = False
@@ -1330,16 +2479,48 @@ class ValvePort_Ethernet(ValvePort):
 
         return self.is_connected
 
+    def negotiate(self):
+        """Asks the remote which frames it understands and picks the most compact.
+           A remote that does not answer gets legacy $chx messages"""
+        self.frame_mode = "chx"
+        reply = b""
+        self.sock.settimeout(self.cap_timeout)
+        try:
+            self.sock.sendall(b"$cap:1|?#")
+            while not reply.endswith(b"#"):
+                data = self.sock.recv(256)
+                if not data:
+                    break
+                reply += data
+        except OSError:  # includes timeouts
+            pass
+        finally:
+            self.sock.settimeout(2.0)
+
+        if reply.startswith(b"$cap:1|") and reply.endswith(b"#"):
+            offered = reply[len(b"$cap:1|"):-1].decode("ascii", "replace").split(",")
+            for mode in ("bin", "bnx"):
+                if mode in offered:
+                    self.frame_mode = mode
+                    break
+        if self.verbose:
+            print('Using {0} frames with {1}:{2}'.format(self.frame_mode, self.host, self.port))
+
     def send(self, message):
-        """Sends a message to the remote"""
+        """Sends a message (str or a bytes frame) to the remote"""
+        data = message.encode('ascii') if isinstance(message, str) else message
         if self.connect():
             try:
-                self.sock.send(message.encode('ascii'))
+                self.sock.sendall(data)
+                self.writes += 1
+                self.bytes_sent += len(data)
             except BrokenPipeError:
                 print('Connection was broken, attempting to re-establish')
                 self.reset_socket()
                 if self.connect():
-                    self.sock.send(message.encode('ascii'))
+                    self.sock.sendall(data)
+                    self.writes += 1
+                    self.bytes_sent += len(data)
                 else:
                     print('Unable to re-establish connection. Will try again on next send')
 
@@ -1347,33 +2528,173 @@ class ValvePort_Ethernet(ValvePort):
         """If communication fails build a new socket"""
         self.sock.close()
         self.is_connected = False
+        self.sent_mask = None  # the remote may have lost its state
+        self.remote_mask = None
         del self.sock
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.settimeout(2.0)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def post(self, mask, full=False):
+        """Queues an on/off state for the writer thread without blocking.  If the
+           queue is full the oldest state is dropped - only the newest is sent -
+           and its full flag is carried by the state being queued"""
+        if mask == self.posted_mask and not full:
+            return
+        self.posted_mask = mask
+        item = (mask, full, time.perf_counter_ns())
+        while True:
+            try:
+                self.out_q.put_nowait(item)
+                break
+            except queue.Full:
+                try:
+                    oldest = self.out_q.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    continue
+                if oldest is not None and oldest[1]:
+                    item = (item[0], True, item[2])
+        depth = self.out_q.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def latest(self, item, block=False, timeout=None):
+        """Writer thread: returns the newest of item and the queued states.  A
+           state folded into a newer one passes on its full flag and queue time,
+           so send latency counts from the oldest unsent change.  Sets stopping
+           when close() has queued its None"""
+        while True:
+            try:
+                newer = self.out_q.get(block, timeout)
+            except queue.Empty:
+                return item
+            block = False
+            if newer is None:
+                self.stopping = True
+            elif item is None:
+                item = newer
+            else:
+                self.collapsed += 1
+                item = (newer[0], newer[1] or item[1], item[2])
+
+    def writeLoop(self):
+        """Writer thread: sends queued states, reconnecting with backoff"""
+        item = None  # state waiting to be written
+        backoff = None  # reconnect delay while the link is down
+        while not self.stopping or (item is not None and backoff is None):
+            if item is None:
+                item = self.latest(None, block=True)
+            else:
+                item = self.latest(item, block=backoff is not None, timeout=backoff)
+            if item is None:
+                continue
+            if self.writeState(item[0], item[1]):
+                self.send_latency.record(time.perf_counter_ns() - item[2])
+                item = None
+                backoff = None
+            else:
+                backoff = self.backoff_min if backoff is None else min(backoff * 2, self.backoff_max)
+        self.sock.close()
+        self.is_connected = False
+
+    def writeState(self, mask, full=False):
+        """Writer thread: brings the remote to mask, sending only what changed
+           since the last successful write.  Returns False if the link is down"""
+        if not self.is_connected:
+            self.fail_count = 0  # the writer's backoff replaces the give-up limit
+            if not self.connect():
+                self.reset_socket()  # a failed socket cannot connect again
+                return False
+            self.connects += 1
+
+        if full or self.remote_mask is None:
+            changed = (1 << self.num_channels) - 1
+        else:
+            changed = mask ^ self.remote_mask
+        try:
+            if self.frame_mode == "chx":
+                for i in range(0, self.num_channels):
+                    if changed >> i & 1:
+                        self.write('$chx:1|{0}:{1}#'.format(i + 1, mask >> i & 1).encode('ascii'))
+            elif changed:
+                self.write(self.binaryFrame(mask) if self.frame_mode == "bin" else self.bankFrame(mask).encode('ascii'))
+        except OSError as e:
+            print('Connection to {0}:{1} was broken ({2}), reconnecting'.format(self.host, self.port, e))
+            self.reset_socket()
+            return False
+        self.remote_mask = mask
+        return True
+
+    def write(self, data):
+        self.sock.sendall(data)
+        self.writes += 1
+        self.bytes_sent += len(data)
+        if self.verbose:
+            print('Sending: {}'.format(data))
+
+    def close(self, timeout=2.0):
+        """Stops the writer thread (after it sends what is queued) or closes the socket"""
+        if self.writer is not None:
+            try:
+                self.out_q.put(None, timeout=timeout)
+            except queue.Full:
+                pass
+            self.writer.join(timeout)
+            self.writer = None
+        else:
+            self.sock.close()
+            self.is_connected = False
+
+    def metrics(self):
+        """One line report of the writer queue and send latency"""
+        depth = self.out_q.qsize() if self.out_q is not None else 0
+        return "ethernet: depth={0} max={1} dropped={2} collapsed={3} connects={4} writes={5} bytes={6}; {7}".format(
+            depth, self.max_depth, self.dropped, self.collapsed, self.connects, self.writes, self.bytes_sent,
+            self.send_latency.summary())
+
+    def bankFrame(self, mask):
+        """$bnx message with the state of every channel in an on/off bitmask"""
+        cmnd = '$bnx:1|{}'.format(self.num_channels)
+        for i in range(0, self.num_channels):
+            cmnd += ':{}'.format(mask >> i & 1)
+        return cmnd + '#'
+
+    def binaryFrame(self, mask):
+        """Binary frame for an on/off bitmask"""
+        return bytes((self.frame_marker, self.num_channels)) + mask.to_bytes((self.num_channels + 7) // 8, 'little')
 
     def execute(self, bank_mode=False):
         """Update the remote device (Puff or other) with channel changes"""
-        if bank_mode:
-            cmnd = '$bnx:1|{}'.format(self.num_channels)
-            for i in range(0, self.num_channels):
-                cmnd += ':{}'.format('1' if self.channels[i] > 0 else '0')
-            cmnd += '#'
+        if self.threaded:
+            self.post(self.onMask(), bank_mode)  # the writer thread does the sending
+        elif bank_mode:
+            cmnd = self.bankFrame(self.onMask())
             self.send(cmnd)
             if self.verbose:
                 print('Sending command: {}'.format(cmnd))
+        elif self.frame_mode != "chx":
+            # all changes in one write, and only if the on/off state changed
+            mask = self.onMask()
+            if mask != self.sent_mask:
+                frame = self.binaryFrame(mask) if self.frame_mode == "bin" else self.bankFrame(mask)
+                self.send(frame)
+                self.sent_mask = mask
+                if self.verbose:
+                    print('Sending frame: {}'.format(frame))
         else:
             # Send individual channel commands
-            for i in range(0, self.num_channels):
-                if self.execstate[i] != self.channels[i]:
-                    chnl = i + 1
-                    cmnd = '$chx:1|{0}:'.format(chnl)
-                    if self.channels[i] > 0:
-                        cmnd += '1#'
-                    else:
-                        cmnd += '0#'
+            for i in maskBits(self.on_mask ^ self.exec_mask):
+                chnl = i + 1
+                cmnd = '$chx:1|{0}:'.format(chnl)
+                if self.on_mask >> i & 1:
+                    cmnd += '1#'
+                else:
+                    cmnd += '0#'
 
-                    self.send(cmnd)
-                    if self.verbose:
-                        print('Sending command: {}'.format(cmnd))
+                self.send(cmnd)
+                if self.verbose:
+                    print('Sending command: {}'.format(cmnd))
 
         # set the exec state array
         ValvePort.execute(self)
@@ -1389,13 +2710,16 @@ class ValvePort_Recorder(ValvePort):
      Control List and saves this to a temporary seqx file, following the name of the media. Subsequent recording sessions
      to the same media file will attempt to reload the .temp.seqx file, making it the top-level layer and allowing the
      work to continue."""
-    def __init__(self, channels=24, channelsperbank=6, media_path='./', kill_callback=None):
-        self.player = paraplayer.ParaPlayer()
+
+    thread_safe = False  # layers are also edited from the UI thread (record, accept, commit)
+
+    def __init__(self, channels=24, channelsperbank=6, media_path='./', kill_callback=None, backend=paraplayer.vlc):
+        self.player = paraplayer.ParaPlayer(backend)
         self.layers = []  # list of ControlList objects
         self.current_layer = 0  # Index of layer staged for recording
         self.layer_recorded = False  # Dirty flag that indicates that the layer has been written to
 
-        self.recording_start = 0.0  # System time recording started
+        self.recording_start = None  # clock time (seconds) recording started, None if not recording
         self.media_loaded = None  # Name of media file
         self.media_path = media_path  # Path to music files
         self.media_file = ''
@@ -1420,25 +2744,25 @@ class ValvePort_Recorder(ValvePort):
 
     def on_start(self, media, media_time):
         """Called when the media begins playing, signalling start of recording """
-        self.recording_start = time.time() - media_time  # correct for delayed starting
-        print('Output recording started at {}'.format(self.recording_start))
+        self.recording_start = parclock.now() - media_time  # correct for delayed starting
+        print('Output recording started at {}'.format(parclock.timestamp(int(self.recording_start * 1000000000))))
 
     def on_completion(self, media, media_time):
         """Called when media playback completes or has reached the end of the time frame"""
         if self.kill_callback:
             self.kill_callback()
         # Compare the local time to the media time sent and set an adjusting offset in the ControlList
-        if self.recording_start > 0:
-            rtime = time.time() - self.recording_start
+        if self.recording_start is not None:
+            rtime = parclock.now() - self.recording_start
             if fabs(rtime - media_time) * 30 > 2.0:
                 offset = (media_time - rtime) * 30
                 self.layers[self.current_layer].addOffsetFrames(offset)  # offset time is in frames
-        self.recording_start = 0.0  # no longer recording
+        self.recording_start = None  # no longer recording
 
     def record(self):
         """Initiates a recording"""
         if self.layer_recorded is False:
-            self.recording_start = time.time()
+            self.recording_start = parclock.now()
             self.player.play()
 
     def stop(self):
@@ -1458,8 +2782,7 @@ class ValvePort_Recorder(ValvePort):
         """Combines all ControlList files and writes them to the disk"""
         if len(self.layers) > 0 and self.layer_recorded is True or len(self.layers) > 1:
             final = ControlList()
-            for layer in self.layers:
-                final.overlay(layer)
+            final.overlay_many(self.layers)
             # final.sort()
             final.reconcile()
             final.saveXML('./recordings/{}.temp.seqx'.format(self.media_file))
@@ -1474,8 +2797,8 @@ class ValvePort_Recorder(ValvePort):
 
     def current_time_in_frames(self):
         """Calculates the current recording time as frames (1/30 sec)"""
-        if self.recording_start > 0.0:
-            return int((time.time() - self.recording_start) * 30)
+        if self.recording_start is not None:
+            return int((parclock.now() - self.recording_start) * 30)
         else:
             return False
 
@@ -1483,19 +2806,18 @@ class ValvePort_Recorder(ValvePort):
         """Records any channel state changes to the current ControlList (layer)"""
         now = None
         current_layer = None
-        if self.recording_start > 0.0:  # only if we are recording
-            for i in range(0, self.num_channels):
-                if (self.execstate[i] == 0) != (self.channels[i] == 0):
-                    if now is None:
-                        now = self.current_time_in_frames()
-                        self.layer_recorded = True  # dirty flag for this layer
-                        current_layer = self.layers[self.current_layer]
-                    event = ControlEvent()
-                    if self.channels[i] > 0:
-                        event.setValues(now, 0, i + 1, 'on')
-                    else:
-                        event.setValues(now, 0, i + 1, 'off')
-                    current_layer.addEvent(event)
+        if self.recording_start is not None:  # only if we are recording
+            for i in maskBits(self.on_mask ^ self.exec_mask):
+                if now is None:
+                    now = self.current_time_in_frames()
+                    self.layer_recorded = True  # dirty flag for this layer
+                    current_layer = self.layers[self.current_layer]
+                event = ControlEvent()
+                if self.on_mask >> i & 1:
+                    event.setValues(now, 0, i + 1, 'on')
+                else:
+                    event.setValues(now, 0, i + 1, 'off')
+                current_layer.addEvent(event)
 
         # set the exec state array (keep track of state even if not recording)
         ValvePort.execute(self)
@@ -1509,7 +2831,7 @@ class ValvePort_Recorder(ValvePort):
 
         self.layers.append(ControlList())
         self.current_layer = 0
-        self.recording_start = 0.0  # by def we're not recording
+        self.recording_start = None  # by def we're not recording
 
         # Load .temp.seqx file as top layer, if exists
         # TODO: check that this doesn't fail or falsely load the wrong media
@@ -1521,78 +2843,161 @@ class ValvePort_Recorder(ValvePort):
 # *********************** ValvePortBank ****************************
 
 
+class PortLane(object):
+    """ Worker thread that makes one ValvePort's calls, in order, for a fan-out
+        ValvePortBank.  Each call's dispatch latency (queued to done) is
+        recorded in stats """
+
+    def __init__(self, port, stats):
+        self.port = port
+        self.stats = stats
+        self.q = queue.Queue()  # (method name, args, queued ns) or None to stop
+        self.thread = threading.Thread(target=self.run, name=stats.name + " lane", daemon=True)
+        self.thread.start()
+
+    def submit(self, method, args, queued):
+        self.q.put((method, args, queued))
+
+    def run(self):
+        while True:
+            item = self.q.get()
+            try:
+                if item is None:
+                    break
+                method, args, queued = item
+                try:
+                    getattr(self.port, method)(*args)
+                except Exception as e:
+                    print("{0}.{1} failed: {2}".format(self.stats.name, method, e))
+                self.stats.record(time.perf_counter_ns() - queued)
+            finally:
+                self.q.task_done()
+
+    def stop(self, timeout=2.0):
+        self.q.put(None)
+        self.thread.join(timeout)
+
+
 class ValvePortBank(ValvePort):
     """ This is a container class for one or more ValvePort instances.
         This allows multiple outputs to be written the sequence.  It
         masquerades as a single ValvePort since that's how it's intended
-        to work """
+        to work
 
-    def __init__(self, channels=22, channelsperbank=6):
+        With fan_out each thread safe port gets its own PortLane, so a slow
+        port (a GUI redraw, a stalled link) no longer delays the others.
+        Physical ports are dispatched first, ports that are not thread safe
+        (Kivy lights) run last in the caller's thread.  Per-port dispatch
+        latency is kept in either mode, see latencyReport() """
+
+    def __init__(self, channels=22, channelsperbank=6, fan_out=False):
         self.numports = 0
         self.ports = []
+        self.fan_out = False
+        self.lanes = []  # PortLanes, physical ports first (fan-out)
+        self.inline = []  # ports called in the caller's thread (fan-out)
+        self.latency = {}  # port -> parstats.LatencyStats
         ValvePort.__init__(self, channels, channelsperbank)  # @@@ SD'A newly added
+        if fan_out:
+            self.setFanOut(True)
 
     def addPort(self, port):
         """ Add a ValvePort object to the list """
         if isinstance(port, ValvePort):
             self.ports.append(port)
             self.numports += 1
+            self.latency[port] = parstats.LatencyStats(type(port).__name__)
+            if self.fan_out:
+                self.setFanOut(True)  # rebuild the lanes
+
+    def setFanOut(self, fan_out=True):
+        """ Turns per-port dispatch lanes on or off """
+        for lane in self.lanes:
+            lane.stop()
+        self.lanes = []
+        self.inline = []
+        self.fan_out = fan_out
+        if fan_out:
+            for port in sorted(self.ports, key=lambda p: not p.physical):  # stable: physical first
+                if port.thread_safe:
+                    self.lanes.append(PortLane(port, self.latency[port]))
+                else:
+                    self.inline.append(port)
+
+    def dispatch(self, method, *args):
+        """ Calls method(*args) on every port: serially, or with fan_out queued
+            to the lanes then run for the inline ports.  A port's latency is the
+            time from this call until its own call is done """
+        queued = time.perf_counter_ns()
+        if self.fan_out:
+            for lane in self.lanes:
+                lane.submit(method, args, queued)
+            ports = self.inline
+        else:
+            ports = self.ports
+        for port in ports:
+            getattr(port, method)(*args)
+            self.latency[port].record(time.perf_counter_ns() - queued)
+
+    def drain(self):
+        """ Waits until the lanes have made every call queued so far """
+        for lane in self.lanes:
+            lane.q.join()
+
+    def close(self):
+        """ Stops the lanes (after their queued calls) """
+        self.setFanOut(False)
+
+    def latencyReport(self):
+        """ One line of dispatch latency per port """
+        return "\n".join(self.latency[port].summary() for port in self.ports)
 
     def setChannel(self, channel, value):
         """Sets a channel to OFF (value=0) or ON (value=non-0).
            Increments a count with each "ON".  Decrements with
            each "OFF".  Use execute() to write the changes to the
            channels"""
-        for i in range(self.numports):
-            self.ports[i].setEvent(channel, value)
+        self.dispatch("setChannel", channel, value)
         return True
 
     def setEvent(self, event):
-        for i in range(self.numports):
-            self.ports[i].setEvent(event)
+        self.dispatch("setEvent", event)
         return True
 
     def oneChannel(self, channel, value=1):
         """Sets ONE channel ON (default), all others off
            Use execute() to write the changes to the channels"""
-        for i in range(self.numports):
-            self.ports[i].oneChannel(channel, value)
+        self.dispatch("oneChannel", channel, value)
         return True
 
     def execute(self):
         """ executes all ports in the bank """
-        for i in range(self.numports):
-            self.ports[i].execute()
+        self.dispatch("execute")
 
     def reset(self):
         """ Clears all channels and sends to the hardware"""
-        for i in range(self.numports):
-            self.ports[i].reset()
+        self.dispatch("reset")
 
     def all_on(self):
         """Sets all channels on and writes to the hardware"""
-        for i in range(self.numports):
-            self.ports[i].all_on()
+        self.dispatch("all_on")
 
     def setChannelExec(self, channel, value):
         """Changes the state of one channel and sends the change
             immediately to the channel device"""
-        for i in range(self.numports):
-            self.ports[i].oneChannelExec(channel, value)
+        self.dispatch("oneChannelExec", channel, value)
         return True
 
     def setEventExec(self, event):
         """Changes the state of one channel and sends the change
             immediately to the channel device"""
-        for i in range(self.numports):
-            self.ports[i].setEventExec(event)
+        self.dispatch("setEventExec", event)
         return True
 
     def oneChannelExec(self, channel, value=1):
         """Changes the state of one channel clearing all others
             immediately to the channel device"""
-        for i in range(self.numports):
-            self.ports[i].oneChannelExec(channel, value)
+        self.dispatch("oneChannelExec", channel, value)
         return True
 
 # ~~~~~~~~~~~~~~~~~~~ legacy sequences ~~~~~~~~~~~~~~~~~~~~~~~
@@ -1601,26 +3006,21 @@ class ValvePortBank(ValvePort):
 def beep(chanl, duration=12, pause=0, start_time=0, level=0, sequence=0):
     """ Opens one channel for duration """
     cl = ControlList()
-    start = TimeCode(start_time)
-    end = TimeCode(start_time + duration)
-    paus = TimeCode(pause)
+    start = framesToNanos(TimeCode(start_time).total_frames)
+    end = framesToNanos(TimeCode(start_time + duration).total_frames)
+    paus = TimeCode(pause).total_frames
+    dur = framesToNanos(TimeCode(duration).total_frames)
 
-    # Add ON event
-    ev = ControlEvent(channel=chanl, action='on', time=start, duration=duration, \
-                      value=1, level=level, sequence=sequence)
-    cl.addEvent(ev)
-
-    # Add OFF event
-    ev.action = 'off'
-    ev.time.setTime(end)
-    cl.addEvent(ev)
+    # ON and OFF events, in time order so no sort is needed
+    store = cl.events
+    store.add(start, start, level, chanl, 1, dur, 1, sequence)
+    store.add(end, end, level, chanl, 0, dur, 1, sequence)
 
     # Add pause events if pause is set
-    if paus.total_frames > 0:
-        ev.channel = 0
-        cl.addEvent(ev)
-        ev.time = TimeCode(end.total_frames + paus.total_frames)
-        cl.addEvent(ev)
+    if paus > 0:
+        store.add(end, end, level, 0, 0, dur, 1, sequence)
+        paused = framesToNanos(nanosToFrames(end) + paus)
+        store.add(paused, paused, level, 0, 0, dur, 1, sequence)
 
     cl.sortEvents()
     return cl
@@ -1629,19 +3029,18 @@ def beep(chanl, duration=12, pause=0, start_time=0, level=0, sequence=0):
 def randy(iterations, num_channels=18, beep_dur=3, per=2, level=0, sequence=0):
     """randomly fires the cannons"""
     cl = ControlList()
+    beeps = []
     start = 0
     for i in range(0, iterations):
         ch = random.randint(1, num_channels)
-        ev = beep(ch, duration=beep_dur, start_time=start, level=level)
-        cl.overlay(ev)
+        beeps.append(beep(ch, duration=beep_dur, start_time=start, level=level))
         start += random.randint(0, per)
 
-    cl.sortEvents()
+    cl.overlay_many(beeps)
     return cl
 
 # Initializing a ControlList with another ControlList does not work
 # Make sure to preserve all channel-0 as these may be time-keeper NOOPs
 # Adding TimeCode objects does not return a TimeCode object (doesn't work)
-# overlay() sorts list each time.  May not be wanted always
 # first event played back (usually ch0) does not clear out - maybe it's getting a count > 1
 # make control list a proper iterator
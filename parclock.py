@@ -0,0 +1,134 @@
+""" ************************************************************
+Clock source for the Parable Sequencing Program
+
+Scheduling (sequence start and event times, tap beats, media position,
+thread deadlines) reads one clock through this module instead of
+time.time().  The default Clock is time.perf_counter_ns(): monotonic, so
+an NTP step or slew never moves a running sequence, and high resolution
+on every platform.  Its values are integer nanoseconds on an arbitrary
+base (seconds as floats from now()); wallNanos() converts them to Unix
+time for logs and files, through an anchor taken when the clock is made,
+and timestamp() formats them for a log line.
+
+SimulatedClock only moves when told to, so timing code can be run
+deterministically in tests and replays: setClock(SimulatedClock()).
+
+Modules call the functions here (parclock.nowNanos(), parclock.now(),
+parclock.sleep() ...) rather than importing them by name, so that
+setClock() takes effect everywhere.
+
+************************************************************ """
+
+import threading
+import time
+
+NS_PER_SECOND = 1000000000
+
+
+class Clock(object):
+    """ Monotonic clock read from source, a function returning integer
+        nanoseconds (time.perf_counter_ns or time.monotonic_ns) """
+
+    def __init__(self, source=time.perf_counter_ns):
+        self.source = source
+        self.wall_offset = 0  # Unix time (ns) minus clock time
+        self.anchor()
+
+    def anchor(self):
+        """ Ties the clock to the current Unix time for wallNanos().  Clock
+            times do not change; only their wall clock reading does """
+        self.wall_offset = time.time_ns() - self.source()
+
+    def nowNanos(self):
+        """ The current time, integer nanoseconds """
+        return self.source()
+
+    def now(self):
+        """ The current time, float seconds """
+        return self.source() / NS_PER_SECOND
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def spinUntil(self, deadline_ns):
+        """ Busy-waits (yielding the CPU) until deadline_ns, for the last
+            fraction of a millisecond before something is due """
+        while self.source() < deadline_ns:
+            time.sleep(0)
+
+    def waitSeconds(self, nanos):
+        """ The timeout, in seconds, to block in a wait (queue.get(),
+            Event.wait()) that should last nanos of clock time """
+        return max(nanos, 0) / NS_PER_SECOND
+
+    def wallNanos(self, nanos=None):
+        """ Unix time (ns) of a clock time (default: now) """
+        return (self.source() if nanos is None else nanos) + self.wall_offset
+
+    def clockNanos(self, wall_ns):
+        """ Clock time of a Unix time (ns) """
+        return wall_ns - self.wall_offset
+
+
+class SimulatedClock(Clock):
+    """ A clock that stands still until advance() or set() moves it.  sleep()
+        and spinUntil() move it instead of waiting, and waits on queues or
+        events do not block, so code driven by it runs as fast as it can and
+        the same way every time.  wall_ns is the Unix time of clock time 0 """
+
+    def __init__(self, start_ns=0, wall_ns=0):
+        self.time_ns = start_ns
+        self.lock = threading.Lock()
+        Clock.__init__(self, self.read)
+        self.wall_offset = wall_ns
+
+    def read(self):
+        return self.time_ns
+
+    def anchor(self):
+        pass  # the wall clock reading is fixed by wall_ns
+
+    def set(self, nanos):
+        """ Moves the clock to nanos (never backwards) """
+        with self.lock:
+            self.time_ns = max(self.time_ns, nanos)
+
+    def advance(self, seconds=0.0, nanos=0):
+        with self.lock:
+            self.time_ns += int(round(seconds * NS_PER_SECOND)) + nanos
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.advance(seconds)
+
+    def spinUntil(self, deadline_ns):
+        self.set(deadline_ns)
+
+    def waitSeconds(self, nanos):
+        return 0
+
+
+def setClock(new_clock):
+    """ Makes new_clock the clock all modules read.  Returns the one it replaces """
+    global clock, nowNanos, now, sleep, spinUntil, waitSeconds, wallNanos, clockNanos
+    old_clock = globals().get("clock")
+    clock = new_clock
+    nowNanos = new_clock.nowNanos
+    now = new_clock.now
+    sleep = new_clock.sleep
+    spinUntil = new_clock.spinUntil
+    waitSeconds = new_clock.waitSeconds
+    wallNanos = new_clock.wallNanos
+    clockNanos = new_clock.clockNanos
+    return old_clock
+
+
+def timestamp(nanos=None):
+    """ Local date and time, to the millisecond, of a clock time (default: now) """
+    wall_ns = wallNanos(nanos)
+    return "{0}.{1:03d}".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(wall_ns // NS_PER_SECOND)),
+                                wall_ns // 1000000 % 1000)
+
+
+setClock(Clock())
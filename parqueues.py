@@ -0,0 +1,148 @@
+""" ************************************************************
+Queues between the threads of the Parable Sequencing Program
+
+The sequencing threads (ControlBank, the temp sequence) and the app run
+in one process, so they do not need multiprocessing.Queue, which pickles
+every item through a feeder thread and a pipe.
+
+EventRing carries events from one producer thread to one consumer thread
+as packed (time ns, channel, action code) slots in a fixed array - no
+locks, no pickling.  Commands (short strings) go through queue.Queue.
+
+commandQueue() and eventQueue() make the queues for a transport: "thread"
+(the default, in-process) or "process" (multiprocessing.Queue, for when a
+sequencer runs in another process).
+
+************************************************************ """
+
+import multiprocessing
+import queue
+import threading
+import time
+from array import array
+import parclasses
+
+
+class EventRing(object):
+    """ Single producer, single consumer ring of events.  The producer only
+        moves tail and the consumer only moves head, so neither takes a lock
+        (each slot is written before tail publishes it).  get() rebuilds a
+        ControlEvent (time, channel and action only); getPacked() returns the
+        raw (time ns, channel, action code) tuple.
+
+        Events are never dropped: a producer that finds the ring full waits
+        for the consumer.  A consumer that blocks in get() is woken by the
+        producer through an Event, which is only touched while one waits. """
+
+    full_wait = 0.0001  # seconds between checks while the ring is full
+
+    def __init__(self, capacity=8192, ready=None):
+        self.capacity = capacity
+        self.slots = array("q", bytes(8 * 3 * capacity))  # time, channel, action per event
+        self.head = 0  # events read (consumer only)
+        self.tail = 0  # events written (producer only)
+        self.ready = ready if ready is not None else threading.Event()  # may be shared, see waitAny()
+        self.waiting = False  # consumer is blocked in get()
+
+    def qsize(self):
+        return self.tail - self.head
+
+    def empty(self):
+        return self.head == self.tail
+
+    def full(self):
+        return self.tail - self.head >= self.capacity
+
+    def putPacked(self, time_ns, channel, action, block=True):
+        """ Adds one event from raw values (action is an EventStore action code) """
+        tail = self.tail
+        while tail - self.head >= self.capacity:
+            if not block:
+                raise queue.Full
+            time.sleep(self.full_wait)
+        i = (tail % self.capacity) * 3
+        slots = self.slots
+        slots[i] = time_ns
+        slots[i + 1] = channel
+        slots[i + 2] = action
+        self.tail = tail + 1  # publish
+        if self.waiting:
+            self.ready.set()
+
+    def put(self, ev, block=True, timeout=None):
+        """ Adds a ControlEvent (queue.Queue compatible; timeout is ignored) """
+        self.putPacked(ev.time.nanos, ev.channel, parclasses.EventStore.actionCode(ev.action), block)
+
+    def getPacked(self, block=True, timeout=None):
+        """ Removes and returns the oldest event as (time ns, channel, action code).
+            Raises queue.Empty if there is none (after timeout seconds if blocking) """
+        head = self.head
+        if head == self.tail:
+            if not block or not self.wait(timeout):
+                raise queue.Empty
+        i = (head % self.capacity) * 3
+        slots = self.slots
+        item = (slots[i], slots[i + 1], slots[i + 2])
+        self.head = head + 1  # release the slot
+        return item
+
+    def get(self, block=True, timeout=None):
+        """ Removes and returns the oldest event as a ControlEvent """
+        time_ns, channel, action = self.getPacked(block, timeout)
+        ev = parclasses.ControlEvent()
+        ev.time.nanos = time_ns
+        ev.ref_time.nanos = time_ns
+        ev.channel = channel
+        ev.action = parclasses.EventStore.ACTIONS[action]
+        return ev
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def wait(self, timeout=None):
+        """ Consumer: waits until the ring is not empty.  False on timeout """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.ready.clear()
+        self.waiting = True
+        try:
+            while self.head == self.tail:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.ready.wait(remaining)
+                self.ready.clear()
+            return True
+        finally:
+            self.waiting = False
+
+
+def waitAny(rings, ready, timeout=None, also=None):
+    """ Waits until one of several EventRings that share the ready Event is not
+        empty (or also(), if given, returns True).  False on timeout """
+    ready.clear()
+    for ring in rings:
+        ring.waiting = True
+    try:
+        for ring in rings:
+            if ring.head != ring.tail:
+                return True
+        if also is not None and also():
+            return True
+        return ready.wait(timeout)
+    finally:
+        for ring in rings:
+            ring.waiting = False
+
+
+def commandQueue(transport="thread"):
+    """ Queue for command and response strings """
+    if transport == "process":
+        return multiprocessing.Queue()
+    return queue.Queue()
+
+
+def eventQueue(transport="thread", capacity=8192):
+    """ Queue for ControlEvents from a sequencer to the outputs """
+    if transport == "process":
+        return multiprocessing.Queue()
+    return EventRing(capacity)
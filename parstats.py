@@ -0,0 +1,76 @@
+""" ************************************************************
+Timing statistics for the Parable Sequencing Program
+
+LatencyStats collects nanosecond timing samples (event firing jitter,
+dispatch latency and the like) into running totals and a log2 histogram
+so they can be reported without keeping every sample.
+
+************************************************************ """
+
+import threading
+
+
+class LatencyStats(object):
+    """ Running count, mean, min, max and a histogram of nanosecond samples.
+        Histogram bucket n counts samples below 2**n microseconds (bucket 0 is
+        under 1 us).  record() may be called from any thread. """
+
+    num_buckets = 24  # up to ~8 seconds
+
+    def __init__(self, name=""):
+        self.name = name
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.count = 0
+            self.total = 0
+            self.min = None
+            self.max = 0
+            self.buckets = [0] * self.num_buckets
+
+    def record(self, nanos):
+        """ Adds one sample (int nanoseconds; negative samples count as 0) """
+        if nanos < 0:
+            nanos = 0
+        bucket = min((nanos // 1000).bit_length(), self.num_buckets - 1)
+        with self.lock:
+            self.count += 1
+            self.total += nanos
+            if self.min is None or nanos < self.min:
+                self.min = nanos
+            if nanos > self.max:
+                self.max = nanos
+            self.buckets[bucket] += 1
+
+    def mean(self):
+        """ Mean sample in nanoseconds (0 if no samples) """
+        return self.total // self.count if self.count > 0 else 0
+
+    def percentile(self, fraction):
+        """ Upper bound (ns) of the histogram bucket holding the given fraction of samples """
+        with self.lock:
+            target = self.count * fraction
+            running = 0
+            for i, num in enumerate(self.buckets):
+                running += num
+                if num > 0 and running >= target:
+                    return (1 << i) * 1000
+        return 0
+
+    def histogram(self):
+        """ Returns [(upper bound in us, count), ...] for the non-empty buckets """
+        with self.lock:
+            return [(1 << i, num) for i, num in enumerate(self.buckets) if num > 0]
+
+    def summary(self):
+        """ One line report, times in microseconds """
+        if self.count == 0:
+            return "{0}: no samples".format(self.name)
+        return "{0}: n={1} mean={2:.1f}us min={3:.1f}us max={4:.1f}us p99<{5}us".format(
+            self.name, self.count, self.mean() / 1000.0, self.min / 1000.0, self.max / 1000.0,
+            self.percentile(0.99) // 1000)
+
+    def __str__(self):
+        return self.summary()
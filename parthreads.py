@@ -22,12 +22,310 @@ ver 3.0 - Python 3 & Trinity  7/2017
 from __future__ import division
 import os
 import time
+import heapq
+import itertools
+import queue
+import collections
+import concurrent.futures
+import multiprocessing
 import parclasses
+import parclock
+import parqueues
+import parstats
+import beatgrid
 import beatnik
 import threading
 # import wx
 
 
+# *********************** SequenceScheduler ****************************
+
+
+class SequenceScheduler(object):
+    """ Keeps the sequences that have something to do in one min-heap, keyed by the
+        clock time (ns) their next event is due, so only due sequences are polled.
+        Heap entries are invalidated lazily: rescheduling a sequence issues a new
+        token and older entries for it are skipped when they surface.
+
+        Also tracks which sequences are not at end (running or cleaning up) so
+        allClear() does not have to visit every sequence. """
+
+    def __init__(self):
+        self.heap = []  # (due time ns, token, ControlList)
+        self.tokens = {}  # ControlList -> token of its live heap entry
+        self.active = set()  # sequences that are running or cleaning up
+        self.counter = itertools.count()
+
+    def schedule(self, seq):
+        """ (Re)computes when seq is next due.  Call after anything that changes
+            a sequence's run state (start, stop, scaling, events fired) """
+        due = seq.nextDueTime()
+        if due is None:
+            self.tokens.pop(seq, None)
+        else:
+            token = next(self.counter)
+            self.tokens[seq] = token
+            heapq.heappush(self.heap, (due, token, seq))
+
+        if seq.atEnd():
+            self.active.discard(seq)
+        else:
+            self.active.add(seq)
+
+    def remove(self, seq):
+        """ Forget a sequence (its heap entry becomes stale) """
+        self.tokens.pop(seq, None)
+        self.active.discard(seq)
+
+    def clear(self):
+        self.heap = []
+        self.tokens = {}
+        self.active = set()
+
+    def popDue(self, now_ns):
+        """ Removes and returns (due time ns, sequence) for the sequences due at or before now_ns """
+        due = []
+        heap = self.heap
+        while heap and heap[0][0] <= now_ns:
+            entry_time, token, seq = heapq.heappop(heap)
+            if self.tokens.get(seq) == token:
+                del self.tokens[seq]
+                due.append((entry_time, seq))
+        return due
+
+    def nextDue(self):
+        """ Returns the earliest due time (ns) or None if nothing is scheduled """
+        heap = self.heap
+        while heap and self.tokens.get(heap[0][2]) != heap[0][1]:
+            heapq.heappop(heap)  # drop stale entries
+        return heap[0][0] if heap else None
+
+    def allClear(self):
+        """ True if no sequence is running or cleaning up """
+        return len(self.active) == 0
+
+
+# *********************** BankCache ****************************
+
+
+def parseSequence(path):
+    """ Loads one sequence file.  Runs in BankCache's process pool, so it is a
+        module level function; the ControlList comes back pickled as its raw
+        event columns (see EventStore.__getstate__) """
+    return parclasses.ControlList(path)
+
+
+class BankCache(object):
+    """ Parsed sequence folders, so a bank that was loaded (or preloaded) before
+        can be put back without reading any files.  Entries are keyed by folder
+        path and checked against the folder's file names, mtimes and sizes, so
+        edited sequences are re-read.  Least recently used folders are dropped
+        when the event data held passes budget bytes (folders in the current
+        bank are never dropped).
+
+        preload() parses a folder on a worker thread while the sequencing
+        thread keeps playing.  get() and preload() may be called from any thread.
+
+        With lazy (the default) a folder is indexed rather than parsed: each
+        sequence is a LazyControlList read from its file header, and its events
+        are parsed when it is first started, or earlier on the worker thread by
+        prefetch().  Events loaded after a folder is stored are not counted
+        against budget until the folder is stored again. """
+
+    seq_overhead = 4096  # rough bytes per ControlList beyond its event columns
+
+    parallel_min = 8  # fewest .seqx files worth sending to the process pool
+
+    def __init__(self, budget=128 * 1024 * 1024, workers=1, processes=None, lazy=True):
+        self.budget = budget
+        self.lazy = lazy  # index folders from the file headers, parse each sequence when first used
+        self.entries = collections.OrderedDict()  # folder -> (signature, [ControlList], bytes)
+        self.total = 0  # bytes held by all entries
+        self.in_use = set()  # folders in the current bank
+        self.loading = {}  # folder -> Future of a preload in progress
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.processes = processes  # parse pool size, None for one per CPU, 1 to parse serially
+        self.pool = None  # ProcessPoolExecutor, see processPool()
+
+    @staticmethod
+    def signature(folder):
+        """ Sorted (file name, mtime, size) of the sequence files in folder, None if there is no folder """
+        try:
+            files = []
+            for entry in os.scandir(folder):
+                if entry.name.endswith((".seqx", ".seqb")):
+                    stat = entry.stat()
+                    files.append((entry.name, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            return None
+        return tuple(sorted(files))
+
+    @staticmethod
+    def sequencePath(path):
+        """ Returns the path of the .seqb twin of a .seqx file if there is one
+            newer than the .seqx file (faster to load), else path """
+        binary_path = path[:-len(".seqx")] + ".seqb"
+        try:
+            if os.path.getmtime(binary_path) >= os.path.getmtime(path):
+                return binary_path
+        except OSError:
+            pass
+        return path
+
+    def parse(self, folder, ready=None):
+        """ Reads every .seqx sequence in folder (or its newer .seqb twin).
+            When lazy only the headers are read.  Otherwise .seqx files are
+            parsed in the process pool when there are at least parallel_min of
+            them; .seqb files map faster than a round trip to the pool so they
+            are always loaded here.  ready(seq) is called for each sequence as
+            it completes.  Returns the sequences in directory order """
+        try:
+            filenames = os.listdir(folder)
+        except FileNotFoundError:
+            return []
+
+        jobs = []  # (index, name, path) still to parse
+        for filename in filenames:
+            parts = filename.rpartition('.')
+            if parts[2] == "seqx":
+                path = str(os.path.join(folder, filename))  # casting to str fixes win2k bug
+                jobs.append((len(jobs), parts[0], self.sequencePath(path)))
+        sequences = [None] * len(jobs)
+
+        def finish(index, name, seq):
+            print(name)
+            # TODO: control list reports whether it is a show sequence and if it has a beat
+            seq.name = name
+            sequences[index] = seq
+            if ready is not None:
+                ready(seq)
+
+        if self.lazy:
+            for index, name, path in jobs:
+                finish(index, name, parclasses.LazyControlList(path))
+            return sequences
+
+        text_jobs = [job for job in jobs if not job[2].endswith(".seqb")]
+        pool = self.processPool() if len(text_jobs) >= self.parallel_min else None
+        if pool is not None:
+            try:
+                futures = dict((pool.submit(parseSequence, path), (index, name)) for index, name, path in text_jobs)
+                for future in concurrent.futures.as_completed(futures):
+                    index, name = futures[future]
+                    finish(index, name, future.result())
+            except concurrent.futures.process.BrokenProcessPool:
+                print("Sequence process pool failed, loading serially")
+                self.pool = None
+
+        for index, name, path in jobs:
+            if sequences[index] is None:
+                finish(index, name, parseSequence(path))
+        return sequences
+
+    def processPool(self):
+        """ The process pool used by parse(), started on first use.  None if
+            there is only one process to use or the platform cannot start a pool """
+        with self.lock:
+            processes = self.processes or os.cpu_count() or 1
+            if self.pool is None and processes > 1:
+                try:
+                    # spawn rather than fork: the app has Kivy, VLC and sequencing threads running
+                    self.pool = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+                except (OSError, NotImplementedError, ValueError) as e:
+                    print("No sequence process pool: " + str(e))
+                    self.processes = 1
+            return self.pool
+
+    def get(self, folder, ready=None):
+        """ Returns the sequences in folder, parsing them now unless they are
+            cached and unchanged.  Waits for a preload of the folder in progress.
+            ready(seq) is called for each sequence as it becomes available """
+        folder = os.path.normpath(folder)
+        with self.lock:
+            future = self.loading.get(folder)
+        if future is not None:
+            future.result()
+
+        signature = self.signature(folder)
+        with self.lock:
+            entry = self.entries.get(folder)
+            if entry is not None and entry[0] == signature:
+                self.entries.move_to_end(folder)
+                sequences = entry[1]
+            else:
+                sequences = None
+        if sequences is None:
+            sequences = self.parse(folder, ready)
+            self.store(folder, signature, sequences)
+        elif ready is not None:
+            for seq in sequences:
+                ready(seq)
+        return sequences
+
+    def preload(self, folder, done=None):
+        """ Parses folder on the worker thread unless it is cached and unchanged.
+            done(folder) is called from the worker when it is ready """
+        folder = os.path.normpath(folder)
+        with self.lock:
+            future = self.loading.get(folder)
+            if future is None:
+                future = self.executor.submit(self._preload, folder)
+                self.loading[folder] = future
+        if done is not None:
+            future.add_done_callback(lambda f: done(folder))
+        return future
+
+    def _preload(self, folder):
+        try:
+            signature = self.signature(folder)
+            with self.lock:
+                entry = self.entries.get(folder)
+                if entry is not None and entry[0] == signature:
+                    return
+            self.store(folder, signature, self.parse(folder))
+        except Exception as e:
+            print("Preload of {0} failed: {1}".format(folder, e))
+        finally:
+            with self.lock:
+                self.loading.pop(folder, None)
+
+    def prefetch(self, seq):
+        """ Parses the events of a LazyControlList on the worker thread, so
+            starting it later does not wait for the file """
+        if isinstance(seq, parclasses.LazyControlList) and not seq.loaded:
+            return self.executor.submit(seq.load)
+        return None
+
+    def store(self, folder, signature, sequences):
+        """ Caches sequences for folder then evicts down to the budget """
+        size = sum(seq.nbytes() + self.seq_overhead for seq in sequences)
+        with self.lock:
+            old = self.entries.pop(folder, None)
+            if old is not None:
+                self.total -= old[2]
+            self.entries[folder] = (signature, sequences, size)
+            self.total += size
+
+            # drop least recently used folders not in the current bank
+            for key in list(self.entries):
+                if self.total <= self.budget:
+                    break
+                if key != folder and key not in self.in_use:
+                    self.total -= self.entries.pop(key)[2]
+
+    def setInUse(self, folders):
+        """ Marks the folders of the current bank so they are not evicted """
+        with self.lock:
+            self.in_use = set(os.path.normpath(folder) for folder in folders)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+        if self.pool is not None:
+            self.pool.shutdown(wait=False)
+
+
 # *********************** ControlGroup ****************************
 
 
@@ -50,9 +348,20 @@ class ControlBank(object):
         self.out_q = None
         self.ev_q = None
 
+        self.scheduler = SequenceScheduler()  # polls only the sequences that are due
+        self.pending_cmd = None  # command received while waiting in waitForWork()
+        self.spin_ns = 500000  # spin (rather than sleep) this close to a deadline
+        self.jitter = parstats.LatencyStats("jitter")  # lateness of due sequences
+        self.cache = BankCache()  # parsed sequence folders for instant bank switches
+
         # self.btic = BTIC.BTIC()  # beat keeper object
         self.btic = beatnik.Beatnik()  # beat keeper object
         self.use_beat = False
+        self.beat_phase = False  # start sequences on predicted beats and re-phase them every beat
+        self.next_rephase = None  # clock time (ns) of the next rephase()
+        self.rephase_min_ns = 100000  # phase errors smaller than this are left alone
+        self.phase_error = parstats.LatencyStats("beat phase error")  # corrections made by rephase()
+        self.grids = {}  # sequence name -> beatgrid.BeatGrid of the music it plays to
         
     def __call__(self, event_queue, in_queue, out_queue):
         """ called as a target of a threaded.Thread object, this will
@@ -94,35 +403,97 @@ class ControlBank(object):
                         self.out_q.put("beaton")
                     lock.release()
 
-                if self.allClear() is True:
-                    time.sleep(.01)
+                if self.beat_phase is True:
+                    lock.acquire()
+                    self.rephase()
+                    lock.release()
+
+                if self.die_pending is False:
+                    self.waitForWork()
             else:
                 # stop the loop/thread when all is cleaned up
                 self.sendPendingEvents()
                 if self.allClear() is True:
                     self.clearBank()                
+                    self.cache.shutdown()
                     self.die_pending = False
                     running = False
                 else:
-                    time.sleep(.01)
+                    self.waitForWork(commands=False)  # commands are not read while shutting down
+
+    def waitForWork(self, commands=True):
+        """ Sleeps until the next sequence event or beat light change is due, or
+            until a command arrives (kept in pending_cmd for processCommands()).
+            Blocks on in_q with no timeout when nothing is scheduled.  The last
+            spin_ns before a deadline are spun for sub-millisecond timing.
+
+            With commands False (shutting down) in_q is left alone and only the
+            next due sequence is waited for, polling every 10 ms if none is """
+        if commands is False:
+            deadline = self.scheduler.nextDue()
+            if deadline is None:
+                parclock.sleep(.01)
+                return
+            remaining = deadline - parclock.nowNanos() - self.spin_ns
+            if remaining > 0:
+                parclock.sleep(remaining / 1000000000)
+            parclock.spinUntil(deadline)
+            return
+
+        if self.pending_cmd is not None:
+            return
+
+        deadline = self.scheduler.nextDue()
+        light = self.btic.nextLightChange()
+        if light is not None:
+            light_deadline = parclock.nowNanos() + int(light * 1000000000) + 1000
+            deadline = light_deadline if deadline is None else min(deadline, light_deadline)
+        if self.beat_phase is True and self.next_rephase is not None:
+            deadline = self.next_rephase if deadline is None else min(deadline, self.next_rephase)
+
+        if deadline is None:
+            self.pending_cmd = self.in_q.get()  # idle, nothing to do until told
+            return
+
+        remaining = deadline - parclock.nowNanos() - self.spin_ns
+        if remaining > 0:
+            try:
+                self.pending_cmd = self.in_q.get(timeout=parclock.waitSeconds(remaining))
+                return
+            except queue.Empty:
+                pass
+        parclock.spinUntil(deadline)
 
     def sendPendingEvents(self):
         """ Send any events due for playback to the main thread """
-        for seq in self.sequences:
+        now = parclock.nowNanos()
+        for due, seq in self.scheduler.popDue(now):
+            if due > 0:
+                self.jitter.record(now - due)
             ev_found = True
             while ev_found is True:
-                ev = seq.getNextByTime()
+                ev = seq.dueEvent()  # time is the clock time it was due
                 if isinstance(ev, parclasses.ControlEvent):
                     self.ev_q.put(ev)
                 else:
                     if ev is True and self.out_q:
                         self.out_q.put("stopped|" + seq.name)
                     ev_found = False
+            self.scheduler.schedule(seq)
+
+    def nextCommand(self):
+        """ Returns the command received while waiting, else the next one in in_q, else None """
+        cmdstr = self.pending_cmd
+        if cmdstr is not None:
+            self.pending_cmd = None
+        elif self.in_q.empty() is False:
+            cmdstr = self.in_q.get()
+        return cmdstr
 
     def processCommands(self):
         """ receive commands from the main thread and do them """
-        if self.in_q.empty() is False and self.die_pending is False:
-            cmdstr = self.in_q.get()
+        cmdstr = self.nextCommand() if self.die_pending is False else None
+        if cmdstr is not None:
             cmd = cmdstr.split("|")
             # print("Thread received command " + cmd[0])
 
@@ -151,6 +522,12 @@ class ControlBank(object):
                     else:
                         self.start(cmd[1])            
 
+            elif cmd[0] == "sync":  # sync|name|start time (clock ns), from the show's MediaSync
+                self.syncStart(cmd[1], int(cmd[2]))
+
+            elif cmd[0] == "beatgrid":  # beatgrid|name|media path|media start (clock ns), from the show
+                self.useBeatGrid(cmd[1], cmd[2], int(cmd[3]))
+
             elif cmd[0] == "tap":
                 try:
                     tap_time = float(cmd[1])
@@ -168,22 +545,36 @@ class ControlBank(object):
                 self.bank_load_pending = True
                 self.stop()
 
+            elif cmd[0] == "preloadbank":
+                self.preloadBank(cmd[1])
+
+            elif cmd[0] == "prefetch":
+                self.prefetch(cmd[1])
+
             elif cmd[0] == "clearbank":
                 self.bank_clear_pending = True
                 self.stop()
 
             elif cmd[0] == "usebeat":
-                if cmd[1] == "yes":
+                if cmd[1] == "yes" or cmd[1] == "phase":
                     self.use_beat = True
+                    self.beat_phase = cmd[1] == "phase"
+                    self.next_rephase = None
                     # print("Using Beat")
                 else:
                     self.use_beat = False
+                    self.beat_phase = False
                     for seq in self.sequences:
                         seq.stopSynching()
                     # print "Not Using Beat"
             elif cmd[0] == "settempo":
                 self.btic.setPeriod(cmd[1])
 
+            elif cmd[0] == "stats":
+                self.out_q.put("message|" + self.jitter.summary())
+                if self.beat_phase is True:
+                    self.out_q.put("message|" + self.phase_error.summary())
+
         # clear or load bank
         if self.bank_clear_pending is True and self.allClear() is True:
             self.bank_clear_pending = False
@@ -192,34 +583,97 @@ class ControlBank(object):
             self.bank_load_pending = False
             self.loadBank(self.next_bank)
 
+    def syncStart(self, name, start_ns):
+        """ Moves the start time of a running sequence to keep it on the media
+            clock, and reschedules it for its new due time """
+        if name in self.grids:
+            self.grids[name].media_start = start_ns / 1000000000
+        for seq in self.sequences:
+            if seq.name == name and seq.syncStart(start_ns):
+                self.scheduler.schedule(seq)
+                return True
+        return False
+
+    def useBeatGrid(self, name, media_path, start_ns):
+        """ Scales a running sequence to the saved beat grid of its music and
+            keeps it on those beats, as scaleToBeat() does with the tap beat.
+            start_ns is the clock time the music started """
+        grid = beatgrid.loadGrid(media_path)
+        if grid is None:
+            return False
+        grid.media_start = start_ns / 1000000000
+        for seq in self.sequences:
+            if seq.name == name and seq.running():
+                seq.scaleToBeat(grid.getPeriod(), grid)
+                self.scheduler.schedule(seq)
+                self.grids[name] = grid
+                return True
+        return False
+
+    def rephase(self):
+        """ Beat phase mode: once a beat, half a beat before the next predicted
+            beat, moves each running sequence that has a beat period so that its
+            own beat nearest the predicted one lands on it, rescaling it first
+            if the tapped tempo has moved """
+        now = parclock.nowNanos()
+        if self.next_rephase is not None and now < self.next_rephase:
+            return
+        if not self.btic.isReady():
+            self.next_rephase = None
+            return
+        period = self.btic.getPeriod()
+        period_ns = int(period * 1000000000)
+        beat = int(self.btic.nextBeatAt(now / 1000000000) * 1000000000)
+        for seq in list(self.scheduler.active):
+            if seq.running() and seq.ref_beat_period.nanos > 0:
+                if seq.sync_period is None or abs(seq.sync_period - period) > period * 0.001:
+                    seq.scaleToBeat(period)
+                error = beat - seq.beatNear(beat)
+                if self.rephase_min_ns <= abs(error) < period_ns // 2:
+                    seq.syncStart(seq.start_time.nanos + error)
+                    self.phase_error.record(abs(error))
+                self.scheduler.schedule(seq)
+        self.next_rephase = beat + period_ns // 2
+
     def stop(self, name=""):
         """ Stops one sequence if named or all sequences if not """
         if name == "":
             for seq in self.sequences:
                 seq.stop()  # begin stopping the sequence
+                self.scheduler.schedule(seq)
             return True
         else:
             result = False
             for seq in self.sequences:
                 if seq.name == name:
                     seq.stop()  # begin stopping the sequence
+                    self.scheduler.schedule(seq)
                     result = True
             return result
 
     def start(self, name):
-        """ Starts a sequence by name if it's loaded in the sequences list """
+        """ Starts a sequence by name if it's loaded in the sequences list.
+            The sequences next to it in the bank are prefetched, since the
+            next one played is often a neighbour """
         result = False
 
         if len(name) > 0:
-            for seq in self.sequences:
+            for index, seq in enumerate(self.sequences):
                 if seq.name == name:
+                    for neighbour in self.sequences[max(index - 1, 0):index + 2]:
+                        if neighbour is not seq:
+                            self.cache.prefetch(neighbour)
                     # synchronize with beat?
-                    if self.use_beat is True and self.btic.isReady():
-                        beattime = self.btic.nextBeatTime() + time.time()
+                    if self.beat_phase is True and self.btic.isReady():
+                        seq.scaleToBeat(self.btic.getPeriod())  # rephase() keeps it on the beat
+                        seq.start(self.btic.nextBeatAt())
+                    elif self.use_beat is True and self.btic.isReady():
+                        beattime = self.btic.nextBeatTime() + parclock.now()
                         seq.scaleToBeat(self.btic.fDL, self.btic)  # set second param to None to disable perpetual sync
                         seq.start(beattime)
                     else:
                         seq.start()
+                    self.scheduler.schedule(seq)
                         
                     # notify main thread
                     if self.out_q:
@@ -227,6 +681,13 @@ class ControlBank(object):
                     result = True
         return result
 
+    def prefetch(self, name):
+        """ Parses a sequence that is only indexed so far (see BankCache), in
+            the background, e.g. when the pointer is over its button """
+        for seq in self.sequences:
+            if seq.name == name:
+                self.cache.prefetch(seq)
+
     def isRunning(self, name):
         """ Returns True if sequence found and is running, else false """
         result = False
@@ -247,6 +708,7 @@ class ControlBank(object):
             while len(self.sequences) > 0:
                 seq = self.sequences.pop()
                 del seq
+            self.scheduler.clear()
                 
             # notify main thread
             if self.out_q:
@@ -257,79 +719,137 @@ class ControlBank(object):
 
     def loadBank(self, bank_name):
         """ Loads all sequences found in a folder.  Bank_name is a
-            subfolder under the folder name """
+            subfolder under the folder name.  Folders come from the
+            bank cache, so a preloaded or previously used bank loads
+            without reading any files """
         result = False
 
         if self.allClear() is True:
             self.bank_load_pending = False
             self.next_bank = ""
 
+            folders = []
             # load default bank?
             if self.autoload is True:
-                for filename in os.listdir(self.seq_dir):
-                    parts = filename.rpartition('.')
-                    if parts[2] == "seqx":
-                        # path = self.seq_dir + "\\" + filename
-                        path = str(self.seq_dir + filename)  # casting to str fixes win2k bug
-                        print(filename)
-                        # TODO: control list reports whether it is a show sequence and if it has a beat
-                        seq = parclasses.ControlList(path)
-                        seq.name = parts[0]
-                        self.sequences.append(seq)
-                        if self.out_q:
-                            # TODO: return indicators for beat and show sequences, strip and use in main thread
-                            self.out_q.put("newseq|" + str(parts[0]))
-                        result = True
+                folders.append((self.seq_dir, ""))
 
             # load the selected bank
             if len(bank_name) > 0:
-                # folder = self.seq_dir + "\\" + bank_name
-                folder = self.seq_dir + bank_name
-                try:
-                    for filename in os.listdir(folder):
-                        parts = filename.rpartition('.')
-                        if parts[2] == "seqx":
-                            path = str(folder + "/" + filename)  # casting to str fixes win2k bug
-                            print(filename)
-                            seq = parclasses.ControlList(path)
-                            seq.name = parts[0]
-                            seq.stop()  # force a stop condition
-                            self.sequences.append(seq)
-                            if self.out_q:
-                                self.out_q.put("newseq|" + str(parts[0]))
-                            result = True
-                except FileNotFoundError:
-                    pass
+                folders.append((self.seq_dir + bank_name, ""))
 
             # Load show music sequence bank
             # NOTE: uses a-priori Show sequence folder
             if self.autoload is True:
-                for filename in os.listdir(self.seq_dir + 'Show/'):
-                    parts = filename.rpartition('.')
-                    if parts[2] == "seqx":
-                        # path = self.seq_dir + "\\" + filename
-                        path = str(self.seq_dir + 'Show/' + filename)  # casting to str fixes win2k bug
-                        print(filename)
-                        # TODO: control list reports whether it is a show sequence and if it has a beat
-                        seq = parclasses.ControlList(path)
-                        seq.name = parts[0]
-                        self.sequences.append(seq)
-                        if self.out_q:
-                            # TODO: return indicators for beat and show sequences, strip and use in main thread
-                            self.out_q.put("newseq|" + str(parts[0]) + '.')
-                        result = True
+                folders.append((self.seq_dir + 'Show/', "."))
+
+            def addSequence(seq, suffix):
+                seq.reset()  # stopped, reports its stopped state once
+                self.sequences.append(seq)
+                self.scheduler.schedule(seq)
+                if self.out_q:
+                    # TODO: return indicators for beat and show sequences, strip and use in main thread
+                    self.out_q.put("newseq|" + seq.name + suffix)
+
+            # sequences are added (and reported) as each one finishes parsing
+            self.cache.setInUse([folder for folder, suffix in folders])
+            for folder, suffix in folders:
+                if self.cache.get(folder, lambda seq: addSequence(seq, suffix)):
+                    result = True
         else:
             self.stop()
 
         return result
 
+    def preloadBank(self, bank_name):
+        """ Parses a bank in the background so a later loadbank is instant """
+        def done(folder):
+            if self.out_q:
+                self.out_q.put("message|bank " + bank_name + " preloaded")
+        self.cache.preload(self.seq_dir + bank_name, done)
+
     def allClear(self):
         """ all sequences are completely finished running and
-            cleaned up """
-        result = True
-        for seq in self.sequences:
-            if seq.atEnd() is False:
-                result = False
+            cleaned up (tracked by the scheduler, no scan) """
+        return self.scheduler.allClear()
+
+
+# *********************** OutputDispatcher ****************************
+
+
+class OutputDispatcher(object):
+    """ Real-time output thread.  Owns a ValvePortBank and fires the events
+        from the sequencing threads' event queues as soon as they arrive,
+        rather than when the UI frame loop gets to them.  Other threads act on
+        the bank through call(), so the bank is only used from this thread.
+
+        EventRing queues are all woken through one shared Event; any other
+        queues (multiprocessing transport) are polled every poll_interval.
+        Events carry the clock time they were due (ControlList.dueEvent()),
+        latency records due time to bank call done """
+
+    poll_interval = 0.0005  # seconds between polls of queues that are not EventRings
+
+    def __init__(self, bank, event_queues):
+        self.bank = bank
+        self.event_queues = list(event_queues)
+        self.signal = threading.Event()
+        self.rings = [q for q in self.event_queues if isinstance(q, parqueues.EventRing)]
+        for ring in self.rings:
+            ring.ready = self.signal
+        self.calls = queue.Queue()  # (function, args) to run in this thread
+        self.latency = parstats.LatencyStats("event to output")
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="output dispatcher", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout=2.0):
+        """ Stops the thread after it has fired what is queued """
+        self.running = False
+        self.signal.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def call(self, function, *args):
+        """ Runs function(*args) in the dispatcher thread (e.g. bank.reset) """
+        self.calls.put((function, args))
+        self.signal.set()
+
+    def run(self):
+        polled = len(self.rings) < len(self.event_queues)
+        while self.running:
+            self.dispatch()
+            if polled:
+                time.sleep(self.poll_interval)
+            else:
+                parqueues.waitAny(self.rings, self.signal, also=self.pending)
+        self.dispatch()
+
+    def pending(self):
+        return not self.calls.empty() or not self.running
+
+    def dispatch(self):
+        """ Runs queued calls then fires every queued event """
+        while True:
+            try:
+                function, args = self.calls.get_nowait()
+            except queue.Empty:
                 break
+            try:
+                function(*args)
+            except Exception as e:
+                print("Output call {0} failed: {1}".format(getattr(function, "__name__", function), e))
 
-        return result
+        for q in self.event_queues:
+            while True:
+                try:
+                    ev = q.get_nowait()
+                except queue.Empty:
+                    break
+                self.bank.setEventExec(ev)
+                self.latency.record(parclock.nowNanos() - ev.time.nanos)
@@ -0,0 +1,189 @@
+""" ************************************************************
+Stand-in Puff server for the Parable Sequencing Program
+
+Listens like Puff.py on the Gray Box and keeps the channel state that
+ValvePort_Ethernet sends it, so the Ethernet path can be exercised
+without the hardware.  It understands legacy $chx messages, $bnx bank
+messages and binary bitmask frames, answers $cap capability queries
+(unless started as a legacy server) and counts what arrives: reads
+(packets, as far as the server can tell - loopback may merge back to
+back writes into one read), bytes and messages.
+
+usage: python puffserver.py [--port 4444] [--legacy]
+
+************************************************************ """
+
+import argparse
+import socket
+import threading
+import time
+import parclock
+
+
+class PuffServer(object):
+    """ Accepts ValvePort_Ethernet connections on a background thread.  Port 0
+        picks a free port (see self.port once started).  capabilities are the
+        frame types reported to a $cap query; empty means behave like a legacy
+        Puff that ignores it.  clock (a function returning ns) stamps the log,
+        by default with Unix time from parclock.wallNanos() """
+
+    frame_marker = 0xB1  # first byte of a binary frame (see ValvePort_Ethernet)
+
+    def __init__(self, host='127.0.0.1', port=0, capabilities=("bin", "bnx"), verbose=False, log=False,
+                 clock=None):
+        self.host = host
+        self.port = port
+        self.capabilities = capabilities
+        self.verbose = verbose
+        self.channels = [0] * 256  # last state received, index 0 = channel 1
+        self.log = [] if log else None  # (clock() received, channel, value) of each change
+        self.clock = clock if clock is not None else parclock.wallNanos
+        self.lock = threading.Lock()
+        self.listener = None
+        self.thread = None
+        self.running = False
+        self.reset()
+
+    def reset(self):
+        """ Clears the counters """
+        self.reads = 0
+        self.bytes = 0
+        self.messages = 0
+
+    def start(self):
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((self.host, self.port))
+        self.listener.listen(4)
+        self.listener.settimeout(0.2)
+        self.port = self.listener.getsockname()[1]
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(2.0)
+        self.listener.close()
+
+    def serve(self):
+        while self.running:
+            try:
+                conn, addr = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self.client, args=(conn,), daemon=True).start()
+
+    def client(self, conn):
+        """ Reads one connection until it closes """
+        conn.settimeout(0.2)
+        buf = b""
+        with conn:
+            while self.running:
+                try:
+                    data = conn.recv(4096)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    break
+                if not data:
+                    break
+                with self.lock:
+                    self.reads += 1
+                    self.bytes += len(data)
+                buf = self.parse(buf + data, conn)
+
+    def parse(self, buf, conn):
+        """ Handles every complete message in buf, returns the incomplete rest """
+        while buf:
+            if buf[0] == self.frame_marker:
+                if len(buf) < 2:
+                    break
+                count = buf[1]
+                size = 2 + (count + 7) // 8
+                if len(buf) < size:
+                    break
+                mask = int.from_bytes(buf[2:size], 'little')
+                self.setChannels([(mask >> i) & 1 for i in range(count)])
+                buf = buf[size:]
+            elif buf[:1] == b"$":
+                end = buf.find(b"#")
+                if end < 0:
+                    break
+                self.message(buf[1:end].decode("ascii", "replace"), conn)
+                buf = buf[end + 1:]
+            else:
+                buf = buf[1:]  # resynchronise on the next message
+        return buf
+
+    def message(self, text, conn):
+        """ Handles one text message (without the $ and #): cmd:bank|args """
+        cmd, sep, rest = text.partition(":")
+        bank, sep, args = rest.partition("|")
+        values = args.split(":")
+        if cmd == "cap":
+            if self.capabilities:
+                conn.sendall("$cap:1|{0}#".format(",".join(self.capabilities)).encode("ascii"))
+            return  # a query, not a state message
+        elif cmd == "chx" and len(values) == 2:
+            channel, value = int(values[0]), int(values[1])
+            with self.lock:
+                if self.log is not None and self.channels[channel - 1] != value:
+                    self.log.append((self.clock(), channel, value))
+                self.channels[channel - 1] = value
+            self.counted(text)
+        elif cmd == "bnx" and len(values) > 1:
+            self.setChannels([int(v) for v in values[1:int(values[0]) + 1]])
+        elif self.verbose:
+            print("Unknown message: " + text)
+
+    def setChannels(self, states):
+        with self.lock:
+            if self.log is not None:
+                now = self.clock()
+                for i, value in enumerate(states):
+                    if self.channels[i] != value:
+                        self.log.append((now, i + 1, value))
+            self.channels[:len(states)] = states
+        self.counted(states)
+
+    def counted(self, what):
+        with self.lock:
+            self.messages += 1
+        if self.verbose:
+            print(what)
+
+    def state(self, num_channels=24):
+        """ The on/off state of the first num_channels channels """
+        with self.lock:
+            return list(self.channels[:num_channels])
+
+    def summary(self, frames=None):
+        """ Counter report, per frame if the number of frames sent is given """
+        with self.lock:
+            text = "reads={0} bytes={1} messages={2}".format(self.reads, self.bytes, self.messages)
+            if frames:
+                text += "  per frame: reads={0:.2f} bytes={1:.1f}".format(self.reads / frames, self.bytes / frames)
+        return text
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stand-in Puff server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4444)
+    parser.add_argument("--legacy", action="store_true", help="ignore $cap queries (legacy Puff)")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = PuffServer(args.host, args.port, () if args.legacy else ("bin", "bnx"), args.verbose).start()
+    print("Puff stand-in listening on {0}:{1}".format(server.host, server.port))
+    try:
+        while True:
+            time.sleep(5)
+            print(server.summary())
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,40 @@
+""" ************************************************************
+Sequence file converter for Parable Sequencing Program
+
+Converts .seqx (XML) sequence files to the binary .seqb format that
+ControlBank.loadBank() prefers when it is newer than the .seqx file.
+
+usage: python seqconvert.py <file.seqx | folder> [...]
+       folders are converted recursively
+
+************************************************************ """
+
+import os
+import sys
+import parclasses
+
+
+def convert(seqx_path):
+    """ Writes the .seqb twin of a .seqx file.  Returns the .seqb path """
+    seqb_path = seqx_path[:-len(".seqx")] + ".seqb"
+    parclasses.ControlList(seqx_path).saveBinary(seqb_path)
+    return seqb_path
+
+
+def convertFolder(folder):
+    """ Converts every .seqx file under folder.  Returns the number converted """
+    converted = 0
+    for root, dirs, files in os.walk(folder):
+        for filename in files:
+            if filename.endswith(".seqx"):
+                convert(os.path.join(root, filename))
+                converted += 1
+    return converted
+
+
+if __name__ == '__main__':
+    for arg in sys.argv[1:]:
+        if os.path.isdir(arg):
+            print("{0}: {1} files converted".format(arg, convertFolder(arg)))
+        else:
+            print("{0}: converted to {1}".format(arg, convert(arg)))
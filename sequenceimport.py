@@ -14,10 +14,14 @@ Ver. 3.0 - 7/17/2017
 
 from __future__ import division
 # import os, sys
-import time
 from PIL import Image
 import parclasses
 
+try:
+    import numpy as np  # optional, used for the (much faster) array import path
+except ImportError:
+    np = None
+
 
 # *********************** GraphicImport ****************************
 
@@ -28,7 +32,8 @@ class GraphicImport(object):
         object.__init__(self)
         pass
 
-    def import_sequence(self, filename, numchannels, spacing, beattrackpos=250, channelmap=None, filtrobj=None):
+    def import_sequence(self, filename, numchannels, spacing, beattrackpos=250, channelmap=None, filtrobj=None,
+                        use_numpy=None):
         """ Opens a graphic file (jpg, gif) and imports a sequence.
             Returns a ControlList object
             filename: graphic file path
@@ -36,7 +41,9 @@ class GraphicImport(object):
             spacing: pixels between channels and first ch offset
             beattrackpos: horiz position of beat track (0 means no beat track)
             channelmap: channel mapping object
-            filterobj: filter object (future) """
+            filterobj: filter object (future)
+            use_numpy: read the image as a NumPy array (default: if installed).
+                Gives the same sequence as the pixel loop """
 
         result = parclasses.ControlList()
         ev = parclasses.ControlEvent()
@@ -75,54 +82,79 @@ class GraphicImport(object):
                 print("colx:" + str(colx) + "  posx:" + str((colx + 1) * spacing) + "  ch:" + str(ch))
 
             # read in graphic lines
-            start = parclasses.TimeCode(time.time())  # calc processing time
-            for line in range(im.size[1]):
+            start = parclasses.TimeCode.now()  # calc processing time
+            pixels = self.pixel_array(im, use_numpy)
+            if pixels is not None:
+                # sample plan: the channel state, x position and colour plane the loop below reads per line
+                plan = []
                 for colx in range(numchannels):
-                        if channelmap is None:
-                            ch = colx
-                        else:
-                            ch = channelmap.lookup(colx + 1) - 1  # lookup then make 0-based
-                            if ch < 0 or ch >= numchannels:
-                                break
-                        
-                        val = buf[(colx + 1) * spacing, line]  # first method
-                        # val = buf[(ch * spacing) + first_pos, line]  # updated method
-                        newval = int(val[0])
-                        # print(str(newval) + " ")  # warning slow!
-                        # print(str((ch + 1) * spacing) + " ",)  # warning slow!
-                        # print(str(line) + " " + str(ch) + " | ",) # warning slow!
-
-                        # if the state has changed, create an event object
-                        newstate = state[ch]
-                        newaction = "off" if newstate == 0 else "on"
-                        if newval > 153 and state[ch] == 0:
-                            newstate = 1
-                            newaction = "on"
-                        elif newval < 118 and state[ch] == 1:
-                            newstate = 0
-                            newaction = "off"
-
-                        if state[ch] != newstate:
-                            ev.setValues(line, 0, ch+1, newaction, 0, newval)
-                            result.addEvent(ev)
-                            state[ch] = newstate
-
-                # read in beat track
+                    if channelmap is None:
+                        ch = colx
+                    else:
+                        ch = channelmap.lookup(colx + 1) - 1  # lookup then make 0-based
+                        if ch < 0 or ch >= numchannels:
+                            break
+                    plan.append((ch, (colx + 1) * spacing, 0))
+                newval = self.read_lines_np(pixels, plan, result.events)
+
+                # beat track: rising edges of the thresholded beat column
                 if beattrackpos > 0:
-                    val = buf[beattrackpos, line]
-                    newbeat = int(val[0]) > 153
-                    if beat != newbeat:
-                        beat = newbeat
-                        if newbeat is True:
-                            if first_beat is False:
-                                first_beat = True
-                                beat_time = parclasses.TimeCode(line)
-                                result.first_beat = beat_time
-                                result.ref_first_beat = parclasses.TimeCode(beat_time)
+                    beats = pixels[:, beattrackpos, 0] > 153
+                    rises = np.flatnonzero(np.diff(beats.astype(np.int8), prepend=0) == 1)
+                    if len(rises) > 0:
+                        first_beat = True
+                        beat_time = parclasses.TimeCode(int(rises[0]))
+                        result.first_beat = beat_time
+                        result.ref_first_beat = parclasses.TimeCode(beat_time)
+                        beat_periods = [parclasses.TimeCode(int(period)) for period in np.diff(rises)]
+            else:
+                for line in range(im.size[1]):
+                    for colx in range(numchannels):
+                            if channelmap is None:
+                                ch = colx
                             else:
-                                # Maintain running average
-                                beat_periods.append(parclasses.TimeCode(line) - beat_time)
-                                beat_time = parclasses.TimeCode(line)
+                                ch = channelmap.lookup(colx + 1) - 1  # lookup then make 0-based
+                                if ch < 0 or ch >= numchannels:
+                                    break
+                        
+                            val = buf[(colx + 1) * spacing, line]  # first method
+                            # val = buf[(ch * spacing) + first_pos, line]  # updated method
+                            newval = int(val[0])
+                            # print(str(newval) + " ")  # warning slow!
+                            # print(str((ch + 1) * spacing) + " ",)  # warning slow!
+                            # print(str(line) + " " + str(ch) + " | ",) # warning slow!
+
+                            # if the state has changed, create an event object
+                            newstate = state[ch]
+                            newaction = "off" if newstate == 0 else "on"
+                            if newval > 153 and state[ch] == 0:
+                                newstate = 1
+                                newaction = "on"
+                            elif newval < 118 and state[ch] == 1:
+                                newstate = 0
+                                newaction = "off"
+
+                            if state[ch] != newstate:
+                                ev.setValues(line, 0, ch+1, newaction, 0, newval)
+                                result.addEvent(ev)
+                                state[ch] = newstate
+
+                    # read in beat track
+                    if beattrackpos > 0:
+                        val = buf[beattrackpos, line]
+                        newbeat = int(val[0]) > 153
+                        if beat != newbeat:
+                            beat = newbeat
+                            if newbeat is True:
+                                if first_beat is False:
+                                    first_beat = True
+                                    beat_time = parclasses.TimeCode(line)
+                                    result.first_beat = beat_time
+                                    result.ref_first_beat = parclasses.TimeCode(beat_time)
+                                else:
+                                    # Maintain running average
+                                    beat_periods.append(parclasses.TimeCode(line) - beat_time)
+                                    beat_time = parclasses.TimeCode(line)
 
             # calculate beat period
             if first_beat is True:
@@ -170,12 +202,13 @@ class GraphicImport(object):
                 print("** Num Beats  " + str(num_beats))
                 print("** Corrected beat period" + str(corrected_beat_period))
             
-            end = parclasses.TimeCode(time.time())
+            end = parclasses.TimeCode.now()
             print("Processing time: " + str(end - start))
 
         return result
 
-    def import_triple(self, filename, numchannels, spacing, beattrackpos=0, channelmap=None, filtrobj=None):
+    def import_triple(self, filename, numchannels, spacing, beattrackpos=0, channelmap=None, filtrobj=None,
+                      use_numpy=None):
         """ Opens a graphic file (jpg, gif) and imports a sequence.
             Returns a ControlList object
             filename: graphic file path
@@ -183,7 +216,8 @@ class GraphicImport(object):
             spacing: pixels between channels and first ch offset
             beattrackpos: horiz position of beat track (0 means no beat track)
             channelmap: channel mapping object
-            filterobj: filter object (future) """
+            filterobj: filter object (future)
+            use_numpy: read the image as a NumPy array (default: if installed) """
 
         result = parclasses.ControlList()
         ev = parclasses.ControlEvent()
@@ -203,33 +237,88 @@ class GraphicImport(object):
             buf = im.load()
 
             # read in graphic lines
-            start = parclasses.TimeCode(time.time())  # calc processing time
-
-            # import red channel (ch 1, 4, 7...)
-            for line in range(im.size[1]):
-                for chnl in range(numchannels):
-                    for trip in range(3):
-                        val = buf[(chnl + 1) * spacing, line]
-                        ch = chnl + trip
-                        newval = val[trip]
+            start = parclasses.TimeCode.now()  # calc processing time
+
+            pixels = self.pixel_array(im, use_numpy)
+            if pixels is not None and pixels.shape[2] >= 3:
+                plan = [(chnl + trip, (chnl + 1) * spacing, trip) for chnl in range(numchannels) for trip in range(3)]
+                self.read_lines_np(pixels, plan, result.events)
+            else:
+                # import red channel (ch 1, 4, 7...)
+                for line in range(im.size[1]):
+                    for chnl in range(numchannels):
+                        for trip in range(3):
+                            val = buf[(chnl + 1) * spacing, line]
+                            ch = chnl + trip
+                            newval = val[trip]
                         
-                        # if the state has changed, create an event object
-                        newstate = state[ch]
-                        newaction = "off" if newstate == 0 else "on"
-                        if newval > 153 and state[ch] == 0:
-                            newstate = 1
-                            newaction = "on"
-                        elif newval < 118 and state[ch] == 1:
-                            newstate = 0
-                            newaction = "off"
-
-                        if state[ch] != newstate:
-                            ev.setValues(line, 0, ch+1, newaction, 0, newval)
-                            result.addEvent(ev)
-                            state[ch] = newstate
+                            # if the state has changed, create an event object
+                            newstate = state[ch]
+                            newaction = "off" if newstate == 0 else "on"
+                            if newval > 153 and state[ch] == 0:
+                                newstate = 1
+                                newaction = "on"
+                            elif newval < 118 and state[ch] == 1:
+                                newstate = 0
+                                newaction = "off"
+
+                            if state[ch] != newstate:
+                                ev.setValues(line, 0, ch+1, newaction, 0, newval)
+                                result.addEvent(ev)
+                                state[ch] = newstate
                             
             result.reconcile()
-            end = parclasses.TimeCode(time.time())
+            end = parclasses.TimeCode.now()
             print("Processing time: " + str(end - start))
 
         return result
+
+    def pixel_array(self, im, use_numpy=None):
+        """ Returns the image as a (line, x, colour plane) NumPy array, or None
+            to use the pixel loops (no NumPy, not wanted or not a colour image) """
+        if use_numpy is None:
+            use_numpy = np is not None
+        if not use_numpy:
+            return None
+        pixels = np.asarray(im)
+        return pixels if pixels.ndim == 3 else None
+
+    def read_lines_np(self, pixels, plan, store):
+        """ Array version of the import pixel loops.  plan lists the (channel
+            state index, x position, colour plane) of each sample the loop reads
+            per line, in loop order; samples sharing a state index share its
+            on/off state.  Every sample of every line is read in one slice, the
+            153/118 hysteresis is applied per channel and the state changes are
+            appended to store (an EventStore) in the order the loop would add
+            them.  Returns the last value read, as the loop leaves newval """
+        num_lines = pixels.shape[0]
+        if len(plan) == 0 or num_lines == 0:
+            return 0
+        states, xpos, planes = (np.array(col) for col in zip(*plan))
+        samples = pixels[:, xpos, planes].astype(np.int16)  # [line, plan entry]
+
+        keys = []  # line * len(plan) + plan entry of each change (the loop's order)
+        channels = []
+        actions = []
+        for ch in np.unique(states):
+            group = np.flatnonzero(states == ch)
+            stream = samples[:, group].reshape(-1)  # this channel's samples in loop order
+
+            # hysteresis: over 153 turns on, under 118 turns off, else the last state holds
+            known = (stream > 153) | (stream < 118)
+            last = np.maximum.accumulate(np.where(known, np.arange(len(stream)), -1))
+            state = np.where(last >= 0, stream[last] > 153, False).astype(np.int8)
+            changes = np.flatnonzero(np.diff(state, prepend=0))
+
+            keys.append((changes // len(group)) * len(plan) + group[changes % len(group)])
+            channels.append(np.full(len(changes), ch + 1, dtype=np.int32))
+            actions.append(state[changes])  # 1 = on, 0 = off
+
+        keys = np.concatenate(keys)
+        order = np.argsort(keys)
+        lines = (keys[order] // len(plan)).astype(np.int64)
+        times = (lines * 2 * parclasses.NS_PER_SECOND + parclasses.FRAMES_PER_SECOND) // \
+            (2 * parclasses.FRAMES_PER_SECOND)  # framesToNanos()
+        store.appendColumns(len(times), time=times, ref_time=times,
+                            channel=np.concatenate(channels)[order], action=np.concatenate(actions)[order])
+        return int(samples[num_lines - 1, len(plan) - 1])
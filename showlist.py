@@ -1,7 +1,10 @@
-from paraplayer import ParaPlayer
+from paraplayer import ParaPlayer, MediaSync
 from multiprocessing import Queue
+import os
 import xml.etree.ElementTree as ET  # XML support
-import time
+import beatgrid
+import parclock
+import parstats
 
 
 class ShowListEvent(object):
@@ -22,6 +25,23 @@ class ShowListEvent(object):
             self.sequence = '{}.seqx'.format(self.source)
 
 
+def read_show(show_file_path):
+    """Reads a .show file. Returns (music root, list of ShowListEvents) or None if it could not be parsed"""
+    try:
+        tree = ET.parse(show_file_path)
+    except Exception as e:
+        print("Error parsing show file {0}: {1}".format(show_file_path, e))
+        return None
+
+    root = tree.getroot()
+    show_events = []
+    events = root.find("events")
+    if events is not None:
+        for ev in events.findall("event"):
+            show_events.append(ShowListEvent(ev))
+    return str(root.get("music_root", '')), show_events
+
+
 class ShowList(object):
     """This class reads in events from a .show file and manages playback of the show"""
     def __init__(self, player: ParaPlayer, seq_queue: Queue, show_file_path=None):
@@ -33,6 +53,8 @@ class ShowList(object):
         self.start_time = 0.0
         self.paused_at = 0.0
         self.locked = False  # Don't allow the show to be paused or stopped
+        self.sync = None  # MediaSync keeping the running sequence on the music
+        self.sync_residual = parstats.LatencyStats("media sync residual")  # media time reports vs the sync fit
 
         self.player.set_start_callback(self.on_start)
         self.player.set_finish_callback(self.on_completion)
@@ -42,25 +64,14 @@ class ShowList(object):
 
     def load(self, show_file_path):
         # Load show file
-        try:
-            tree = ET.parse(show_file_path)
-        except Exception as e:
-            print("Error parsing show file {0}: {1}".format(show_file_path, e))
+        show = read_show(show_file_path)
+        if show is None:
             return
 
-        # set top-level attributes
-        root = tree.getroot()
-        self.music_root = str(root.get("music_root", ''))
-
-        # Read event elements from the file and create element list
+        # set top-level attributes and the event list
         del self.events[:]  # clear any exiting events
-        self.events = []
+        self.music_root, self.events = show
         self.current_index = 0
-        events = root.find("events")
-        if events is not None:
-            ev_list = events.findall("event")
-            for ev in ev_list:
-                self.events.append(ShowListEvent(ev))
 
     def get_event(self, item_index):
         """Returns the item at index of None"""
@@ -76,6 +87,7 @@ class ShowList(object):
 
     def stop(self):
         """Stops playback and resets player"""
+        self.end_sync()
         self.seq_queue.put('stop')
         self.player.stop()
         self.paused_at = 0.0
@@ -84,13 +96,14 @@ class ShowList(object):
     def pause(self):
         """Stops playback and resets player"""
         if self.paused_at == 0.0:
+            self.end_sync()
             self.seq_queue.put('stop')
             self.player.pause()
-            self.paused_at = time.time() - self.start_time
+            self.paused_at = parclock.now() - self.start_time
         else:
             self.seq_queue.put('resume')
             self.player.play()
-            self.start_time = time.time() - self.paused_at
+            self.start_time = parclock.now() - self.paused_at
             self.paused_at = 0.0
 
     def current_event(self):
@@ -115,7 +128,7 @@ class ShowList(object):
         if ev is not None:
             if ev.type == 'stop':
                 # no playback initiated so we'll wait until start() is called again
-                self.paused_at = time.time() - self.start_time
+                self.paused_at = parclock.now() - self.start_time
                 self.current_index += 1
                 print("Show playback intentionally stopped, press PLAY to resume")
             else:
@@ -148,6 +161,7 @@ class ShowList(object):
             print("On Completion called with time signature " + str(time_sig) + " for media " + media_path)
         else:
             print("On Completion called after pause at " + str(time_sig))
+        self.end_sync()
         if not self.show_paused():
             self.play_next()
 
@@ -157,10 +171,31 @@ class ShowList(object):
         if ev:
             if ev.sequence != '':
                 self.seq_queue.put('start|{}'.format(ev.sequence))
+                if media_path and os.path.exists(beatgrid.gridPath(media_path)):
+                    # keep the sequence on the song's precomputed beats (see beatgrid.py)
+                    media_start = parclock.nowNanos() - int(time_sig * 1000000000)
+                    self.seq_queue.put('beatgrid|{}|{}|{}'.format(ev.sequence, media_path, media_start))
+                self.begin_sync(ev.sequence)
         if media_path:
             print("On Start called with time signature " + str(time_sig) + " for media " + media_path)
         else:
             print("On Start called after pause at " + str(time_sig))
 
+    def begin_sync(self, sequence):
+        """Keeps the start time of the named sequence on the media clock while the music plays"""
+        self.end_sync()
+
+        def on_correction(start_ns):
+            self.seq_queue.put('sync|{}|{}'.format(sequence, start_ns))
+
+        self.sync = MediaSync(self.player, on_correction, self.sync_residual)
+        self.sync.start()
+
+    def end_sync(self):
+        """Stops correcting the running sequence"""
+        if self.sync is not None:
+            self.sync.end()
+            self.sync = None
+
     def show_paused(self):
         return self.paused_at > 0.0
@@ -0,0 +1,42 @@
+""" pytest setup: the modules under test live in the folder above.
+
+    The tests never drive hardware, so the parallel port library (pyparallel)
+    is replaced by a stub that writes nowhere, and VLC by fakevlc.  Both go
+    into sys.modules before any module under test imports them; the bundled
+    vlc.py also does not import on Python 3.11+ """
+
+import os
+import sys
+import types
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class Parallel(object):
+    """ Stand-in for parallel.Parallel: takes the data and drops it """
+
+    def __init__(self, *args, **kwargs):
+        self.data = 0
+
+    def setData(self, data):
+        self.data = data
+
+
+parallel = types.ModuleType("parallel")
+parallel.Parallel = Parallel
+sys.modules["parallel"] = parallel
+
+import fakevlc  # noqa: E402  (needs the path above)
+
+sys.modules["vlc"] = fakevlc
+import parclock  # noqa: E402
+
+
+@pytest.fixture
+def clock():
+    """ A SimulatedClock at 0 (Unix time 2023-11-14 22:13:20.250 UTC) in place of the real clock """
+    simulated = parclock.SimulatedClock(0, 1700000000250000000)
+    old_clock = parclock.setClock(simulated)
+    yield simulated
+    parclock.setClock(old_clock)
@@ -0,0 +1,85 @@
+""" ControlList.overlay() and overlay_many() against the copy, offset and resort they replace """
+
+import random
+import pytest
+import parclasses
+
+frames = parclasses.framesToNanos
+
+
+def rows(cl):
+    """ Every column of every event, in list order """
+    store = cl.events
+    return [tuple(getattr(store, name)[i] for name, code in store.columns) for i in range(len(store))]
+
+
+def randomList(rng, num_events, channel=0, shuffled=False):
+    """ A ControlList of num_events on a few frames (so times tie), some on channel 0 """
+    cl = parclasses.ControlList(channel=channel)
+    cl.events.clear()
+    times = sorted(rng.randint(0, 20) for i in range(num_events))
+    if shuffled:
+        rng.shuffle(times)
+    for n, t in enumerate(times):
+        cl.events.add(frames(t), frames(t), rng.randint(0, 2), rng.choice((0, 0, 1, 2, 3)), rng.randint(0, 1),
+                      frames(rng.randint(0, 5)), n, rng.randint(0, 3))
+    return cl
+
+
+def copyAndResort(cl, other, time_offset=0):
+    """ What overlay() did before it merged: copy, offset, append, stable sort """
+    other = parclasses.ControlList(other)
+    ofs = parclasses.TimeCode(time_offset)
+    if ofs.total_frames != 0:
+        other.offsetTime(ofs.total_frames)
+    cl.addEvents(other.events)
+    cl.sortEvents()
+
+
+@pytest.mark.parametrize("seed", range(6))
+def test_overlay_many_matches_overlay(seed):
+    rng = random.Random(seed)
+    defchannel = rng.choice((0, 7))
+    base = randomList(rng, 30, channel=defchannel)
+    lists = [(randomList(rng, rng.randint(0, 25), shuffled=seed % 2 == 1), rng.randint(-10, 10)) for i in range(5)]
+
+    merged = parclasses.ControlList(base)
+    merged.defchannel = defchannel
+    merged.overlay_many(lists)
+
+    one_by_one = parclasses.ControlList(base)
+    one_by_one.defchannel = defchannel
+    resorted = parclasses.ControlList(base)
+    resorted.defchannel = defchannel
+    for other, time_offset in lists:
+        one_by_one.overlay(other, time_offset)
+        copyAndResort(resorted, other, time_offset)
+
+    assert rows(merged) == rows(one_by_one) == rows(resorted)
+    assert merged.events.isSorted()
+
+
+def test_overlay_remaps_channel_zero():
+    cl = parclasses.ControlList(channel=9)
+    cl.events.clear()
+    other = parclasses.ControlList()
+    other.events.clear()
+    other.events.add(frames(1), frames(1), 0, 0, 1)
+    other.events.add(frames(2), frames(2), 0, 4, 1)
+    cl.overlay(other, -1)
+    assert [(ev.time.total_frames, ev.channel) for ev in cl.events] == [(0, 9), (1, 4)]
+    assert [ch for ch in other.events.channel] == [0, 4]  # the other list is not changed
+
+
+def test_existing_events_first_on_equal_times():
+    cl = parclasses.ControlList()
+    cl.events.clear()
+    cl.events.add(frames(5), frames(5), 0, 1, 1, value=1)
+    first = parclasses.ControlList()
+    first.events.clear()
+    first.events.add(frames(3), frames(3), 0, 2, 1, value=2)
+    second = parclasses.ControlList()
+    second.events.clear()
+    second.events.add(frames(8), frames(8), 0, 3, 1, value=3)
+    cl.overlay_many([(first, 2), (second, -3)])
+    assert [ev.value for ev in cl.events] == [1, 2, 3]
@@ -0,0 +1,95 @@
+""" ParaPlayer callbacks against the fake VLC backend """
+
+import threading
+import time
+import pytest
+import fakevlc
+import paraplayer
+import parclock
+
+LATE = 0.05  # seconds a callback may lag its VLC event or loop end (VLC reports every 0.25s)
+
+
+def newPlayer(**timing):
+    """ A ParaPlayer on a fakevlc Instance with the given timing, its media set """
+    para = paraplayer.ParaPlayer(fakevlc, fakevlc.Instance(**timing))
+    para.set_media("fake.wav")
+    return para
+
+
+@pytest.fixture
+def players():
+    made = []
+    yield made
+    for para in made:
+        para.kill()
+        para.join(2)
+
+
+def test_start_callback_waits_for_playing(players):
+    para = newPlayer(start_latency=0.2)
+    players.append(para)
+    started = []
+    done = threading.Event()
+
+    def onStart(media_path, ptime):
+        started.append(parclock.now())
+        done.set()
+
+    para.set_start_callback(onStart)
+    para.play()
+    assert not started  # VLC has not reported playing yet
+    assert done.wait(2)
+    playing_at = para.player.playing_at
+    assert playing_at is not None
+    assert 0 <= started[0] - playing_at < LATE
+    time.sleep(0.3)
+    assert len(started) == 1
+
+
+def test_finish_callback_on_end_reached(players):
+    para = newPlayer(media_length=0.3)
+    players.append(para)
+    finished = []
+    done = threading.Event()
+
+    def onFinish(media_path, ptime):
+        finished.append((parclock.now(), media_path, ptime))
+        done.set()
+
+    para.set_finish_callback(onFinish)
+    para.play()
+    assert done.wait(2)
+    ended_at = para.player.ended_at
+    assert ended_at is not None
+    when, media_path, ptime = finished[0]
+    assert 0 <= when - ended_at < LATE
+    assert media_path == "fake.wav"
+    assert ptime == pytest.approx(0.3, abs=0.01)
+    assert para.is_playing is False
+    time.sleep(0.2)
+    assert len(finished) == 1
+
+
+def test_loop_callback_near_loop_end(players):
+    loop_end = 0.4
+    para = newPlayer(time_period=0.25)  # VLC time changes far apart: the player must extrapolate
+    players.append(para)
+    vlc_player = para.player
+    loop_started = []
+    late = []
+    done = threading.Event()
+
+    def onLoop(media_path, ptime):
+        late.append(parclock.now() - loop_started[-1] - loop_end)
+        loop_started.append(vlc_player.base_clock)  # set_time() restarted the media clock
+        if len(late) == 3:
+            para.stop()
+            done.set()
+
+    para.set_start_callback(lambda media_path, ptime: loop_started.append(vlc_player.base_clock))
+    para.loop(0.0, loop_end, loop_callback_fn=onLoop)
+    assert done.wait(loop_end * 3 + 2)
+    assert len(late) == 3
+    for seconds in late:
+        assert -0.005 < seconds < LATE
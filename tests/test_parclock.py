@@ -0,0 +1,85 @@
+""" The clock source, and timing code run deterministically on a SimulatedClock """
+
+import time
+import fakevlc
+import parclasses
+import parclock
+
+NS = parclock.NS_PER_SECOND
+
+
+def test_wall_clock_round_trip():
+    real = parclock.Clock()
+    now = real.nowNanos()
+    assert real.clockNanos(real.wallNanos(now)) == now
+    assert abs(real.wallNanos() - time.time_ns()) < NS
+
+
+def test_simulated_clock_moves_only_when_told(clock):
+    assert parclock.nowNanos() == 0
+    parclock.sleep(0.5)
+    assert parclock.nowNanos() == NS // 2
+    clock.advance(nanos=7)
+    assert parclock.nowNanos() == NS // 2 + 7
+    clock.set(100)  # never backwards
+    assert parclock.nowNanos() == NS // 2 + 7
+    parclock.spinUntil(2 * NS)
+    assert parclock.now() == 2.0
+    assert parclock.waitSeconds(NS) == 0
+
+
+def test_set_clock_returns_the_old_clock(clock):
+    assert parclock.clock is clock
+    assert parclock.setClock(clock) is clock
+
+
+def test_wall_time_of_simulated_clock(clock):
+    clock.advance(1.5)
+    assert parclock.wallNanos() == 1700000001750000000
+    assert parclock.clockNanos(1700000000250000000) == 0
+    expected = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(1700000001)) + ".750"
+    assert parclock.timestamp() == expected
+
+
+def test_sequence_plays_on_simulated_clock(clock):
+    seq = parclasses.ControlList()
+    seq.events.clear()
+    seq.events.add(0, 0, 0, 3, 1)
+    seq.events.add(NS, NS, 0, 3, 0)
+    clock.advance(10.0)
+    seq.start()
+
+    first = seq.getNextByTime()
+    assert (first.channel, first.action) == (3, "on")
+    assert seq.getNextByTime() is False
+    clock.advance(0.999)
+    assert seq.getNextByTime() is False
+    clock.advance(0.001)
+    second = seq.getNextByTime()
+    assert (second.channel, second.action) == (3, "off")
+
+
+def test_recorder_records_from_clock_zero(clock, tmp_path, monkeypatch):
+    """ Recording that starts at clock time 0 is still recording """
+    monkeypatch.chdir(str(tmp_path))  # the recorder looks for ./recordings
+    recorder = parclasses.ValvePort_Recorder(backend=fakevlc)
+    recorder.set_media("song.wav", media_path=str(tmp_path) + "/")
+    assert recorder.current_time_in_frames() is False
+    recorder.execute()  # nothing recorded while not recording
+    layer = recorder.layers[recorder.current_layer]
+    before = len(layer.events)
+
+    recorder.on_start(None, 0.0)
+    assert recorder.recording_start == 0.0
+    recorder.setChannel(3, 1)
+    clock.advance(2.0)
+    recorder.execute()
+    assert [(ev.channel, ev.action, parclasses.nanosToFrames(ev.time.nanos)) for ev in layer.events][before:] == \
+        [(3, "on", 60)]
+
+    recorder.on_completion(None, 2.0)
+    assert recorder.recording_start is None
+    recorder.setChannel(3, 0)
+    recorder.execute()
+    assert len(layer.events) == before + 1
+    recorder.player.kill()
@@ -0,0 +1,131 @@
+""" ValvePort_Ethernet against the PuffServer stand-in, for each framing """
+
+import random
+import time
+import pytest
+import parclasses
+import puffserver
+
+
+def waitFor(test, timeout=2.0):
+    """ Polls test() until it is true or timeout seconds pass """
+    end = time.monotonic() + timeout
+    while not test():
+        if time.monotonic() > end:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def portState(port):
+    """ The port's on/off state as a list, index 0 = channel 1 """
+    mask = port.onMask()
+    return [mask >> i & 1 for i in range(port.num_channels)]
+
+
+@pytest.fixture
+def server(request):
+    capabilities = getattr(request, "param", ("bin", "bnx"))
+    server = puffserver.PuffServer(capabilities=capabilities).start()
+    yield server
+    server.stop()
+
+
+@pytest.mark.parametrize("framing, mode", [("chx", "chx"), ("bnx", "bnx"), ("bin", "bin"), ("auto", "bin")])
+def test_server_follows_port(server, framing, mode):
+    port = parclasses.ValvePort_Ethernet(24, 6, server.host, server.port, framing=framing)
+    try:
+        assert port.frame_mode == mode
+        port.execute()  # initial all-off
+        rng = random.Random(framing)
+        for step in range(50):
+            for ch in rng.sample(range(1, 25), rng.randint(1, 6)):
+                port.setChannel(ch, 1 - (port.onMask() >> (ch - 1) & 1))
+            changed = bin(port.changedMask()).count("1")
+            writes = port.writes
+            port.execute()
+            if mode == "chx":
+                assert port.writes - writes == changed
+            else:
+                assert port.writes - writes == 1
+            assert waitFor(lambda: server.state(24) == portState(port)), "step {0}".format(step)
+    finally:
+        port.close()
+
+
+@pytest.mark.parametrize("framing", ["bnx", "bin"])
+def test_one_write_per_execute(server, framing):
+    port = parclasses.ValvePort_Ethernet(24, 6, server.host, server.port, framing=framing)
+    try:
+        port.execute()  # initial all-off
+        assert waitFor(lambda: server.messages == 1)
+        writes = port.writes
+        for i in range(20):
+            for ch in range(1, 13):
+                port.setChannel(ch, (i + 1) % 2)
+            port.execute()
+        assert port.writes - writes == 20
+        assert waitFor(lambda: server.messages == 21)
+        assert server.state(24) == portState(port) == [0] * 24
+    finally:
+        port.close()
+
+
+@pytest.mark.parametrize("server", [()], indirect=True)
+def test_auto_falls_back_to_chx(server):
+    port = parclasses.ValvePort_Ethernet(24, 6, server.host, server.port, framing="auto")
+    try:
+        assert port.frame_mode == "chx"
+        port.execute()  # initial all-off, one message per channel
+        assert port.writes == 24
+        for ch in (1, 5, 24):
+            port.setChannel(ch, 1)
+        port.execute()
+        assert port.writes == 27
+        assert waitFor(lambda: server.state(24) == portState(port))
+    finally:
+        port.close()
+
+
+def test_post_keeps_full_flag_of_dropped_state(server):
+    port = parclasses.ValvePort_Ethernet(24, 6, server.host, server.port, framing="bin", threaded=True,
+                                         queue_size=2)
+    port.close()  # no writer, so posts stay queued
+    port.post(1, full=True)
+    port.post(2)
+    port.post(3)
+    assert port.dropped == 1
+    assert [item[:2] for item in (port.out_q.get_nowait(), port.out_q.get_nowait())] == [(2, False), (3, True)]
+
+
+def test_writer_reconnects_to_restarted_server(server):
+    port = parclasses.ValvePort_Ethernet(24, 6, server.host, server.port, framing="bin", threaded=True)
+    rng = random.Random(11)
+
+    def change():
+        for ch in rng.sample(range(1, 25), 4):
+            port.setChannel(ch, 1 - (port.onMask() >> (ch - 1) & 1))
+        port.execute()
+
+    try:
+        for i in range(10):
+            change()
+        assert waitFor(lambda: server.state(24) == portState(port))
+        assert port.connects == 1
+
+        server.stop()
+        for i in range(30):  # the link breaks and the writer backs off
+            change()
+            time.sleep(0.01)
+        restarted = puffserver.PuffServer(port=server.port).start()
+        try:
+            for i in range(5):
+                change()
+            assert waitFor(lambda: restarted.state(24) == portState(port), timeout=5.0)
+            assert port.connects >= 2
+            assert port.collapsed > 0  # states posted while down were folded into one
+            assert restarted.messages < 35
+        finally:
+            restarted.stop()
+    finally:
+        port.close()
@@ -0,0 +1,70 @@
+""" ControlList.reconcile(): levels combined into level 0 events, by the sweep and by NumPy """
+
+import random
+import pytest
+import parclasses
+
+frames = parclasses.framesToNanos
+ON = parclasses.EventStore.actionCode("on")
+OFF = parclasses.EventStore.actionCode("off")
+
+
+def rows(seq):
+    store = seq.events
+    return [(store.time[i], store.level[i], store.channel[i], store.action[i], store.value[i])
+            for i in range(len(store))]
+
+
+def mixedList(num_events, seed):
+    """ Events on levels 0 to 3, with pixel values, added out of time order """
+    rand = random.Random(seed)
+    seq = parclasses.ControlList()
+    seq.events.clear()
+    events = [(frames(rand.randint(0, 3000)), rand.randint(0, 3), rand.randint(1, 18), rand.choice((ON, OFF)),
+               rand.randint(1, 255)) for i in range(num_events)]
+    rand.shuffle(events)
+    for time_ns, level, channel, action, value in events:
+        seq.events.add(time_ns, time_ns, level, channel, action, 0, value)
+    return seq
+
+
+def test_two_levels():
+    seq = parclasses.ControlList()
+    seq.events.clear()
+    seq.events.add(frames(20), frames(20), 1, 5, OFF, 0, 9)
+    seq.events.add(frames(10), frames(10), 2, 5, ON, 0, 9)
+    seq.events.add(0, 0, 1, 5, ON, 0, 9)
+    for use_numpy in (False, True):
+        if use_numpy:
+            pytest.importorskip("numpy")
+        result = seq.reconcile(use_numpy=use_numpy)
+        # on once both levels are, off when either goes
+        assert rows(result) == [(frames(10), 0, 5, ON, 0), (frames(20), 0, 5, OFF, 0)]
+
+
+@pytest.mark.parametrize("num_events", [500, parclasses.reconcile_numpy_min + 1000])
+def test_sweep_and_numpy_agree(num_events):
+    pytest.importorskip("numpy")
+    seq = mixedList(num_events, num_events)
+    kept = sorted((row for row in rows(seq) if row[1] == 0), key=lambda row: row[0])
+
+    swept = rows(seq.reconcile(use_numpy=False))
+    assert rows(seq.reconcile(use_numpy=True)) == swept
+
+    assert all(row[1] == 0 for row in swept)
+    assert [row[0] for row in swept] == sorted(row[0] for row in swept)
+    # the level 0 events that were there keep their values; the generated ones have value 0
+    generated = list(swept)
+    for row in kept:
+        generated.remove(row)
+    assert len(generated) == len(swept) - len(kept) > 0
+    assert all(row[4] == 0 for row in generated)
+
+
+def test_existing_events_first_on_equal_times():
+    seq = parclasses.ControlList()
+    seq.events.clear()
+    seq.events.add(0, 0, 1, 4, ON)
+    seq.events.add(0, 0, 0, 7, ON, 0, 3)
+    result = seq.reconcile(use_numpy=False)
+    assert rows(result) == [(0, 0, 7, ON, 3), (0, 0, 4, ON, 0)]
@@ -0,0 +1,109 @@
+""" Round trips through the binary .seqb format: .seqx -> seqconvert -> .seqb -> ControlList """
+
+import os
+import random
+import parclasses
+import seqconvert
+
+
+def makeSequence(num_events=500):
+    """ A ControlList with every header value set and events on several levels """
+    rand = random.Random(6)
+    seq = parclasses.ControlList()
+    seq.name = "round trip"
+    seq.deflevel = 2
+    seq.defchannel = 5
+    seq.looping = True
+    seq.scale_factor = 1.25
+    seq.scale_pending = True
+    seq.ref_beat_period.setTime(0.5)
+    seq.ref_first_beat.setTime(0.25)
+    seq.beat_period.setTime(0.4)
+    seq.first_beat.setTime(0.2)
+    frame_ns = parclasses.framesToNanos(1)
+    start = 0
+    for i in range(num_events):
+        start += rand.randint(0, 3) * frame_ns
+        seq.events.add(start, start, rand.randint(0, 3), rand.randint(1, 18), rand.randint(0, 2),
+                       rand.randint(0, 5) * frame_ns, rand.randint(0, 255), rand.randint(0, 4))
+    return seq
+
+
+def header(seq):
+    return (seq.deflevel, seq.defchannel, seq.name, seq.looping, seq.scale_factor, seq.scale_pending,
+            seq.ref_beat_period.nanos, seq.ref_first_beat.nanos, seq.beat_period.nanos, seq.first_beat.nanos)
+
+
+def assertSameEvents(first, second):
+    assert len(first.events) == len(second.events)
+    for name, code in parclasses.EventStore.columns:
+        assert list(getattr(first.events, name)) == list(getattr(second.events, name)), name
+
+
+def convertedPair(tmp_path):
+    """ Saves makeSequence() as .seqx, converts it; returns (.seqx list, .seqb list, .seqb path) """
+    seqx_path = str(tmp_path / "sequence.seqx")
+    makeSequence().saveXML(seqx_path)
+    seqb_path = seqconvert.convert(seqx_path)
+    return parclasses.ControlList(seqx_path), parclasses.ControlList(seqb_path), seqb_path
+
+
+def test_round_trip(tmp_path):
+    source, binary, seqb_path = convertedPair(tmp_path)
+    assert seqb_path == str(tmp_path / "sequence.seqb")
+    assert binary.events.mapping is not None  # loaded without a copy
+    assert header(binary) == header(source)
+    assertSameEvents(binary, source)
+    binary.close()
+
+
+def test_round_trip_new_list(tmp_path):
+    seqx_path = str(tmp_path / "new.seqx")
+    parclasses.ControlList().saveXML(seqx_path)
+    binary = parclasses.ControlList(seqconvert.convert(seqx_path))
+    source = parclasses.ControlList(seqx_path)
+    assert header(binary) == header(source)
+    assertSameEvents(binary, source)
+    binary.close()
+
+
+def test_convert_folder(tmp_path):
+    os.mkdir(str(tmp_path / "bank"))
+    for name in ("one", "two", os.path.join("bank", "three")):
+        makeSequence(50).saveXML(str(tmp_path / (name + ".seqx")))
+    assert seqconvert.convertFolder(str(tmp_path)) == 3
+    for name in ("one", "two", os.path.join("bank", "three")):
+        assert os.path.exists(str(tmp_path / (name + ".seqb")))
+
+
+def test_edit_mapped_store(tmp_path):
+    source, binary, seqb_path = convertedPair(tmp_path)
+    store = binary.events
+
+    # writing into a mapped column changes the list, not the file
+    store.channel[0] = 24
+    store.changed()
+    assert store.channel[0] == 24
+    reread = parclasses.ControlList(seqb_path)
+    assert reread.events.channel[0] == source.events.channel[0]
+    reread.close()
+
+    # growing the store copies it out of the file
+    store.add(store.time[-1], store.ref_time[-1], 0, 7, 1)
+    assert store.mapping is None
+    assert len(store) == len(source.events) + 1
+    assert store.channel[0] == 24 and store.channel[-1] == 7
+    assert list(store.time[1:-1]) == list(source.events.time[1:])
+
+    # and the file still reads back as it was written
+    reread = parclasses.ControlList(seqb_path)
+    assertSameEvents(reread, source)
+    reread.close()
+
+
+def test_close_releases_file(tmp_path):
+    source, binary, seqb_path = convertedPair(tmp_path)
+    binary.close()
+    assert binary.events.mapping is None
+    os.remove(seqb_path)  # an open mapping would block this on Windows
+    assertSameEvents(binary, source)
@@ -0,0 +1,81 @@
+""" GraphicImport: the NumPy array path gives the same sequence as the pixel loops """
+
+import random
+import pytest
+import parclasses
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+import sequenceimport  # noqa: E402  (needs PIL)
+
+SPACING = 10
+CHANNELS = 8
+BEAT_X = (CHANNELS + 2) * SPACING
+LINES = 600
+
+
+def writeImage(path, seed):
+    """ A JPEG of blocky channel bands sampled at x = (channel + 1) * SPACING: each
+        band is light, dark or mid grey (inside the hysteresis) for runs of
+        lines, in each colour plane on its own, with a beat stripe every 24 lines """
+    rand = random.Random(seed)
+    pixels = np.zeros((LINES, BEAT_X + SPACING, 3), dtype=np.uint8)
+    for colx in range(CHANNELS):
+        x = (colx + 1) * SPACING
+        for plane in range(3):
+            line = 0
+            while line < LINES:
+                run = rand.randint(8, 40)
+                pixels[line:line + run, x - 4:x + 4, plane] = rand.choice((20, 135, 240))
+                line += run
+    for line in range(10, LINES, 24):
+        pixels[line:line + 6, BEAT_X - 4:BEAT_X + 4, :] = 255
+    Image.fromarray(pixels).save(path, "JPEG", quality=90)
+
+
+def rows(seq):
+    store = seq.events
+    return [(store.time[i], store.ref_time[i], store.level[i], store.channel[i], store.action[i],
+             store.value[i]) for i in range(len(store))]
+
+
+def sameSequence(array_seq, loop_seq):
+    assert rows(array_seq) == rows(loop_seq)
+    assert array_seq.name == loop_seq.name
+    for attr in ("beat_period", "ref_beat_period", "first_beat", "ref_first_beat"):
+        assert getattr(array_seq, attr).nanos == getattr(loop_seq, attr).nanos, attr
+
+
+def channelMap():
+    """ Swaps channels 1 and 3; channel 4 maps past the imported channels, which ends the import there """
+    mapping = parclasses.ChannelMap(24)
+    mapping.addMapping(1, 3)
+    mapping.addMapping(3, 1)
+    mapping.addMapping(4, 12)
+    return mapping
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+@pytest.mark.parametrize("mapped", [False, True])
+def test_import_sequence(tmp_path, seed, mapped):
+    path = str(tmp_path / "blocks.jpg")
+    writeImage(path, seed)
+    importer = sequenceimport.GraphicImport()
+    results = [importer.import_sequence(path, CHANNELS, SPACING, BEAT_X, channelMap() if mapped else None,
+                                        use_numpy=use_numpy) for use_numpy in (True, False)]
+    sameSequence(*results)
+    assert len(results[0].events) > 20
+    assert results[0].ref_beat_period.nanos > 0
+    if mapped:
+        assert set(results[0].events.channel) <= {0, 1, 2, 3}
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_import_triple(tmp_path, seed):
+    path = str(tmp_path / "blocks.jpg")
+    writeImage(path, seed)
+    importer = sequenceimport.GraphicImport()
+    results = [importer.import_triple(path, CHANNELS * 3, SPACING, use_numpy=use_numpy)
+               for use_numpy in (True, False)]
+    sameSequence(*results)
+    assert len(results[0].events) > 20
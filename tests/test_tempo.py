@@ -0,0 +1,112 @@
+""" Live tempo changes: ControlList.scale() through the TempoMap, on a SimulatedClock """
+
+import parclasses
+import parclock
+
+NS = 1000000000
+STEP = NS // 10  # events every 100 ms of reference time
+
+
+def pulses(count=100):
+    """ A list turning channel 1 on and off every STEP: event i at reference time i * STEP """
+    seq = parclasses.ControlList()
+    seq.events.clear()
+    for i in range(count):
+        seq.events.add(i * STEP, i * STEP, 0, 1, 1 - i % 2)
+    return seq
+
+
+def drain(seq):
+    """ The events due now, as reference times """
+    due = []
+    ev = seq.getNextByTime()
+    while isinstance(ev, parclasses.ControlEvent):
+        due.append(ev.ref_time.nanos)
+        ev = seq.getNextByTime()
+    return due
+
+
+def position(seq):
+    """ Reference time the list has played to """
+    return seq.tempo.refAt(parclock.nowNanos() - seq.start_time.nanos)
+
+
+def test_scale_mid_sequence_does_not_jump(clock):
+    seq = pulses()
+    seq.start()
+    clock.advance(2.55)
+    assert drain(seq)[-1] == 25 * STEP
+    before = position(seq)
+
+    seq.scale(2.0)
+    assert position(seq) == before
+    assert drain(seq) == []  # nothing fell due because of the change
+    clock.advance(0.05 * 2 - 0.001)  # 26 * STEP is 50 ms of reference time away: 100 ms at half speed
+    assert drain(seq) == []
+    clock.advance(0.001)
+    assert drain(seq) == [26 * STEP]
+
+
+def test_events_fire_at_tempo_wall_time(clock):
+    seq = pulses()
+    seq.start()
+    clock.advance(1.23)
+    drain(seq)
+    seq.scale(1.5)
+    start = seq.start_time.nanos
+    for i in range(13, 100):
+        due = start + seq.tempo.wallAt(i * STEP)
+        clock.set(due - 1)
+        assert drain(seq) == []
+        clock.set(due)
+        assert drain(seq) == [i * STEP]
+    assert seq.running() is False and seq.eof is True
+
+
+def test_played_time_is_tempo_wall_time(clock):
+    seq = pulses()
+    seq.start()
+    clock.advance(0.5)
+    drain(seq)
+    seq.scale(0.5)
+    clock.advance(1.0)
+    ev = seq.getNextByTime()
+    assert ev.time.nanos == seq.tempo.wallAt(ev.ref_time.nanos)
+
+
+def test_ramp_reaches_target_at_end(clock):
+    seq = pulses()
+    seq.start()
+    clock.advance(1.0)
+    drain(seq)
+    seq.scale(2.0, ramp=0.8)
+    tempo = seq.tempo
+    ramp_start = NS
+    ramp_end = NS + 8 * STEP
+
+    assert tempo.scaleFactor() == 2.0
+    assert tempo.wall[-1] == ramp_end
+    assert tempo.scales[-1] == tempo.fixed(2.0)
+    # from the end on a reference ns takes 2 ns of playback, during the ramp between 1 and 2
+    assert tempo.refAt(ramp_end + NS) - tempo.refAt(ramp_end) == NS // 2
+    ramped = tempo.refAt(ramp_end) - tempo.refAt(ramp_start)
+    assert 8 * STEP // 2 < ramped < 8 * STEP
+    # events keep playing through the ramp at the times the map gives them
+    for i in range(11, 40):
+        due = seq.start_time.nanos + tempo.wallAt(i * STEP)
+        clock.set(due)
+        assert drain(seq) == [i * STEP]
+
+
+def test_scale_stopped_then_start(clock):
+    seq = pulses(20)
+    seq.scale(0.5)
+    assert seq.running() is False
+    seq.start()
+    assert drain(seq) == [0]
+    clock.advance(0.05 - 1e-9)  # STEP at double speed
+    assert drain(seq) == []
+    clock.advance(1e-9)
+    assert drain(seq) == [STEP]
+    clock.advance(0.05 * 18)
+    assert drain(seq) == [i * STEP for i in range(2, 20)]
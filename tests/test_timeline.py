@@ -0,0 +1,127 @@
+""" The compiled playback Timeline: seeking, due batches, out of order events and streamed growth """
+
+import random
+import parclasses
+
+NS = 1000000000
+frames = parclasses.framesToNanos
+
+
+def randomList(num_events, seed, ties=True):
+    """ A sorted list of on/off events on random channels, with many events sharing a time """
+    rand = random.Random(seed)
+    seq = parclasses.ControlList()
+    seq.events.clear()
+    frame = 0
+    for i in range(num_events):
+        frame += rand.randint(0, 2) if ties else rand.randint(1, 3)
+        seq.events.add(frames(frame), frames(frame), 0, rand.randint(1, 18), rand.randint(0, 1))
+    return seq
+
+
+def drain(seq):
+    """ The events due now, as (ref_time, channel) """
+    due = []
+    ev = seq.getNextByTime()
+    while isinstance(ev, parclasses.ControlEvent):
+        due.append((ev.ref_time.nanos, ev.channel))
+        ev = seq.getNextByTime()
+    return due
+
+
+def test_index_at_frame_matches_linear_scan():
+    seq = randomList(400, 1)
+    store = seq.events
+    timeline = seq.timeline()
+    last = parclasses.nanosToFrames(store.ref_time[-1])
+    for frame in range(-1, last + 3):
+        expected = next((i for i in range(len(store))
+                         if parclasses.nanosToFrames(store.ref_time[i]) >= frame), len(store))
+        assert timeline.indexAtFrame(frame) == expected, frame
+
+
+def test_get_event_at_time_matches_linear_scan():
+    seq = randomList(200, 2)
+    store = seq.events
+    for frame in range(0, parclasses.nanosToFrames(store.ref_time[-1]) + 2, 3):
+        expected = next((i for i in range(len(store)) if store.ref_time[i] >= frames(frame)), None)
+        ev = seq.getEventAtTime(frame / parclasses.FRAMES_PER_SECOND)
+        if expected is None:
+            assert ev is None
+        else:
+            assert seq.next_event == expected
+            assert (ev.ref_time.nanos, ev.channel) == (store.ref_time[expected], store.channel[expected])
+
+
+def test_events_sharing_a_time_come_out_together(clock):
+    seq = parclasses.ControlList()
+    seq.events.clear()
+    seq.events.add(0, 0, 0, 1, 1)
+    for channel in (4, 2, 9):
+        seq.events.add(NS, NS, 0, channel, 1)
+    seq.events.add(2 * NS, 2 * NS, 0, 4, 0)
+    seq.start()
+    assert drain(seq) == [(0, 1)]
+    clock.set(NS - 1)
+    assert drain(seq) == []
+    clock.set(NS)
+    assert drain(seq) == [(NS, 4), (NS, 2), (NS, 9)]  # list order
+    assert seq.nextDueTime() == seq.start_time.nanos + 2 * NS
+
+
+def test_out_of_order_event_falls_due_with_the_one_before(clock):
+    seq = parclasses.ControlList()
+    seq.events.clear()
+    for time_ns, channel in ((0, 1), (2 * NS, 2), (NS, 3), (3 * NS, 4)):
+        seq.events.add(time_ns, time_ns, 0, channel, 0)  # offs, so no cleanup events at the end
+    timeline = seq.timeline()
+    assert list(timeline.due) == [0, 2 * NS, 3 * NS]
+    assert list(timeline.first) == [0, 1, 3, 4]
+
+    seq.start()
+    assert drain(seq) == [(0, 1)]
+    clock.set(3 * NS // 2)
+    assert drain(seq) == []  # the 1 s event waits for the 2 s one
+    clock.set(2 * NS)
+    assert drain(seq) == [(2 * NS, 2), (NS, 3)]
+    clock.set(3 * NS)
+    assert drain(seq) == [(3 * NS, 4)]
+
+
+def assertSameSteps(grown, fresh):
+    assert list(grown.due) == list(fresh.due)
+    assert list(grown.first) == list(fresh.first)
+    assert list(grown.frames) == list(fresh.frames)
+    assert grown.on_masks == fresh.on_masks
+    assert grown.off_masks == fresh.off_masks
+    assert grown.count == fresh.count
+
+
+def test_streamed_timeline_matches_fresh_compile():
+    source = randomList(5000, 3).events
+    # an out of order event, and a batch boundary inside a run of equal times
+    source.ref_time[2000] = source.ref_time[1990]
+    source.ref_time[2999] = source.ref_time[3000]
+    source.changed()
+
+    seq = parclasses.ControlList()
+    seq.events.clear()
+    store = seq.events
+    compiled = seq.timeline()
+    for start in range(0, len(source), 1000):
+        batch = parclasses.EventStore()
+        for i in range(start, min(start + 1000, len(source))):
+            batch.add(source.time[i], source.ref_time[i], 0, source.channel[i], source.action[i])
+        store.extend(batch)
+        assert store.grownFrom(compiled.version)
+        assert seq.timeline() is compiled  # grown, not compiled again
+        assertSameSteps(compiled, parclasses.Timeline(store))
+
+
+def test_edit_compiles_again():
+    seq = randomList(100, 4)
+    compiled = seq.timeline()
+    seq.events.channel[0] = 5
+    seq.events.changed()
+    assert not seq.events.grownFrom(compiled.version)
+    assert seq.timeline() is not compiled